@@ -1,41 +1,63 @@
+import time
+
+startup_begin = time.perf_counter()
+
+import gc
 import os
 import re
+import sys
 import json
 import yaml
 import random
-import requests
+import signal
 import asyncio
 import chatango
 import unicodedata
 import logging
 import logging.config
-from bs4 import BeautifulSoup, Tag
-from pytz import timezone
-from calendar import timegm
-from datetime import datetime, timedelta
-from time import gmtime
-from youtube_search import YoutubeSearch
+from datetime import datetime
 from urllib.parse import urlparse, urlunparse, parse_qs
 from collections import deque
 from asyncio import to_thread
 from dotenv import load_dotenv
 
 load_dotenv()
-import anthropic
-import kekg
-import kodi
-import kraft
-import daddy
-import tvpass
-import wolfram
-from imdb import imdb_info_by_id, imdb_info_by_search, imdb_printout
-from claude import (
-    LLMClient,
-    format_chat_history,
-    format_response_for_html,
-    check_model_refusal,
-    SYSTEM_PROMPTS,
+import chatlog
+import fetch
+import plugins
+import metrics
+from plugins import lazy, lazy_module
+from imdb import imdb_info_by_id_cached, imdb_info_by_search_cached, imdb_printout
+from router import Router, MessageContext
+import cache
+from cache import TTLCache
+from sendqueue import (
+    SendQueue,
+    TokenBucket,
+    chunk_message,
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    PRIORITY_BULK,
+    SEND_MARGIN,
 )
+from banned import BannedWords
+from stash import StashIndex
+from watcher import FileWatcher
+from history import RoomHistory
+import logindex
+import supervisor
+import scheduler
+from governor import Governor, ALLOWED, DROPPED
+
+plugins.timings.append(("core imports", time.perf_counter() - startup_begin))
+
+# Heavy integrations are imported the first time a command needs them
+anthropic = lazy_module("anthropic")
+bs4 = lazy_module("bs4")
+claude = lazy_module("claude")
+wolfram = lazy_module("wolfram")
+kekg = lazy_module("kekg")
+YoutubeSearch = metrics.instrument("youtube")(lazy("youtube_search", "YoutubeSearch"))
 
 
 class LowercaseFormatter(logging.Formatter):
@@ -76,36 +98,38 @@ def random_selection(list):
     return list[random.randint(0, len(list) - 1)]
 
 
-def log(room_name, sub, message):
-    if sub:
-        filename = "{0}_{1}.log".format(room_name, sub)
-    else:
-        filename = "{0}.log".format(room_name)
+# Logs not tied to a room, supervisor workers each write their own copy
+# (status_w1.log) so no two processes append to and rotate the same file.
+# Workers add the bot's name, its mentions log is written by all of them
+SHARED_LOGS = {"status", "errors", "flood", "bans"}
 
-    time_str = "{:%Y-%m-%d %H:%M:%S}".format(datetime.now(timezone("America/Denver")))
 
-    with open(cwd + "/logs/" + filename, "a") as logfile:
-        logfile.write("[{0}] {1}\n".format(time_str, message))
+def log(room_name, sub, message):
+    if shard is not None and sub is None and room_name in SHARED_LOGS:
+        sub = "w{}".format(shard.index)
+    chatlog.logger.write(room_name, sub, message)
 
 
 def logError(room_name, sub, message_body, e):
+    metrics.logged_errors.inc(sub)
     log("errors", None, "[{}] [{}] {}".format(room_name, sub, message_body))
     log("errors", None, "[{}] [{}] {}".format(room_name, sub, repr(e)))
 
 
-memes = {}
-for filename in os.listdir(cwd):
-    if filename[-10:] == "_memes.txt":
-        meme_type = filename[:-10]
-        memes[meme_type] = [line.rstrip("\n") for line in open(cwd + "/" + filename)]
+with plugins.timed("load rooms.yaml"):
+    with open(cwd + "/rooms.yaml", "r") as roomsyaml:
+        chat = yaml.safe_load(roomsyaml)
 
-with open(cwd + "/rooms.yaml", "r") as roomsyaml:
-    chat = yaml.safe_load(roomsyaml)
-
-with open(cwd + "/stash_memes.json", "r") as stashjson:
-    stash_memes = json.load(stashjson)
-
-stash_tuples = [(k, v) for k, v in stash_memes.items()]
+# Filled in by load_memes() once the bot is up
+memes = {}
+stash_memes = {}
+stash_index = StashIndex({})
+banned_words = None
+# Set once the log index is open
+log_index = None
+# supervisor.Link when running as a supervisor worker
+shard = None
+memes_loaded = asyncio.Event()
 
 link_re = re.compile(r"https?://\S+")
 yt_re = re.compile(
@@ -114,6 +138,30 @@ yt_re = re.compile(
 imdb_re = re.compile(r"(?:.*\.|.*)imdb.com/(?:t|T)itle(?:\?|/)(..\d+)")
 twitter_re = re.compile(r"(twitter|x).com/[a-zA-Z0-9_]+/status/([0-9]+)", re.IGNORECASE)
 clean_tag_re = re.compile("<.*?>")
+# 9pm, 9:30pm, 21:30
+clock_re = re.compile(r"^(\d{1,2})(?::(\d\d))?\s*(am|pm)?$")
+
+
+def parse_clock(text):
+    """(hour, minute) for 9pm, 9:30pm or 21:30, None if it's no time of day"""
+    clock = clock_re.match(text.strip().lower())
+    if not clock:
+        return None
+    hour, minute, ampm = clock.groups()
+    hour, minute = int(hour), int(minute or 0)
+    if minute > 59:
+        return None
+    if ampm:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if ampm == "pm" else 0)
+    elif 1 <= hour <= 11:
+        # Nobody asks what movies are on at 9 in the morning
+        hour += 12
+    elif hour > 23:
+        return None
+    return hour, minute
+
 
 LEET_MAP = str.maketrans(
     {
@@ -130,13 +178,8 @@ LEET_MAP = str.maketrans(
 )
 
 
-def room_history(room, max_messages: int = 20) -> list[chatango.Message]:
-    return [
-        msg
-        for msg in list(reversed(room.history))[:max_messages]
-        if chatango.MessageFlags.CHANNEL_MOD not in msg.flags
-        and "WWWWWW" not in msg.body
-    ]
+# Characters of chat sent with a mention, unset keeps the last 15 messages
+LLM_CONTEXT_CHARS = int(os.environ.get("LLM_CONTEXT_CHARS", 0)) or None
 
 
 def render_history(history, max_length=999):
@@ -161,118 +204,301 @@ roger_messages = [
     "What do you need?",
 ]
 
-simple_memes: dict[str, str] = {
-    "!whatson": "https://guide.lmao.love/",
-    "!daddy": "https://guide.lmao.love/daddy",
-    "!tvpass": "https://guide.lmao.love/tvpass",
-    "!jameis": stash_memes["/jameis"],
-    "!winston": stash_memes["/jameis"],
-    "!phins": stash_memes["/phins"],
-    "!spike": stash_memes["/1smoke"],
-    "pika": stash_memes["/pikaa"],
-    "devil?": stash_memes["/devil?"],
-    "go2bed": stash_memes["/go2bed"],
-    "gil2bed": stash_memes["/gil2bed"],
-}
 
-random_memes: dict[str, list[str]] = {
-    "lmao?": roger_messages,
-    "clam": memes["clam"],
-    "lmoa": memes["lmoa"],
-    "maga": memes["trump"],
-    "biden": memes["biden"],
-    "tyson": memes["tyson"],
-    "propaganda": memes["korea"],
-    "xmas": memes["santa"],
-    "christmas": memes["santa"],
-    "shkreli": memes["shkreli"],
-    "jumanji": memes["jumanji"],
-    "ronaldo": memes["ronaldo"],
-    "rolando": memes["ronaldo"],
-    "penaldo": memes["ronaldo"],
-    "milady": memes["milady"],
-    "dance": memes["dance"],
-    "hippo": memes["hippo"],
-    "!wo": memes["wo"],
-    "henlo": ["BAZOO!!!", "HOOOOOOOOOO"],
-}
+def meme_commands(memes, stash_memes):
+    """Build the simple/random meme tables and the regex that finds them"""
+    simple_memes: dict[str, str] = {
+        "!whatson": "https://guide.lmao.love/",
+        "!daddy": "https://guide.lmao.love/daddy",
+        "!tvpass": "https://guide.lmao.love/tvpass",
+        "!jameis": stash_memes["/jameis"],
+        "!winston": stash_memes["/jameis"],
+        "!phins": stash_memes["/phins"],
+        "!spike": stash_memes["/1smoke"],
+        "pika": stash_memes["/pikaa"],
+        "devil?": stash_memes["/devil?"],
+        "go2bed": stash_memes["/go2bed"],
+        "gil2bed": stash_memes["/gil2bed"],
+    }
+
+    random_memes: dict[str, list[str]] = {
+        "lmao?": roger_messages,
+        "clam": memes["clam"],
+        "lmoa": memes["lmoa"],
+        "maga": memes["trump"],
+        "biden": memes["biden"],
+        "tyson": memes["tyson"],
+        "propaganda": memes["korea"],
+        "xmas": memes["santa"],
+        "christmas": memes["santa"],
+        "shkreli": memes["shkreli"],
+        "jumanji": memes["jumanji"],
+        "ronaldo": memes["ronaldo"],
+        "rolando": memes["ronaldo"],
+        "penaldo": memes["ronaldo"],
+        "milady": memes["milady"],
+        "dance": memes["dance"],
+        "hippo": memes["hippo"],
+        "!wo": memes["wo"],
+        "henlo": ["BAZOO!!!", "HOOOOOOOOOO"],
+    }
+    meme_cmds = "|".join(
+        re.escape(cmd) for cmd in list(simple_memes.keys()) + list(random_memes.keys())
+    )
+    command_re = re.compile(
+        r"\/[^\s]*|stash|ay+ lmao|" + meme_cmds, flags=re.IGNORECASE
+    )
+    return simple_memes, random_memes, command_re
+
+
+simple_memes = {}
+random_memes = {}
+command_re = re.compile(r"\/[^\s]*|stash|ay+ lmao", flags=re.IGNORECASE)
+
+
+def parse_meme_file(filename):
+    with open(cwd + "/" + filename) as meme_file:
+        return [line.rstrip("\n") for line in meme_file]
+
+
+def parse_stash():
+    with open(cwd + "/stash_memes.json", "r") as stashjson:
+        return json.load(stashjson)
+
+
+def load_memes():
+    """Parse every meme file, runs in a thread so rooms connect first"""
+    global memes, stash_memes, stash_index, banned_words
+    global simple_memes, random_memes, command_re
+
+    new_memes = {}
+    for filename in sorted(os.listdir(cwd)):
+        if filename[-10:] == "_memes.txt":
+            meme_type = filename[:-10]
+            with plugins.timed("load " + filename):
+                new_memes[meme_type] = parse_meme_file(filename)
+
+    with plugins.timed("load stash_memes.json"):
+        new_stash = parse_stash()
+
+    with plugins.timed("build stash index"):
+        new_index = StashIndex(new_stash)
+
+    with plugins.timed("build banned words"):
+        new_banned = BannedWords(cwd + "/banned_memes.txt")
+
+    memes = new_memes
+    stash_memes = new_stash
+    stash_index = new_index
+    banned_words = new_banned
+    simple_memes, random_memes, command_re = meme_commands(new_memes, new_stash)
+
+
+async def hot_reload(filename, parse, apply):
+    """Parse off the loop and swap in on it, keep the old data if anything fails"""
+    start = time.perf_counter()
+    try:
+        parsed = await to_thread(parse)
+        apply(parsed)
+    except Exception as e:
+        logError("reload", filename, "kept previous version", e)
+        return
+    log(
+        "status",
+        None,
+        "[reload] {} in {:.0f} ms".format(
+            filename, (time.perf_counter() - start) * 1000
+        ),
+    )
+
+
+async def reload_meme_file(filename):
+    meme_type = filename[:-10]
+
+    def parse():
+        new_memes = dict(memes)
+        new_memes[meme_type] = parse_meme_file(filename)
+        if meme_type == "banned":
+            new_banned = BannedWords(cwd + "/" + filename)
+        else:
+            new_banned = banned_words
+        return new_memes, new_banned, meme_commands(new_memes, stash_memes)
+
+    def apply(parsed):
+        global memes, banned_words, simple_memes, random_memes, command_re
+        memes, banned_words, (simple_memes, random_memes, command_re) = parsed
+
+    await hot_reload(filename, parse, apply)
+
+
+async def reload_stash(filename):
+    def parse():
+        new_stash = parse_stash()
+        return new_stash, StashIndex(new_stash), meme_commands(memes, new_stash)
+
+    def apply(parsed):
+        global stash_memes, stash_index, simple_memes, random_memes, command_re
+        stash_memes, stash_index, (simple_memes, random_memes, command_re) = parsed
+
+    await hot_reload(filename, parse, apply)
+
+
+async def reload_rooms(filename):
+    def parse():
+        with open(cwd + "/rooms.yaml", "r") as roomsyaml:
+            return yaml.safe_load(roomsyaml)
+
+    def apply(new_chat):
+        global chat
+        router.build(new_chat)
+        anon_router.build(new_chat)
+        chat = new_chat
+
+    await hot_reload(filename, parse, apply)
+
+
+async def reload_kekg_config(filename):
+    def parse():
+        # Not imported yet means they'll read the new file when they are
+        for name in ["kekg", "kodi"]:
+            if lazy_module(name).loaded:
+                lazy_module(name).reload_config()
+
+    await hot_reload(filename, parse, lambda _: None)
+
+
+def parse_schedule():
+    with open(cwd + "/schedule.yaml", "r") as scheduleyaml:
+        jobs = scheduler.parse_schedule(yaml.safe_load(scheduleyaml))
+    for job in jobs:
+        if job.action not in scheduled_actions:
+            raise ValueError("{}: unknown action {}".format(job.name, job.action))
+    return jobs
+
+
+async def reload_schedule(filename):
+    await hot_reload(filename, parse_schedule, schedule.load)
+
+
+watcher = FileWatcher(cwd)
+watcher.watch_suffix("_memes.txt", reload_meme_file)
+watcher.watch("stash_memes.json", reload_stash)
+watcher.watch("rooms.yaml", reload_rooms)
+watcher.watch("kekg_memes.json", reload_kekg_config)
+watcher.watch("schedule.yaml", reload_schedule)
+
 
 kekg_actions = {
-    "!moviespam": (kekg.movies, {"spam": True}),
-    "!moviesspam": (kekg.movies, {"spam": True}),
-    "!imdbspam": (kekg.movies, {"spam": True, "imdb": True}),
-    "!movies": (kekg.movies, {}),
-    "!sports": (kekg.sports, {}),
-    "!egg": (kekg.egg, {}),
-    "!march": (kekg.march, {}),
-    "!showspam": (kekg.shows, {"spam": True}),
-    "!showsspam": (kekg.shows, {"spam": True}),
-    "!shows": (kekg.shows, {}),
-    "!moviesalt": (kekg.movies_alt, {}),
-    "!sportsalt": (kekg.sports_alt, {}),
-    "!church": (kekg.church, {}),
-    "!reality": (kekg.reality, {}),
-    "!p": (kodi.progress, {}),
-    "!rm": (kodi.random_movie, {}),
-    "!kraftin": (kraft.who_krafting, {}),
+    "!moviespam": (lazy("kekg", "movies"), {"spam": True}),
+    "!moviesspam": (lazy("kekg", "movies"), {"spam": True}),
+    "!imdbspam": (lazy("kekg", "movies"), {"spam": True, "imdb": True}),
+    "!movies": (lazy("kekg", "movies"), {}),
+    "!sports": (lazy("kekg", "sports"), {}),
+    "!egg": (lazy("kekg", "egg"), {}),
+    "!march": (lazy("kekg", "march"), {}),
+    "!showspam": (lazy("kekg", "shows"), {"spam": True}),
+    "!showsspam": (lazy("kekg", "shows"), {"spam": True}),
+    "!shows": (lazy("kekg", "shows"), {}),
+    "!moviesalt": (lazy("kekg", "movies_alt"), {}),
+    "!sportsalt": (lazy("kekg", "sports_alt"), {}),
+    "!church": (lazy("kekg", "church"), {}),
+    "!reality": (lazy("kekg", "reality"), {}),
+    "!p": (lazy("kodi", "progress"), {}),
+    "!rm": (lazy("kodi", "random_movie"), {}),
+    "!kraftin": (lazy("kraft", "who_krafting"), {}),
 }
 
 kodi_actions = {
-    "!pixel": (kodi.pixel_toggle, {}),
+    "!pixel": (lazy("kodi", "pixel_toggle"), {}),
 }
 
 lmao_actions = {
-    "!help": (daddy.help, {}),
-    "!now": (daddy.now, {}),
-    "!tv": (daddy.tv, {}),
-    "!crick": (daddy.crick, {}),
-    "!cricket": (daddy.crick, {}),
-    "!ufc": (daddy.ufc, {}),
-    "!afl": (daddy.afl, {}),
-    "!mlb": (daddy.baseball, {}),
-    "!hoops": (daddy.hoops, {}),
-    "!nba": (daddy.nba, {}),
-    "!foot": (daddy.foot, {}),
-    "!egg": (daddy.egg, {}),
-    "!hockey": (daddy.hockey, {}),
-    "!tennis": (daddy.tennis, {}),
-    "!motor": (daddy.motor, {}),
-    "!ppv": (daddy.ppv, {}),
-    "!ski": (daddy.ski, {}),
-    "!golf": (daddy.golf, {}),
-    "!wwe": (daddy.wwe, {}),
-    "!misc": (daddy.misc, {}),
-    "!moviespam": (tvpass.movies, {"spam": True}),
-    "!moviesspam": (tvpass.movies, {"spam": True, "ai": True}),
-    "!imdbspam": (tvpass.movies, {"spam": True, "imdb": True}),
-    "!movies": (tvpass.movies, {}),
-    "!sports": (daddy.guide_link, {}),
-    "!tvpasssports": (tvpass.sports, {"ai": True}),
-    "!shows": (tvpass.shows, {}),
-    "!showsai": (tvpass.shows, {"ai": True}),
-    "!news": (tvpass.news, {}),
-    "!newsai": (tvpass.news, {"ai": True}),
-    "!moviesalt": (tvpass.movies_alt, {}),
-    "!tvpasssportsalt": (tvpass.sports_alt, {"ai": True}),
-    "!church": (tvpass.church, {}),
-    "!churchai": (tvpass.church, {"ai": True}),
-    "!reality": (tvpass.reality, {}),
-    "!realityai": (tvpass.reality, {"ai": True}),
+    "!help": (lazy("daddy", "help"), {}),
+    "!now": (lazy("daddy", "now"), {}),
+    "!tv": (lazy("daddy", "tv"), {}),
+    "!crick": (lazy("daddy", "crick"), {}),
+    "!cricket": (lazy("daddy", "crick"), {}),
+    "!ufc": (lazy("daddy", "ufc"), {}),
+    "!afl": (lazy("daddy", "afl"), {}),
+    "!mlb": (lazy("daddy", "baseball"), {}),
+    "!hoops": (lazy("daddy", "hoops"), {}),
+    "!nba": (lazy("daddy", "nba"), {}),
+    "!foot": (lazy("daddy", "foot"), {}),
+    "!egg": (lazy("daddy", "egg"), {}),
+    "!hockey": (lazy("daddy", "hockey"), {}),
+    "!tennis": (lazy("daddy", "tennis"), {}),
+    "!motor": (lazy("daddy", "motor"), {}),
+    "!ppv": (lazy("daddy", "ppv"), {}),
+    "!ski": (lazy("daddy", "ski"), {}),
+    "!golf": (lazy("daddy", "golf"), {}),
+    "!wwe": (lazy("daddy", "wwe"), {}),
+    "!misc": (lazy("daddy", "misc"), {}),
+    "!moviespam": (lazy("tvpass", "movies"), {"spam": True}),
+    "!moviesspam": (lazy("tvpass", "movies"), {"spam": True, "ai": True}),
+    "!imdbspam": (lazy("tvpass", "movies"), {"spam": True, "imdb": True}),
+    "!movies": (lazy("tvpass", "movies"), {}),
+    "!sports": (lazy("daddy", "guide_link"), {}),
+    "!tvpasssports": (lazy("tvpass", "sports"), {"ai": True}),
+    "!shows": (lazy("tvpass", "shows"), {}),
+    "!showsai": (lazy("tvpass", "shows"), {"ai": True}),
+    "!news": (lazy("tvpass", "news"), {}),
+    "!newsai": (lazy("tvpass", "news"), {"ai": True}),
+    "!moviesalt": (lazy("tvpass", "movies_alt"), {}),
+    "!tvpasssportsalt": (lazy("tvpass", "sports_alt"), {"ai": True}),
+    "!church": (lazy("tvpass", "church"), {}),
+    "!churchai": (lazy("tvpass", "church"), {"ai": True}),
+    "!reality": (lazy("tvpass", "reality"), {}),
+    "!realityai": (lazy("tvpass", "reality"), {"ai": True}),
 }
 
-meme_cmds = "|".join(
-    re.escape(cmd) for cmd in list(simple_memes.keys()) + list(random_memes.keys())
-)
-command_re = re.compile(r"\/[^\s]*|stash|ay+ lmao|" + meme_cmds, flags=re.IGNORECASE)
+
+youtube_cache = TTLCache("youtube", ttl=6 * 3600, negative_ttl=600)
+twitter_cache = TTLCache("twitter", ttl=3600, negative_ttl=300)
+
+
+async def youtube_video_printout(video_id):
+    """Thumbnail, title and short link for a video id, None if not found"""
+    videos = await to_thread(YoutubeSearch, '"' + video_id + '"', max_results=5)
+    results = videos.videos
+    if not isinstance(results, list):
+        return None
+
+    result = next((res for res in results if res.get("id") == video_id), None)
+    if result is None:
+        return None
+
+    yt_img = result["thumbnails"][0]
+    title = result["title"]
+    url_suffix = re.sub(r"shorts\/", "watch?v=", result["url_suffix"])
+    the_link = "https://youtu.be{}".format(url_suffix)
+
+    # Youtube website started adding "pp" query param so parse and remove for shorter urls
+    parsed_url = urlparse(the_link)
+    v = parse_qs(parsed_url.query).get("v", [""])[0]
+    new_link = urlunparse(parsed_url._replace(query=f"v={v}"))
+
+    return "{}<br/> {}<br/> {}".format(yt_img, title, new_link)
+
+
+@metrics.instrument("twitter")
+async def tweet_printout(api_url):
+    res = await fetch.get(api_url)
+    tweet = res.json()
+    images = ""
+    for media in tweet["media_extended"]:
+        images += media["thumbnail_url"]
+        images += " "
+    return "{}\n{}".format(tweet["text"], images)
 
 
 class LmaoRoom(chatango.Room):
     def __init__(self, name: str):
         super().__init__(name)
-        self.last_msg_time = 0
-        self.send_queue = asyncio.Queue()
+        self.send_queue = SendQueue(name)
+        self.send_bucket = TokenBucket()
         # Hack a smaller history size
         self._history = deque(maxlen=50)
+        self.chat_history = RoomHistory(maxlen=50)
 
         self.add_task(self._process_send_queue())
 
@@ -285,39 +511,27 @@ class LmaoRoom(chatango.Room):
             self.add_delayed_task(delay_time, self.send_message(message, **kwargs))
             return
 
-        # Handle sending very large message in chunks
-        if len(message) <= max_length:
-            await self.send_queue.put((message, kwargs))
-        else:
-            # If message is too long, split on '\n' and send in order
-            chunks = []
-            current_chunk = []
+        priority = kwargs.pop("priority", PRIORITY_NORMAL)
 
-            for line in message.split("\n"):
-                if sum(len(s) for s in current_chunk) + len(line) + 1 > max_length:
-                    chunks.append("\n".join(current_chunk))
-                    current_chunk = []
-                current_chunk.append(line)
-
-            if current_chunk:
-                chunks.append("\n".join(current_chunk))
-
-            for chunk in chunks:
-                await self.send_queue.put((chunk, kwargs))
-                await asyncio.sleep(0.1)
+        # Handle sending very large message in chunks
+        for chunk in chunk_message(message, max_length):
+            self.send_queue.put(chunk, kwargs, priority)
 
     async def _process_send_queue(self):
         while True:
-            msg, kwargs = await self.send_queue.get()
-            previous_msg_time = self.last_msg_time
-            current_msg_time = timegm(gmtime())
-            time_since_last_msg = current_msg_time - previous_msg_time
-
-            if self.rate_limit and time_since_last_msg < self.rate_limit:
-                wait_time = self.rate_limit + 1 - time_since_last_msg
-                await asyncio.sleep(wait_time)
-
-            self.last_msg_time = timegm(gmtime())
+            await self.send_queue.wait()
+
+            if self.rate_limit:
+                # Slow mode counts from the last message, a burst gets flagged
+                self.send_bucket.capacity = 1
+                self.send_bucket.rate = 1 / (self.rate_limit + SEND_MARGIN)
+                wait_time = self.send_bucket.delay()
+                if wait_time:
+                    await asyncio.sleep(wait_time)
+                self.send_bucket.take()
+
+            # Pop after waiting so anything more urgent that arrived goes first
+            msg, kwargs = self.send_queue.pop(self._maxlen - 200)
             await super().send_message(msg, **kwargs)
 
 
@@ -355,92 +569,204 @@ class LmaoBot(chatango.Client):
             headers = {
                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)",
             }
-            page = await to_thread(requests.get, the_link, headers=headers)
-            soup = BeautifulSoup(page.content, "html.parser")
+            page = await fetch.get(the_link, headers=headers)
+            soup = bs4.BeautifulSoup(page.content, "html.parser")
             desc = soup.find("meta", attrs={"property": "og:description"})
-            if desc and isinstance(desc, Tag):
+            if desc and isinstance(desc, bs4.Tag):
                 await room.send_message(desc.get("content"))
         except Exception as e:
             logError(room.name, "gospel", "preach", e)
 
-    async def check_four_twenty(self):
+    async def four_twenty(self, room):
+        await room.send_message(random_selection(memes["four"]), priority=PRIORITY_BULK)
+
+    async def promote_norks(self, room):
+        msg = random_selection(
+            [
+                "Kim Alive and Well",
+                "Missles armed and ready",
+                "Forty Foot Giants",
+                "Shen Yun theatre",
+                "Production facility",
+                "How to Produce Food",
+                "Naval sightings",
+                "Mexican standoff",
+                "Festival",
+                "펀 자브 다바",
+                "맞아요게이",
+                "미사일 대피소에 들어가다",
+                "양 사람들을 깨워",
+            ]
+        )
+        img = random_selection(memes["korea"])
+        await room.send_message(
+            "{}\n{}\n{}".format(msg, img, "https://www.twitch.tv/kctv_elufa"),
+            priority=PRIORITY_BULK,
+        )
+
+    async def run_job(self, job):
+        """Run a schedule.yaml job in every connected room of its groups"""
+        rooms = [
+            room
+            for room in self.rooms.values()
+            if room.connected
+            and (
+                job.groups is None
+                or any(room.name in chat.get(g, ()) for g in job.groups)
+            )
+            and (job.chance >= 1 or random.random() < job.chance)
+        ]
+        action = getattr(self, scheduled_actions[job.action])
+        with metrics.track("job", job.name):
+            results = await scheduler.fan_out(rooms, action, job.jitter)
+        for room, result in zip(rooms, results):
+            if isinstance(result, Exception):
+                logError(room.name, "schedule", job.name, result)
+
+    async def report_stats(self):
         while True:
-            this_moment = datetime.now(timezone("America/New_York"))
-            minus_twenty = this_moment - timedelta(minutes=20)
-            hour = minus_twenty.hour
-            minute = minus_twenty.minute
-            second = minus_twenty.second
-
-            if hour in {16, 17, 18, 19} and minute == 0:
-                for _, room in self.rooms.items():
-                    if room.connected and (
-                        room.name in chat["four"] or room.name in chat["dev"]
-                    ):
-                        await room.send_message(random_selection(memes["four"]))
-
-            rest_time = ((60 - minute) * 60) - second
             try:
-                await asyncio.sleep(rest_time)
+                await asyncio.sleep(metrics.METRICS_INTERVAL)
             except asyncio.exceptions.CancelledError:
                 break
+            for line in metrics.summary():
+                log("status", None, line)
+            log("status", None, "[cache] {}".format(cache.report()))
 
-    async def promote_norks(self):
-        while True:
-            this_moment = datetime.now(timezone("Asia/Pyongyang"))
-            hour = this_moment.hour
-            minute = this_moment.minute
-            second = this_moment.second
-
-            # one hour after it starts
-            if hour == 16 and minute == 0:
-                for _, room in self.rooms.items():
-                    if (
-                        room.connected
-                        and random_selection([1, 0, 0, 0, 0, 0, 0, 0]) == 1
-                    ):
-                        msg = random_selection(
-                            [
-                                "Kim Alive and Well",
-                                "Missles armed and ready",
-                                "Forty Foot Giants",
-                                "Shen Yun theatre",
-                                "Production facility",
-                                "How to Produce Food",
-                                "Naval sightings",
-                                "Mexican standoff",
-                                "Festival",
-                                "펀 자브 다바",
-                                "맞아요게이",
-                                "미사일 대피소에 들어가다",
-                                "양 사람들을 깨워",
-                            ]
-                        )
-                        img = random_selection(memes["korea"])
-                        await room.send_message(
-                            "{}\n{}\n{}".format(
-                                msg, img, "https://www.twitch.tv/kctv_elufa"
-                            )
-                        )
+    connection_check_timeout = 5
 
-            rest_time = ((60 - minute) * 60) - second
+    async def load_data(self):
+        # Supervisor workers inherit the memes it loaded before forking
+        if not memes_loaded.is_set():
             try:
-                await asyncio.sleep(rest_time)
-            except asyncio.exceptions.CancelledError:
-                break
+                await to_thread(load_memes)
+            except Exception as e:
+                logError("startup", "memes", "load_memes", e)
+            memes_loaded.set()
+            plugins.log_report()
+        # The first mention or page lookup would otherwise import these on
+        # the loop and stall every room, anthropic alone takes ~0.4s
+        for module in (bs4, anthropic, claude, wolfram):
+            try:
+                await to_thread(module.load)
+            except Exception as e:
+                logError("startup", "import", module._name, e)
+        self.add_task(watcher.run())
 
-    connection_check_timeout = 5
+    async def index_logs(self):
+        global log_index
+        if not logindex.LOG_INDEX:
+            return
+        try:
+            index = await to_thread(logindex.LogIndex)
+            # New lines from now on, then catch up on the files already there
+            chatlog.logger.listeners.append(index.add_lines)
+            log_index = index
+            if shard and shard.index:
+                # Worker 0 catches up for everyone, the others catch up on a
+                # file when they write to it, see LogIndex.add_lines
+                return
+            start = time.perf_counter()
+            lines = await to_thread(index.import_dir, chatlog.LOG_DIR)
+            log(
+                "status",
+                None,
+                "[index] imported {} log lines in {:.1f}s".format(
+                    lines, time.perf_counter() - start
+                ),
+            )
+        except Exception as e:
+            logError("startup", "index", "import_dir", e)
 
     async def on_started(self):
-        self.add_task(self.check_four_twenty())
-        # self.add_task(self.promote_norks())
+        fetch.attach(asyncio.get_running_loop())
+        self.add_task(self.load_data())
+        self.add_task(chatlog.logger.run())
+        self.add_task(self.index_logs())
+        self.add_task(self.report_stats())
+        if metrics.METRICS_PORT:
+            # Each supervisor worker serves on its own port after the first
+            self.add_task(
+                metrics.serve(metrics.METRICS_PORT + (shard.index if shard else 0))
+            )
+        if shard:
+            shard.attach(
+                asyncio.get_running_loop(),
+                on_error=lambda e: logError("supervisor", "cache_put", "", e),
+                join=self.join_room,
+                leave=self.leave_room,
+            )
+            self.add_task(shard.report_volume())
+        schedule.run_job = self.run_job
+        self.add_task(schedule.run())
+        if os.environ.get("KEKG_URL"):
+            self.add_task(self.refresh_guide())
+
+    async def refresh_guide(self):
+        # Imported off the loop, kekg pulls in imdb
+        await memes_loaded.wait()
+        await to_thread(kekg.load)
+        await kekg.guide.run(
+            lambda e: logError("kekg", "guide", "refresh", e),
+            on_refresh=self.announce_guide,
+        )
+
+    async def announce_guide(self):
+        """One message per subscribed room with what just started"""
+        new = await to_thread(kekg.new_broadcasts)
+        if not new:
+            return
+        now = time.time()
+        messages = {}
+        for room in self.rooms.values():
+            kinds = kekg.announce.kinds_for(room.name, chat)
+            if room.connected and kinds and not kekg.announce.is_quiet(room.name, now):
+                text = kekg.announcement(new, kinds)
+                if text:
+                    messages[room.name] = text
+
+        async def send(room):
+            await room.send_message(
+                messages[room.name], use_html=True, priority=PRIORITY_BULK
+            )
+
+        rooms = [room for room in self.rooms.values() if room.name in messages]
+        results = await scheduler.fan_out(rooms, send)
+        for room, result in zip(rooms, results):
+            if isinstance(result, Exception):
+                logError(room.name, "kekg", "announce", result)
+
+    async def join_room(self, room_name):
+        try:
+            await self.join(room_name)
+        except Exception as e:
+            logError(room_name, "supervisor", "join", e)
+
+    async def leave_room(self, room_name):
+        try:
+            await self.leave(room_name)
+        except Exception as e:
+            logError(room_name, "supervisor", "leave", e)
 
     async def on_task_exception(self, task):
         e = task.exception()
         log("errors", None, "[unknown] [unknown] {}".format(repr(e)))
 
+    async def on_connect(self, room):
+        if plugins.PROFILE_STARTUP:
+            logging.info(
+                "[%s] connected after %.0f ms",
+                room.name,
+                (time.perf_counter() - startup_begin) * 1000,
+            )
+
     async def on_denied(self, room):
         log("status", None, "[{0}] Denied".format(room.name))
 
+    async def on_disconnect(self, room):
+        log("status", None, "[{0}] Disconnected".format(room.name))
+        fetch.cancel_room(room.name)
+
     async def on_ban(self, room, user, target):
         log("bans", None, "[{}] {} banned {}".format(room.name, user.name, target.name))
 
@@ -463,13 +789,16 @@ class LmaoBot(chatango.Client):
     async def on_delete_message(self, room, message):
         user: chatango.User = message.user
         log(room.name, "deleted", "<{0}> {1}".format(user.name, message.body))
-        if user.name.lower() == "lmaolover" and message.body != stash_memes["/jews"]:
-            await room.send_message(stash_memes["/jews"])
+        room.chat_history.remove(message)
+        jews = stash_memes.get("/jews")
+        if jews and user.name.lower() == "lmaolover" and message.body != jews:
+            await room.send_message(jews)
 
     async def on_delete_user(self, room, messages):
         for message in messages:
             user: chatango.User = message.user
             log(room.name, "deleted", "<{0}> {1}".format(user.name, message.body))
+            room.chat_history.remove(message)
 
     async def on_message(self, room, message):
         user: chatango.User = message.user
@@ -485,11 +814,23 @@ class LmaoBot(chatango.Client):
             r"[^a-z]", "", message_body_normal.translate(LEET_MAP)
         )
 
-        if chatango.MessageFlags.CHANNEL_MOD in message.flags:
+        is_mod = chatango.MessageFlags.CHANNEL_MOD in message.flags
+        if is_mod:
             log(room.name, "mod", "<{0}> {1}".format(user.name, message.body))
         else:
             log(room.name, None, "<{0}> {1}".format(user.name, message.body))
 
+        # Pick up the backlog the room loaded when it joined
+        if not room.chat_history.seeded:
+            for msg in room.history:
+                if msg is not message:
+                    room.chat_history.add(
+                        msg, chatango.MessageFlags.CHANNEL_MOD in msg.flags
+                    )
+        room.chat_history.add(message, is_mod)
+        if shard:
+            shard.seen(room.name)
+
         if user.name.lower() == bot_user_lower:
             return
 
@@ -502,505 +843,739 @@ class LmaoBot(chatango.Client):
 
         link_matches = link_re.search(message.body)
 
-        if room.name in chat["lmao"] + chat["dev"] and any(
-            banned_word in message_body_alpha for banned_word in memes["banned"]
+        if not memes_loaded.is_set():
+            await memes_loaded.wait()
+
+        if (
+            banned_words
+            and router.in_group(room.name, "lmao", "dev")
+            and (banned_word := banned_words.search(message_body_alpha))
         ):
+            log(
+                room.name,
+                "banned",
+                "<{0}> [{1}] {2}".format(user.name, banned_word, message.body),
+            )
             await room.delete_message(message)
             return
 
-        if user.isanon:
-            if message_body_lower.strip() == "= =":
-                await room.send_message("{0}".format(random_selection(memes["eye"])))
-            elif link_matches and any(
-                link_type in link_matches.group(0)
-                for link_type in [
-                    "kfcclub.com.tw",
-                    "ntdtv.com.tw",
-                    "image.pizzahut.com.tw",
-                ]
-            ):
-                try:
-                    the_link = link_matches.group(0)
-                    await room.send_message(
-                        "{}".format(
-                            the_link,
+        ctx = MessageContext(
+            room,
+            message,
+            bot_user_lower,
+            message_body_lower,
+            link_matches.group(0) if link_matches else None,
+        )
+
+        route = (anon_router if user.isanon else router).dispatch(ctx)
+        if route:
+            outcome = governor.check(route.name, ctx)
+            if outcome != ALLOWED:
+                if outcome == DROPPED and governor.first_drop(route.name, ctx):
+                    log(
+                        "flood",
+                        None,
+                        "[{}] [governor] dropped {} from {}".format(
+                            room.name, route.name, user.name
                         ),
-                        use_html=True,
                     )
-                except Exception as e:
-                    logError(room.name, "propaganda", message.body, e)
+                return
+            with metrics.track("handler", route.name):
+                # Own task so outbound calls get cancelled if the room goes away
+                task = fetch.room_task(room.name, route.handler(self, room, ctx))
+                await asyncio.wait([task])
+                if not task.cancelled():
+                    task.result()
 
-            return
+    async def handle_eye(self, room, ctx):
+        await room.send_message("{0}".format(random_selection(memes["eye"])))
 
-        if (
-            f"@{bot_user_lower}" in message_body_lower
-            and room.name in chat["kek"] + chat["dev"] + chat["lmao"]
-        ):
-            message_without_quote = re.sub(
-                r"@lmaolover: `.*`", "", message.body, flags=re.IGNORECASE
-            )
+    async def handle_anon_propaganda(self, room, ctx):
+        try:
+            await room.send_message("{}".format(ctx.link), use_html=True)
+        except Exception as e:
+            logError(room.name, "propaganda", ctx.body, e)
 
-            if message.body != message_without_quote:
-                return
+    async def handle_mention(self, room, ctx):
+        message = ctx.message
+        user = ctx.user
+        message_without_quote = re.sub(
+            r"@lmaolover: `.*`", "", message.body, flags=re.IGNORECASE
+        )
 
-            untagged_message = re.sub(
-                r"@lmaolover", "", message_without_quote, flags=re.IGNORECASE
-            ).strip()
+        if message.body != message_without_quote:
+            return
 
-            if not untagged_message:
-                return
+        untagged_message = re.sub(
+            r"@lmaolover", "", message_without_quote, flags=re.IGNORECASE
+        ).strip()
 
-            mod_msg = ""
-            if chatango.MessageFlags.CHANNEL_MOD in message.flags:
-                mod_msg = f"{user.name}: {message.body}\n"
+        if not untagged_message:
+            return
 
-            # Initialize our LLM client
-            llm_client = LLMClient(
-                api_key=os.getenv("XAI_API_KEY"),
-                base_url="https://api.x.ai",
-            )
+        mod_msg = ""
+        if chatango.MessageFlags.CHANNEL_MOD in message.flags:
+            mod_msg = f"{user.name}: {message.body}\n"
 
-            # Choose model
-            model = "grok-3-beta"
+        # Shared async client, keeps its connections between mentions
+        llm_client = claude.LLMClient(
+            api_key=os.getenv("XAI_API_KEY"),
+            base_url=os.getenv("XAI_BASE_URL", "https://api.x.ai"),
+            use_async=True,
+        )
 
-            try:
-                # Format history messages appropriately for the model
-                history_messages = format_chat_history(
-                    room_history(room, max_messages=15),
-                    format_type="messages",  # For grok-beta, we use the messages format
-                    filter_text="WWWWWW",
-                    cutoff_message="lmao?",
-                    cutoff_user=user.name,
-                )
+        # Choose model
+        model = "grok-3-beta"
+
+        try:
+            # Pre-built role dicts from the room store, no rescanning
+            history_messages = room.chat_history.context(
+                max_messages=None if LLM_CONTEXT_CHARS else 15,
+                max_chars=LLM_CONTEXT_CHARS,
+            )
 
-                # Run the LLM in a separate thread to not block
-                response = await to_thread(
-                    llm_client.generate_response,
-                    system_prompt=SYSTEM_PROMPTS["chat_assistant"],
+            # A newer mention from this user replaces this one
+            claude.mention_limiter.supersede(room.name, user.name)
+            async with claude.mention_limiter.slot(room.name):
+                # Send each paragraph as soon as it is complete
+                pieces = []
+                async for piece in llm_client.astream_response(
+                    system_prompt=claude.SYSTEM_PROMPTS["chat_assistant"],
                     messages=history_messages,
                     model=model,
                     temperature=0.6,
                     max_tokens=1500,
                     timeout=16,
-                )
-
-                # Check for refusal language specific to the model
-                if check_model_refusal(response, model=model):
-                    log(
-                        room.name,
-                        "aidebug",
-                        f"{user.name}: {message.body}\n{response}",
+                    max_length=room._maxlen // 2,
+                ):
+                    pieces.append(piece)
+                    await room.send_message(
+                        claude.format_response_for_html(piece),
+                        use_html=True,
+                        priority=PRIORITY_HIGH,
                     )
+            response = "\n\n".join(pieces)
 
-                # Format and send the message
-                await room.send_message(
-                    format_response_for_html(response),
-                    use_html=True,
+            # Check for refusal language specific to the model
+            if claude.check_model_refusal(response, model=model):
+                log(
+                    room.name,
+                    "aidebug",
+                    f"{user.name}: {message.body}\n{response}",
                 )
 
-            except anthropic.APIError as e:
-                await room.send_message(f"AI was too retarded sorry @{user.name}.")
-            except Exception as e:
-                await room.send_message("Help me I died")
+        except anthropic.APIError as e:
+            await room.send_message(
+                f"AI was too retarded sorry @{user.name}.", priority=PRIORITY_HIGH
+            )
+        except Exception as e:
+            await room.send_message("Help me I died", priority=PRIORITY_HIGH)
 
-        elif yt_matches := yt_re.search(message.body):
-            try:
-                search = yt_matches.group(1)
-                if len(search) > 0:
-                    videos = await to_thread(
-                        YoutubeSearch, '"' + search + '"', max_results=5
+    async def handle_youtube_link(self, room, ctx):
+        try:
+            search = ctx.match.group(1)
+            if len(search) > 0:
+                yt_msg = await youtube_cache.get_or_fetch(
+                    search, lambda: youtube_video_printout(search)
+                )
+                if yt_msg:
+                    await room.send_message(yt_msg, use_html=True)
+                else:
+                    await room.send_message(
+                        random_selection(
+                            [
+                                "FORBIDDEN video requested",
+                                "Video BANNED by Mormon Church",
+                                "Illicit material detected",
+                                "I ain't clickin that shit",
+                            ]
+                        ),
                     )
-                    try:
-                        results = videos.videos
-                        if not isinstance(results, list):
-                            raise TypeError
+            else:
+                pass
+        except Exception as e:
+            logError(room.name, "youtube", ctx.body, e)
 
-                        result = next(
-                            (res for res in results if res.get("id") == search)
-                        )
+    async def handle_twitter_link(self, room, ctx):
+        x_matches = ctx.match
+        x_url = x_matches.group(0)
+        api_url = x_url.replace(x_matches.group(1), "https://api.vxtwitter", 1)
+        try:
+            tweet_msg = await twitter_cache.get_or_fetch(
+                x_matches.group(2), lambda: tweet_printout(api_url)
+            )
+            await room.send_message(tweet_msg)
+        except Exception as e:
+            logError(room.name, "twitter", ctx.body, e)
 
-                        yt_img = result["thumbnails"][0]
-                        title = result["title"]
-                        url_suffix = re.sub(
-                            r"shorts\/", "watch?v=", result["url_suffix"]
-                        )
-                        the_link = "https://youtu.be{}".format(url_suffix)
+    async def handle_wolfram(self, room, ctx):
+        try:
+            wolfram_response = await wolfram.chatbot_wolfram_query_async(
+                ctx.match.strip()
+            )
+            await room.send_message(wolfram_response)
+        except Exception as e:
+            logError(room.name, "wolframalpha", ctx.body, e)
 
-                        # Youtube website started adding "pp" query param so parse and remove for shorter urls
-                        parsed_url = urlparse(the_link)
-                        v = parse_qs(parsed_url.query).get("v", [""])[0]
-                        new_link = urlunparse(parsed_url._replace(query=f"v={v}"))
+    async def handle_youtube_search(self, room, ctx):
+        try:
+            search = ctx.match.strip()
+            if len(search) > 0:
+                videos = await to_thread(YoutubeSearch, search, max_results=1)
+                results = videos.videos
+                if isinstance(results, list) and len(results) > 0:
+                    result = results[0]
+                    yt_img = result["thumbnails"][0]
+                    title = result["title"]
+                    url_suffix = re.sub(r"shorts\/", "watch?v=", result["url_suffix"])
+                    the_link = "https://youtu.be{}".format(url_suffix)
+
+                    # Youtube website started adding "pp" query param so parse and remove for shorter urls
+                    parsed_url = urlparse(the_link)
+                    v = parse_qs(parsed_url.query).get("v", [""])[0]
+                    new_link = urlunparse(parsed_url._replace(query=f"v={v}"))
 
-                        await room.send_message(
-                            "{}<br/> {}<br/> {}".format(yt_img, title, new_link),
-                            use_html=True,
-                        )
-                    except (TypeError, StopIteration):
-                        await room.send_message(
-                            random_selection(
-                                [
-                                    "FORBIDDEN video requested",
-                                    "Video BANNED by Mormon Church",
-                                    "Illicit material detected",
-                                    "I ain't clickin that shit",
-                                ]
-                            ),
-                        )
+                    await room.send_message(
+                        "{}<br/> {}<br/> {}".format(yt_img, title, new_link),
+                        use_html=True,
+                    )
                 else:
-                    pass
-            except Exception as e:
-                logError(room.name, "youtube", message.body, e)
+                    await room.send_message(
+                        random_selection(
+                            [
+                                "dude wtf is this",
+                                "nah dude no",
+                                "nah we don't got that",
+                                "sorry bro, try again",
+                            ]
+                        ),
+                    )
+            else:
+                pass
+        except Exception as e:
+            logError(room.name, "youtube-search", ctx.body, e)
 
-        elif x_matches := twitter_re.search(message.body):
-            x_url = x_matches.group(0)
-            api_url = x_url.replace(x_matches.group(1), "https://api.vxtwitter", 1)
-            try:
-                res = await to_thread(requests.get, api_url)
-                tweet = res.json()
-                images = ""
-                for media in tweet["media_extended"]:
-                    images += media["thumbnail_url"]
-                    images += " "
-                await room.send_message("{}\n{}".format(tweet["text"], images))
-            except Exception as e:
-                logError(room.name, "twitter", message.body, e)
-        elif (
-            len(message_body_lower) > 2
-            and message_body_lower[0] == "?"
-            and message_body_lower[1] == "?"
-            and message_body_lower[2] != "?"
-        ):
-            try:
-                wolfram_response = wolfram.chatbot_wolfram_query(
-                    message_body_lower[2:].strip()
+    async def handle_imdb(self, room, ctx):
+        try:
+            if ctx.trigger == "search":
+                video_id = ctx.match.group(1)
+                imdb_info = await imdb_info_by_id_cached(video_id)
+            else:
+                query = ctx.match[:34].strip()
+                imdb_info = await imdb_info_by_search_cached(query)
+                if imdb_info is None:
+                    raise KeyError(query)
+                video_id = imdb_info["imdbID"]
+            if imdb_info is None:
+                raise KeyError(video_id)
+            title = imdb_info["Title"]
+            year = imdb_info["Year"]
+            rating = imdb_info["imdbRating"]
+            await room.send_message(
+                imdb_printout(imdb_info, show_poster=True), use_html=True
+            )
+            log(
+                room.name,
+                "imdb",
+                "<{0}> {1}::{2}::{3}::{4}".format(
+                    ctx.user.name, video_id, title, year, rating
+                ),
+            )
+        except KeyError:
+            await room.send_message("Never heard of it")
+        except asyncio.TimeoutError:
+            await room.send_message("imdb ded")
+        except fetch.HTTPError:
+            await room.send_message("imdb ded")
+        except Exception as e:
+            logError(room.name, "imdb", ctx.body, e)
+
+    async def handle_propaganda(self, room, ctx):
+        try:
+            page = await fetch.get(ctx.link)
+            soup = bs4.BeautifulSoup(page.content, "html.parser")
+            title_tag = soup.find("title")
+            img_tag = soup.find("meta", attrs={"property": "og:image"})
+            if title_tag and isinstance(img_tag, bs4.Tag):
+                await room.send_message(
+                    "{}<br/> {}".format(
+                        img_tag.get("content") if img_tag else "",
+                        title_tag.get_text(),
+                    ),
+                    use_html=True,
                 )
-                await room.send_message(wolfram_response)
-            except Exception as e:
-                logError(room.name, "wolframalpha", message.body, e)
+        except Exception as e:
+            logError(room.name, "propaganda", ctx.body, e)
 
-        elif (
-            len(message_body_lower) > 1
-            and message_body_lower[0] == "?"
-            and message_body_lower[1] != "?"
-        ):
-            try:
-                search = message_body_lower[1:].strip()
-                if len(search) > 0:
-                    videos = await to_thread(YoutubeSearch, search, max_results=1)
-                    results = videos.videos
-                    if isinstance(results, list) and len(results) > 0:
-                        result = results[0]
-                        yt_img = result["thumbnails"][0]
-                        title = result["title"]
-                        url_suffix = re.sub(
-                            r"shorts\/", "watch?v=", result["url_suffix"]
-                        )
-                        the_link = "https://youtu.be{}".format(url_suffix)
+    async def handle_link_title(self, room, ctx):
+        try:
+            page = await fetch.get(ctx.link)
+            soup = bs4.BeautifulSoup(page.content, "html.parser")
+            title_tag = soup.find("title")
+            if title_tag:
+                await room.send_message(title_tag.get_text())
+        except Exception as e:
+            logError(room.name, "link", ctx.body, e)
 
-                        # Youtube website started adding "pp" query param so parse and remove for shorter urls
-                        parsed_url = urlparse(the_link)
-                        v = parse_qs(parsed_url.query).get("v", [""])[0]
-                        new_link = urlunparse(parsed_url._replace(query=f"v={v}"))
+    async def handle_kodi(self, room, ctx):
+        try:
+            coroutine_func, kwargs = kodi_actions[ctx.match]
+            k_msg = await to_thread(coroutine_func, **kwargs)
+            k_msg = k_msg if k_msg.strip() else "Nope"
+            await room.send_message(k_msg, use_html=True)
+        except json.JSONDecodeError as e:
+            await room.send_message("Not possible")
+        except Exception as e:
+            logError(room.name, "kodi", ctx.body, e)
 
-                        await room.send_message(
-                            "{}<br/> {}<br/> {}".format(yt_img, title, new_link),
-                            use_html=True,
-                        )
-                    else:
-                        await room.send_message(
-                            random_selection(
-                                [
-                                    "dude wtf is this",
-                                    "nah dude no",
-                                    "nah we don't got that",
-                                    "sorry bro, try again",
-                                ]
-                            ),
-                        )
-                else:
-                    pass
-            except Exception as e:
-                logError(room.name, "youtube-search", message.body, e)
+    async def send_guide(
+        self, room, ctx, func, *args, empty="None on atm", stale=False, **kwargs
+    ):
+        """Reply with func's listing, stale=True notes an outdated kekg guide"""
+        try:
+            k_msg = await to_thread(func, *args, **kwargs)
+            k_msg = k_msg if k_msg.strip() else empty
+            if stale:
+                # func came from kekg, so it's loaded by now
+                k_msg += kekg.stale_note()
+            await room.send_message(k_msg, use_html=True, priority=PRIORITY_BULK)
+        except json.JSONDecodeError as e:
+            await room.send_message("Guide not available rn")
+        except Exception as e:
+            logError(room.name, "kekg", ctx.body, e)
+
+    async def handle_kekg(self, room, ctx):
+        coroutine_func, kwargs = kekg_actions[ctx.match]
+        # !p, !rm and !kraftin aren't from the guide
+        stale = coroutine_func.module is kekg
+        await self.send_guide(room, ctx, coroutine_func, stale=stale, **kwargs)
+
+    async def handle_kekg_at(self, room, ctx):
+        clock = parse_clock(ctx.match)
+        if clock is None:
+            await room.send_message("Like !movies 9pm, 9:30pm or 21:30")
+            return
+        hour, minute = clock
+        await self.send_guide(
+            room,
+            ctx,
+            lazy("kekg", "movies_at"),
+            hour,
+            minute,
+            empty="None on then",
+            stale=True,
+        )
 
-        elif (
-            imdb_matches := imdb_re.search(message.body)
-        ) or message_body_lower.startswith("!imdb "):
-            try:
-                if imdb_matches:
-                    video_id = imdb_matches.group(1)
-                    imdb_info = await to_thread(imdb_info_by_id, video_id)
-                else:
-                    imdb_info = await to_thread(
-                        imdb_info_by_search, message_body_lower[6:40]
-                    )
-                    video_id = imdb_info["imdbID"]
-                title = imdb_info["Title"]
-                year = imdb_info["Year"]
-                rating = imdb_info["imdbRating"]
+    async def handle_kekg_next(self, room, ctx):
+        await self.send_guide(
+            room, ctx, lazy("kekg", "next_airing"), ctx.match.strip(), stale=True
+        )
+
+    async def handle_lmao_action(self, room, ctx):
+        match = ctx.match
+        try:
+            coroutine_func, kwargs = lmao_actions[match]
+            if match in slow_lmao_actions:
                 await room.send_message(
-                    imdb_printout(imdb_info, show_poster=True), use_html=True
-                )
-                log(
-                    room.name,
-                    "imdb",
-                    "<{0}> {1}::{2}::{3}::{4}".format(
-                        user.name, video_id, title, year, rating
-                    ),
+                    f"⚠️ <b>Please wait...</b>\n<i>Generating your spam...</i>",
+                    use_html=True,
                 )
-            except KeyError:
-                await room.send_message("Never heard of it")
-            except requests.exceptions.Timeout:
-                await room.send_message("imdb ded")
-            except requests.exceptions.HTTPError:
-                await room.send_message("imdb ded")
-            except Exception as e:
-                logError(room.name, "imdb", message.body, e)
-
-        elif link_matches and any(
-            link_type in link_matches.group(0)
-            for link_type in [
-                "theepochtimes.com",
-                "ntd.com",
-                "revolver.news",
-                "ntdtv.com",
-                "ntdca.com",
-                "75.126.16.248",
-                "infowars.com",
-                "rebelnews.com",
-                "skynews.com.au",
-                "worldstar.com",
-                "www.shenyuncreations.com",
-            ]
-        ):
-            try:
-                the_link = link_matches.group(0)
-                page = await to_thread(requests.get, the_link)
-                soup = BeautifulSoup(page.content, "html.parser")
-                title_tag = soup.find("title")
-                img_tag = soup.find("meta", attrs={"property": "og:image"})
-                if title_tag and isinstance(img_tag, Tag):
+            k_msg = await to_thread(coroutine_func, **kwargs)
+            k_msg = k_msg if k_msg.strip() else "None on atm"
+            await room.send_message(k_msg, use_html=True, priority=PRIORITY_BULK)
+        except json.JSONDecodeError as e:
+            await room.send_message("Guide not available rn")
+        except Exception as e:
+            logError(room.name, "lmao", ctx.body, e)
+
+    async def handle_stash(self, room, ctx):
+        message_body_lower = ctx.body_lower
+        command_matches = ctx.match
+        if "!stash" in message_body_lower:
+            await room.send_message("https://lmao.love/stash/")
+        elif "newstash" in message_body_lower:
+            latest_names = " ".join(reversed(stash_index.latest(69)))
+            await room.send_message("{}".format(latest_names))
+        else:
+            cmd_matches = [cmd.lower() for cmd in command_matches]
+            # remove ticks from quoting
+            cmd_matches = [s[:-1] if s.endswith("`") else s for s in cmd_matches]
+
+            # Plural option
+            cmds_expanded = []
+            for match in cmd_matches:
+                key, plural = stash_index.resolve(match)
+                if plural:
+                    cmds_expanded.extend([key] * 3)
+                elif (
+                    f"{match}s" in message_body_lower
+                    or f"{match}es" in message_body_lower
+                ):
+                    cmds_expanded.extend([key or match] * 3)
+                else:
+                    cmds_expanded.append(key or match)
+
+            if "spam" in message_body_lower:
+                cmds_expanded = cmds_expanded * 3
+
+            show_names = False
+            names = []
+            links = []
+            misses = []
+            for cmd in cmds_expanded:
+                if router.in_group(room.name, "phil") and (
+                    "chop" in cmd or cmd == "/dink"
+                ):
+                    names.append(cmd)
+                    links.append(stash_memes["/philsdink"])
+                elif cmd == "stash":
+                    show_names = True
+                    stash_roll = stash_index.roll()
+                    names.append(stash_roll[0])
+                    link = stash_roll[1]
+                    links.append(link.split(" ")[0])
+                elif cmd in stash_index.memes:
+                    multi_link = stash_index.memes[cmd].split()
+                    multi_name = [""] * len(multi_link)
+                    multi_name[0] = cmd
+                    names.extend(multi_name)
+                    links.extend(multi_link)
+                elif re.match("ay+ lmao", cmd):
+                    names.append(cmd)
+                    links.append(random_selection(memes["lmao"]))
+                elif cmd in simple_memes.keys():
+                    names.append(cmd)
+                    links.append(simple_memes.get(cmd))
+                elif cmd in random_memes.keys():
+                    names.append(cmd)
+                    links.append(random_selection(random_memes.get(cmd)))
+                elif cmd.startswith("/"):
+                    misses.append(cmd)
+
+            cmd_msg = "{}{}{}".format(
+                " ".join(names[:3]) if show_names else "",
+                (
+                    "\n"
+                    if show_names
+                    or len(links) > 2
+                    or (len(links) > 1 and router.in_group(room.name, "balb"))
+                    else ""
+                ),
+                " ".join(links[:3]),
+            )
+
+            if cmd_msg.strip():
+                await room.send_message(cmd_msg)
+            elif misses:
+                # Only whole words, not the path of a link or and/or
+                words = set(message_body_lower.split())
+                suggestions = stash_index.suggest(m for m in misses if m in words)
+                if suggestions:
                     await room.send_message(
-                        "{}<br/> {}".format(
-                            img_tag.get("content") if img_tag else "",
-                            title_tag.get_text(),
-                        ),
-                        use_html=True,
+                        "Did you mean {}".format(
+                            " ".join(
+                                dict.fromkeys(
+                                    key for keys in suggestions.values() for key in keys
+                                )
+                            )
+                        )
                     )
-            except Exception as e:
-                logError(room.name, "propaganda", message.body, e)
-
-        elif link_matches and any(
-            link_type in link_matches.group(0)
-            for link_type in [
-                "dailymotion.com",
-                "strawpoll.me",
-                "open.spotify.com",
-            ]
-        ):
-            try:
-                the_link = link_matches.group(0)
-                page = await to_thread(requests.get, the_link)
-                soup = BeautifulSoup(page.content, "html.parser")
-                title_tag = soup.find("title")
-                if title_tag:
-                    await room.send_message(title_tag.get_text())
-            except Exception as e:
-                logError(room.name, "link", message.body, e)
-
-        elif (
-            (
-                matches := [
-                    cmd
-                    for cmd in kodi_actions.keys()
-                    if cmd == message_body_lower.strip()
-                ]
+
+    async def handle_infowars(self, room, ctx):
+        page = await fetch.get("https://www.infowars.com/rss.xml")
+        soup = bs4.BeautifulSoup(page.content, "xml")
+        item = random_selection(soup.find_all("item"))
+        await room.send_message(
+            "{}\n{}\n{}".format(
+                item.enclosure.get("url"), item.title.text, item.link.text
             )
-            and room.name in chat["kek"] + chat["dev"]
-            and user.name.lower() in chat["mods"]
-        ):
-            match = max(matches, key=len)
-            try:
-                params = kodi_actions[match]
-                coroutine_func, kwargs = params
-                k_msg = await to_thread(coroutine_func, **kwargs)
-                k_msg = k_msg if k_msg.strip() else "Nope"
-                await room.send_message(k_msg, use_html=True)
-            except json.JSONDecodeError as e:
-                await room.send_message("Not possible")
-            except Exception as e:
-                logError(room.name, "kodi", message.body, e)
+        )
 
-        elif (
-            matches := [
-                cmd for cmd in kekg_actions.keys() if cmd == message_body_lower.strip()
-            ]
-        ) and room.name in chat["kek"] + chat["dev"]:
-            match = max(matches, key=len)
-            try:
-                params = kekg_actions[match]
-                coroutine_func, kwargs = params
-                k_msg = await to_thread(coroutine_func, **kwargs)
-                k_msg = k_msg if k_msg.strip() else "None on atm"
-                await room.send_message(k_msg, use_html=True)
-            except json.JSONDecodeError as e:
-                await room.send_message("Guide not available rn")
-            except Exception as e:
-                logError(room.name, "kekg", message.body, e)
+    async def handle_church(self, room, ctx):
+        await self.praise_jesus(room)
 
-        elif (
-            matches := [
-                cmd for cmd in lmao_actions.keys() if cmd == message_body_lower.strip()
-            ]
-        ) and room.name in chat["lmao"] + chat["dev"]:
-            match = max(matches, key=len)
-            try:
-                params = lmao_actions[match]
-                coroutine_func, kwargs = params
-                if match in [
-                    "!tvpasssports",
-                    "!tvpasssportsalt",
-                    "!realityai",
-                    "!showsai",
-                    "!moviesspam",
-                    "!churchai",
-                    "!newsai",
-                ]:
-                    await room.send_message(
-                        f"⚠️ <b>Please wait...</b>\n<i>Generating your spam...</i>",
-                        use_html=True,
+    async def handle_gospel(self, room, ctx):
+        await self.preach_the_gospel(room)
+
+    async def handle_tldr(self, room, ctx):
+        await room.send_message(random_selection(["tl;dr", "spam"]), delay=1)
+
+    async def handle_cnn(self, room, ctx):
+        await room.send_message(random_selection(memes["cnn"]), delay=1)
+
+    async def handle_seen(self, room, ctx):
+        name = ctx.match.strip().lstrip("@")
+        if not name or log_index is None:
+            return
+        try:
+            row = await to_thread(log_index.seen, name)
+            if row:
+                seen_name, seen_room, seen_time, body = row
+                await room.send_message(
+                    "{} was in {} at {}: {}".format(
+                        seen_name, seen_room, seen_time, body[:200]
                     )
-                k_msg = await to_thread(coroutine_func, **kwargs)
-                k_msg = k_msg if k_msg.strip() else "None on atm"
-                await room.send_message(k_msg, use_html=True)
-            except json.JSONDecodeError as e:
-                await room.send_message("Guide not available rn")
-            except Exception as e:
-                logError(room.name, "lmao", message.body, e)
-
-        elif command_matches := command_re.findall(message.body):
-            if "!stash" in message_body_lower:
-                await room.send_message("https://lmao.love/stash/")
-            elif "newstash" in message_body_lower:
-                latest_names = " ".join(reversed([st[0] for st in stash_tuples[-69:]]))
-                await room.send_message("{}".format(latest_names))
+                )
             else:
-                cmd_matches = [cmd.lower() for cmd in command_matches]
-                # remove ticks from quoting
-                cmd_matches = [s[:-1] if s.endswith("`") else s for s in cmd_matches]
-
-                # Plural option
-                cmds_expanded = []
-                for match in cmd_matches:
-                    if (
-                        match not in stash_memes
-                        and match[-1] == "s"
-                        and match[:-1] in stash_memes
-                    ):
-                        cmds_expanded.extend([match[:-1]] * 3)
-                    elif (
-                        match not in stash_memes
-                        and match[-2:] == "es"
-                        and match[:-2] in stash_memes
-                    ):
-                        cmds_expanded.extend([match[:-2]] * 3)
-                    elif (
-                        f"{match}s" in message_body_lower
-                        or f"{match}es" in message_body_lower
-                    ):
-                        cmds_expanded.extend([match] * 3)
-                    else:
-                        cmds_expanded.append(match)
-
-                if "spam" in message_body_lower:
-                    cmds_expanded = cmds_expanded * 3
-
-                show_names = False
-                names = []
-                links = []
-                for cmd in cmds_expanded:
-                    if room.name in chat["phil"] and ("chop" in cmd or cmd == "/dink"):
-                        names.append(cmd)
-                        links.append(stash_memes["/philsdink"])
-                    elif cmd == "stash":
-                        show_names = True
-                        stash_roll = random_selection(stash_tuples)
-                        names.append(stash_roll[0])
-                        link = stash_roll[1]
-                        links.append(link.split(" ")[0])
-                    elif cmd in stash_memes:
-                        multi_link = stash_memes.get(cmd, "").split()
-                        multi_name = [""] * len(multi_link)
-                        multi_name[0] = cmd
-                        names.extend(multi_name)
-                        links.extend(multi_link)
-                    elif re.match("ay+ lmao", cmd):
-                        names.append(cmd)
-                        links.append(random_selection(memes["lmao"]))
-                    elif cmd in simple_memes.keys():
-                        names.append(cmd)
-                        links.append(simple_memes.get(cmd))
-                    elif cmd in random_memes.keys():
-                        names.append(cmd)
-                        links.append(random_selection(random_memes.get(cmd)))
-
-                cmd_msg = "{}{}{}".format(
-                    " ".join(names[:3]) if show_names else "",
-                    (
-                        "\n"
-                        if show_names
-                        or len(links) > 2
-                        or (len(links) > 1 and room.name in chat["balb"])
-                        else ""
-                    ),
-                    " ".join(links[:3]),
+                await room.send_message("Never seen {}".format(name))
+        except Exception as e:
+            logError(room.name, "seen", ctx.body, e)
+
+    async def handle_schedule(self, room, ctx):
+        lines = [
+            "{} {:%a %H:%M %Z} {}".format(
+                job.name,
+                datetime.fromtimestamp(when, job.cron.tz),
+                " ".join(job.groups or ["all"]),
+            )
+            for when, job in schedule.upcoming()
+        ]
+        await room.send_message("\n".join(lines) or "Nothing scheduled")
+
+    async def handle_grep(self, room, ctx):
+        term = ctx.match.strip()
+        if not term or log_index is None:
+            return
+        try:
+            rows = await to_thread(log_index.grep, term)
+            if rows:
+                await room.send_message(
+                    "\n".join(
+                        "[{}] [{}] <{}> {}".format(t, r, u, body[:200])
+                        for u, r, t, body in rows
+                    )
                 )
+            else:
+                await room.send_message("Nothing")
+        except Exception as e:
+            logError(room.name, "grep", ctx.body, e)
+
+
+slow_lmao_actions = frozenset(
+    [
+        "!tvpasssports",
+        "!tvpasssportsalt",
+        "!realityai",
+        "!showsai",
+        "!moviesspam",
+        "!churchai",
+        "!newsai",
+    ]
+)
 
-                if cmd_msg.strip():
-                    await room.send_message(cmd_msg)
+propaganda_hosts = [
+    "theepochtimes.com",
+    "ntd.com",
+    "revolver.news",
+    "ntdtv.com",
+    # Hosts match on whole labels, ntdtv.com doesn't cover this one
+    "ntdtv.com.tw",
+    "ntdca.com",
+    "75.126.16.248",
+    "infowars.com",
+    "rebelnews.com",
+    "skynews.com.au",
+    "worldstar.com",
+    "www.shenyuncreations.com",
+]
 
-        elif "alex jones" in message_body_lower or "infowars" in message_body_lower:
-            page = await to_thread(requests.get, "https://www.infowars.com/rss.xml")
-            soup = BeautifulSoup(page.content, "xml")
-            item = random_selection(soup.find_all("item"))
-            await room.send_message(
-                "{}\n{}\n{}".format(
-                    item.enclosure.get("url"), item.title.text, item.link.text
-                )
-            )
+anon_router = Router()
+anon_router.add("eye", LmaoBot.handle_eye, exact=["= ="])
+anon_router.add(
+    "anon-propaganda",
+    LmaoBot.handle_anon_propaganda,
+    hosts=["kfcclub.com.tw", "ntdtv.com.tw", "image.pizzahut.com.tw"],
+)
+anon_router.build(chat)
 
-        elif "church" in message_body_lower or "satan" in message_body_lower:
-            await self.praise_jesus(room)
-        elif "preach" in message_body_lower or "gospel" in message_body_lower:
-            await self.preach_the_gospel(room)
-        elif room.name in chat["balb"] + chat["dev"] and len(message_body_lower) > 299:
-            await room.send_message(random_selection(["tl;dr", "spam"]), delay=1)
-        elif (
-            "lil" in message_body_lower and "cnn" in message_body_lower
-        ) or message_body_lower.split().count("cnn") >= 3:
-            await room.send_message(random_selection(memes["cnn"]), delay=1)
-        # else:
-        #     if chatango.MessageFlags.CHANNEL_MOD not in message.flags:
-        #         log(room.name, "unhandled", "<{0}> {1}".format(user.name, message.body))
 
+# schedule.yaml action names to LmaoBot methods taking a room
+scheduled_actions = {
+    "four_twenty": "four_twenty",
+    "promote_norks": "promote_norks",
+}
 
-if __name__ == "__main__":
-    with open(cwd + "/config.yaml") as configyaml:
-        config = yaml.safe_load(configyaml)
+schedule = scheduler.Scheduler()
+try:
+    schedule.load(parse_schedule())
+except FileNotFoundError:
+    pass
+
+
+# Order matters, the first matching route handles the message
+def from_mod(ctx):
+    return ctx.user.name.lower() in router.group_sets.get("mods", ())
+
+
+router = Router()
+router.add(
+    "mention",
+    LmaoBot.handle_mention,
+    when=lambda ctx: f"@{ctx.bot_name}" in ctx.body_lower,
+    groups=["kek", "dev", "lmao"],
+)
+# needs= are literals each regex can't match without, a cheap check first
+router.add(
+    "youtube", LmaoBot.handle_youtube_link, search=yt_re, needs=["youtu", "shorts/"]
+)
+router.add(
+    "twitter", LmaoBot.handle_twitter_link, search=twitter_re, needs=["/status/"]
+)
+router.add(
+    "wolframalpha",
+    LmaoBot.handle_wolfram,
+    prefix=["??"],
+    guard=lambda ctx: ctx.match[:1] not in ("", "?"),
+)
+router.add(
+    "youtube-search",
+    LmaoBot.handle_youtube_search,
+    prefix=["?"],
+    guard=lambda ctx: ctx.match[:1] not in ("", "?"),
+)
+router.add(
+    "imdb", LmaoBot.handle_imdb, search=imdb_re, needs=["imdb"], prefix=["!imdb "]
+)
+router.add("propaganda", LmaoBot.handle_propaganda, hosts=propaganda_hosts)
+router.add(
+    "link",
+    LmaoBot.handle_link_title,
+    hosts=["dailymotion.com", "strawpoll.me", "open.spotify.com"],
+)
+router.add("seen", LmaoBot.handle_seen, prefix=["!seen "], guard=from_mod)
+router.add("grep", LmaoBot.handle_grep, prefix=["!grep "], guard=from_mod)
+router.add("schedule", LmaoBot.handle_schedule, exact=["!schedule"], guard=from_mod)
+router.add(
+    "kodi",
+    LmaoBot.handle_kodi,
+    exact=kodi_actions.keys(),
+    groups=["kek", "dev"],
+    guard=from_mod,
+)
+router.add(
+    "kekg", LmaoBot.handle_kekg, exact=kekg_actions.keys(), groups=["kek", "dev"]
+)
+router.add(
+    "kekg-at",
+    LmaoBot.handle_kekg_at,
+    prefix=["!movies "],
+    guard=lambda ctx: clock_re.match(ctx.match.strip().lower()),
+    groups=["kek", "dev"],
+)
+router.add(
+    "kekg-next",
+    LmaoBot.handle_kekg_next,
+    prefix=["!next "],
+    guard=lambda ctx: ctx.match.strip(),
+    groups=["kek", "dev"],
+)
+router.add(
+    "lmao",
+    LmaoBot.handle_lmao_action,
+    exact=lmao_actions.keys(),
+    groups=["lmao", "dev"],
+)
+router.add("stash", LmaoBot.handle_stash, when=lambda ctx: command_re.findall(ctx.body))
+router.add("infowars", LmaoBot.handle_infowars, contains=["alex jones", "infowars"])
+router.add("church", LmaoBot.handle_church, contains=["church", "satan"])
+router.add("gospel", LmaoBot.handle_gospel, contains=["preach", "gospel"])
+router.add(
+    "tldr",
+    LmaoBot.handle_tldr,
+    when=lambda ctx: len(ctx.body_lower) > 299,
+    groups=["balb", "dev"],
+)
+router.add(
+    "cnn",
+    LmaoBot.handle_cnn,
+    when=lambda ctx: ("lil" in ctx.body_lower and "cnn" in ctx.body_lower)
+    or ctx.body_lower.split().count("cnn") >= 3,
+)
+router.build(chat)
+
+# Flood budget class of each route, see governor.py for costs and quotas
+governor = Governor(
+    {
+        "mention": "llm",
+        "wolframalpha": "wolfram",
+        "kekg": "guide",
+        "kekg-at": "guide",
+        "kekg-next": "guide",
+        "lmao": "guide",
+        "kodi": "guide",
+        "youtube": "lookup",
+        "youtube-search": "lookup",
+        "twitter": "lookup",
+        "imdb": "lookup",
+        "link": "lookup",
+        "propaganda": "lookup",
+        "infowars": "lookup",
+        "gospel": "lookup",
+        "stash": "stash",
+    }
+)
 
-    if "BOT_PROD" in os.environ:
-        rooms = config["rooms"]["prod"]
-    else:
-        rooms = config["rooms"]["dev"]
 
+def run_bot(username, password, rooms):
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
 
-    bot = LmaoBot(config["username"], config["password"], rooms, room_class=LmaoRoom)
+    bot = LmaoBot(username, password, rooms, room_class=LmaoRoom)
+
+    # docker stop sends SIGTERM, exit normally so buffered logs get written
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
     try:
         loop.run_until_complete(bot.run())
     except KeyboardInterrupt:
         print("[KeyboardInterrupt] Killed bot.")
     finally:
+        loop.run_until_complete(fetch.close())
+        chatlog.logger.close()
+        if log_index:
+            log_index.close()
         loop.stop()
         loop.close()
+
+
+def run_shard(username, password):
+    """Supervisor worker target, one bot on a share of the rooms"""
+
+    def target(index, rooms, conn):
+        global shard
+        shard = supervisor.Link(conn, index)
+        cache.remote = shard
+        SHARED_LOGS.add(username.lower())
+        # Ctrl-C goes to the whole process group, let the supervisor stop us
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        run_bot(username, password, rooms)
+
+    return target
+
+
+if __name__ == "__main__":
+    with open(cwd + "/config.yaml") as configyaml:
+        config = yaml.safe_load(configyaml)
+
+    if "BOT_PROD" in os.environ:
+        rooms = config["rooms"]["prod"]
+    else:
+        rooms = config["rooms"]["dev"]
+
+    if supervisor.SHARDS > 1:
+        # Load once here so every worker shares the pages until it reloads
+        load_memes()
+        memes_loaded.set()
+        plugins.log_report()
+        gc.freeze()
+        try:
+            supervisor.Supervisor(
+                rooms,
+                supervisor.SHARDS,
+                run_shard(config["username"], config["password"]),
+                log=lambda message: log("status", None, "[supervisor] " + message),
+            ).run()
+        except KeyboardInterrupt:
+            print("[KeyboardInterrupt] Killed bot.")
+    else:
+        run_bot(config["username"], config["password"], rooms)
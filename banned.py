@@ -0,0 +1,76 @@
+class WordMatcher:
+    """Aho-Corasick automaton that finds any of many words in one pass
+
+    The failure links are folded into the transition table when it is built,
+    so scanning is a single dict lookup per character.
+    """
+
+    def __init__(self, words):
+        self.words = [w for w in dict.fromkeys(words) if w]
+
+        delta = [{}]
+        out = [None]
+        for word in self.words:
+            state = 0
+            for ch in word:
+                nxt = delta[state].get(ch)
+                if nxt is None:
+                    nxt = len(delta)
+                    delta[state][ch] = nxt
+                    delta.append({})
+                    out.append(None)
+                state = nxt
+            if out[state] is None:
+                out[state] = word
+
+        # Breadth first so every fail target is complete before it is copied
+        fail = [0] * len(delta)
+        queue = list(delta[0].values())
+        for state in queue:
+            for ch, nxt in delta[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in delta[f]:
+                    f = fail[f]
+                fail[nxt] = delta[f].get(ch, 0) if delta[f].get(ch) != nxt else 0
+                if out[nxt] is None:
+                    out[nxt] = out[fail[nxt]]
+
+        for state in queue:
+            inherited = delta[fail[state]]
+            goto = delta[state]
+            for ch, nxt in inherited.items():
+                if ch not in goto:
+                    goto[ch] = nxt
+
+        self._delta = delta
+        self._out = out
+
+    def search(self, text):
+        """Return the first word found in text, or None"""
+        delta = self._delta
+        out = self._out
+        state = 0
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if out[state] is not None:
+                return out[state]
+        return None
+
+
+class BannedWords:
+    """Banned word list backed by a file, call reload() when it changes"""
+
+    def __init__(self, path):
+        self.path = path
+        self.matcher = WordMatcher([])
+        self.reload()
+
+    def reload(self):
+        with open(self.path) as banned_file:
+            words = [line.rstrip("\n") for line in banned_file]
+        # Swap in one assignment so a message never sees half a matcher
+        self.matcher = WordMatcher(words)
+
+    def search(self, text):
+        return self.matcher.search(text)
@@ -0,0 +1,69 @@
+"""
+Banned word matcher versus the old substring scan
+
+    python3 bench/bench_banned.py [number of banned words]
+
+Uses synthetic words and chat lines so it runs without the meme files.
+"""
+
+import os
+import sys
+import random
+import string
+import timeit
+
+cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, cwd)
+
+from banned import WordMatcher
+
+
+def random_word(rng, lo, hi):
+    return "".join(
+        rng.choice(string.ascii_lowercase) for _ in range(rng.randint(lo, hi))
+    )
+
+
+def main():
+    word_count = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    rng = random.Random(420)
+
+    words = [random_word(rng, 4, 12) for _ in range(word_count)]
+
+    start = timeit.default_timer()
+    matcher = WordMatcher(words)
+    build_ms = (timeit.default_timer() - start) * 1000
+    print("{} words, built in {:.1f} ms".format(word_count, build_ms))
+
+    for length in [20, 80, 300]:
+        # Chat text with spaces/punctuation already stripped like on_message does
+        clean = [random_word(rng, length, length) for _ in range(200)]
+        dirty = [
+            text[: length // 2] + rng.choice(words) + text[length // 2 :]
+            for text in clean
+        ]
+
+        for text in clean + dirty:
+            naive = any(w in text for w in words)
+            assert naive == (matcher.search(text) is not None), text
+
+        for label, texts in [("clean", clean), ("banned", dirty)]:
+            naive_time = timeit.timeit(
+                lambda: [any(w in t for w in words) for t in texts], number=5
+            )
+            matcher_time = timeit.timeit(
+                lambda: [matcher.search(t) for t in texts], number=5
+            )
+            runs = 5 * len(texts)
+            print(
+                "{:>4} chars {:<6} substring {:8.1f} us  automaton {:6.1f} us".format(
+                    length,
+                    label,
+                    naive_time / runs * 1e6,
+                    matcher_time / runs * 1e6,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Guide commands on raw guide JSON versus the pre-indexed GuideModel
+
+    python3 bench/bench_guide.py [number of channels]
+
+Builds a synthetic guide (2000 channels by default) and times !movies,
+!sports, !reality and !egg the old way, scanning dicts and parsing times per
+command, against index lookups on the model, and times writing and loading
+a guide snapshot.  Needs kekg_memes.json to import kekg, its labels are
+replaced with synthetic ones.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import timeit
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pytz
+
+cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, cwd)
+
+import kekg
+
+GENRES = [["Movie"], ["Sports"], ["News"], ["Reality"], ["Comedy"], None]
+TITLES = ["*NFL Football", "*College Football", "Law & Order", "The Matrix"]
+
+
+def make_guide(rng, count, now):
+    def broadcast(start, runtime):
+        return {
+            "title": rng.choice(TITLES) + rng.choice(["", " 2", " Live"]),
+            "plot": "All the action. No. 5 plays St. Louis. " * 3,
+            "genre": rng.choice(GENRES),
+            "runtime": runtime,
+            "starttime": time.strftime(kekg.GUIDE_TIME, time.gmtime(start)),
+            "endtime": time.strftime(
+                kekg.GUIDE_TIME, time.gmtime(start + runtime * 60)
+            ),
+            "progress": max(0, int(now - start)),
+            "progresspercentage": max(0, (now - start) / (runtime * 60) * 100),
+        }
+
+    channels = []
+    for i in range(count):
+        runtime = rng.choice([30, 60, 90, 120, 180])
+        start = now - rng.randrange(0, runtime * 60)
+        channels.append(
+            {
+                "channelnumber": 100 + i,
+                "label": "LABEL{}".format(i),
+                "channel": "Channel {}".format(i),
+                "broadcastnow": broadcast(start, runtime),
+                "broadcastnext": broadcast(start + runtime * 60, 60),
+            }
+        )
+    return {"result": {"channels": channels}}
+
+
+# What kekg did before GuideModel, on the raw dicts
+
+
+def old_filter_channels(guide, numbers=[], labels=[], programs=[], reject=False):
+    filtered = []
+    for ch in guide["result"]["channels"]:
+        number_match = not numbers or (str(ch["channelnumber"]) in numbers) ^ reject
+        label_match = not labels or (ch["label"] in labels) ^ reject
+        program_match = not programs or (
+            ch.get("broadcastnow")
+            and (ch["broadcastnow"].get("title") in programs) ^ reject
+        )
+        if number_match and label_match and program_match:
+            filtered.append(ch)
+    return filtered
+
+
+def old_runs_over_jeop(broadcast):
+    start = broadcast.get("starttime")
+    end = broadcast.get("endtime")
+    if not start or not end:
+        return False
+    eastern_timezone = pytz.timezone("US/Eastern")
+    startdate = (
+        datetime.strptime(start, "%Y-%m-%d %H:%M:%S")
+        .replace(tzinfo=pytz.UTC)
+        .astimezone(eastern_timezone)
+    )
+    enddate = (
+        datetime.strptime(end, "%Y-%m-%d %H:%M:%S")
+        .replace(tzinfo=pytz.UTC)
+        .astimezone(eastern_timezone)
+    )
+    jeop_start = startdate.replace(hour=19, minute=5, second=0, microsecond=0)
+    if startdate.time() > jeop_start.time():
+        jeop_start += timedelta(days=1)
+    if jeop_start.weekday() > 4:
+        return False
+    return startdate.time() < jeop_start.time() and enddate.time() > jeop_start.time()
+
+
+def old_good_movie(broadcast):
+    return (
+        broadcast.get("runtime", 0) > 60
+        and not broadcast.get("title", "").startswith("*")
+        and not old_runs_over_jeop(broadcast)
+    )
+
+
+def old_bad_movie(broadcast):
+    genre = broadcast.get("genre")
+    return bool(genre) and "Movie" in genre and not old_runs_over_jeop(broadcast)
+
+
+def old_good_sports(broadcast):
+    on_now = broadcast.get("title")
+    return on_now.startswith("*") and "College" not in on_now
+
+
+def old_program_timing(broadcast):
+    current_time = datetime.now(pytz.UTC)
+    starttime = datetime.strptime(
+        broadcast.get("starttime", ""), "%Y-%m-%d %H:%M:%S"
+    ).replace(tzinfo=pytz.UTC)
+    if starttime > current_time:
+        return "In {} minutes".format(
+            round((starttime - current_time).total_seconds() / 60)
+        )
+    return "{}% done".format(math.floor(broadcast.get("progresspercentage", 50)))
+
+
+def old_starting_now(channels, test, default_now=False):
+    started, coming_up = [], []
+    for channel in channels:
+        now = channel.get("broadcastnow")
+        next = channel.get("broadcastnext")
+        if now:
+            now_starting = now.get("progresspercentage", 50) < 15
+            now_remaining = math.floor(
+                ((now.get("runtime", 420) * 60) - now.get("progress", 210 * 60)) / 60
+            )
+            if now_starting and test(now):
+                started.append((channel, now))
+            elif next and now_remaining <= 15 and test(next):
+                coming_up.append((channel, next))
+            elif default_now and test(now):
+                started.append((channel, now))
+    return started, coming_up
+
+
+def old_command(guide, test, default_now, **filters):
+    started, coming_up = old_starting_now(
+        old_filter_channels(guide, **filters), test, default_now
+    )
+    return [old_program_timing(br) for _, br in started + coming_up]
+
+
+def new_command(test, default_now, **filters):
+    started, coming_up = kekg.starting_now(
+        kekg.filter_channels(**filters), test, default_now
+    )
+    return [kekg.program_timing(br) for _, br in started + coming_up]
+
+
+def per_call(func, number=20):
+    return timeit.timeit(func, number=number) / number * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rng = random.Random(420)
+    guide = make_guide(rng, count, time.time())
+    size = len(json.dumps(guide))
+
+    kekg.movies_labels = ["LABEL{}".format(i) for i in range(0, count, 20)]
+    kekg.sports_labels = ["LABEL{}".format(i) for i in range(5, count, 25)]
+    kekg.reality_numbers = [str(100 + i) for i in range(7, count, 100)]
+    kekg.fetch_kekg = lambda: guide
+
+    start = timeit.default_timer()
+    kekg.GuideModel(guide)
+    build_ms = (timeit.default_timer() - start) * 1000
+    tracemalloc.start()
+    traced = kekg.GuideModel(guide)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del traced
+    print(
+        "{} channels, {:.0f} KB of JSON, model built in {:.1f} ms, {:.1f} MB".format(
+            count, size / 1000, build_ms, memory / 1e6
+        )
+    )
+    kekg.guide_model()
+
+    state = {
+        "guide": guide,
+        "etag": '"bench"',
+        "last_modified": None,
+        "fetched": time.time(),
+        "expires": time.time() + kekg.MAX_REFRESH,
+    }
+    folder = tempfile.mkdtemp()
+    start = timeit.default_timer()
+    path = kekg.write_snapshot(state, folder)
+    write_ms = (timeit.default_timer() - start) * 1000
+    print(
+        "snapshot {:.0f} KB, written in {:.1f} ms, loaded in {:.1f} ms".format(
+            os.path.getsize(path) / 1000,
+            write_ms,
+            per_call(lambda: kekg.read_snapshot(path), number=5),
+        )
+    )
+
+    commands = [
+        ("!movies", kekg.good_movie, old_good_movie, False,
+         {"labels": kekg.movies_labels}),
+        ("!sports", kekg.good_sports, old_good_sports, True,
+         {"labels": kekg.sports_labels}),
+        ("!reality", kekg.always_true, kekg.always_true, True,
+         {"numbers": kekg.reality_numbers}),
+        ("!egg", kekg.always_true, kekg.always_true, True,
+         {"programs": ["*College Football"]}),
+        ("!moviesalt", kekg.bad_movie, old_bad_movie, False, {}),
+    ]  # fmt: skip
+    print("{:<12} {:>8} {:>10} {:>10}".format("command", "lines", "old ms", "model ms"))
+    for name, test, old_test, default_now, filters in commands:
+        lines = new_command(test, default_now, **filters)
+        print(
+            "{:<12} {:>8} {:>10.3f} {:>10.3f}".format(
+                name,
+                len(lines),
+                per_call(lambda: old_command(guide, old_test, default_now, **filters)),
+                per_call(lambda: new_command(test, default_now, **filters)),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
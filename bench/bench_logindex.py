@@ -0,0 +1,124 @@
+"""
+Ingest throughput, index size and query time of the log index
+
+    python3 bench/bench_logindex.py [lines]
+
+Writes synthetic room logs to a temp folder, bulk imports them, re-runs the
+import to show it resumes, then feeds more lines through the chat logger the
+way the bot does.
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, cwd)
+
+import chatlog
+import logindex
+
+ROOMS = ["devroom", "lmaoroom", "kekroom", "balbroom"]
+USERS = ["user{}".format(i) for i in range(500)]
+WORDS = (
+    "lmao the game tonight is on channel movie guide kek based check this link "
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ who watching anyone awake"
+).split()
+
+
+def synthetic_line(rng, stamp):
+    body = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 20)))
+    return "[{}] <{}> {}\n".format(stamp, rng.choice(USERS), body)
+
+
+def write_logs(log_dir, total):
+    rng = random.Random(1)
+    per_room = total // len(ROOMS)
+    size = 0
+    for room in ROOMS:
+        with open(os.path.join(log_dir, room + ".log"), "w") as logfile:
+            for i in range(per_room):
+                stamp = "2024-01-{:02d} {:02d}:{:02d}:{:02d}".format(
+                    1 + i * 28 // per_room, i % 24, i % 60, i % 60
+                )
+                line = synthetic_line(rng, stamp)
+                logfile.write(line)
+                size += len(line)
+        # Not room chat, the importer should skip it
+        with open(os.path.join(log_dir, room + "_deleted.log"), "w") as logfile:
+            logfile.write(synthetic_line(rng, "2024-01-01 00:00:00"))
+    return per_room * len(ROOMS), size
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log_dir = os.path.join(tmp, "logs")
+        os.makedirs(log_dir)
+        lines, size = write_logs(log_dir, total)
+        print("logs      {} lines, {:.1f} MB".format(lines, size / 1e6))
+
+        index = logindex.LogIndex(os.path.join(tmp, "index.sqlite3"))
+        start = time.perf_counter()
+        imported = index.import_dir(log_dir)
+        elapsed = time.perf_counter() - start
+        print(
+            "import    {} lines in {:.2f}s, {:.0f} lines/s".format(
+                imported, elapsed, imported / elapsed
+            )
+        )
+
+        start = time.perf_counter()
+        again = index.import_dir(log_dir)
+        print(
+            "re-run    {} lines in {:.1f} ms".format(
+                again, (time.perf_counter() - start) * 1000
+            )
+        )
+
+        # Live lines go through the chat logger listener, one flush per line
+        # since the background flusher isn't running here
+        logger = chatlog.ChatLogger(log_dir)
+        logger.listeners.append(index.add_lines)
+        rng = random.Random(2)
+        live = 20000
+        start = time.perf_counter()
+        for _ in range(live):
+            logger.write(rng.choice(ROOMS), None, synthetic_line(rng, "x")[4:-1])
+        logger.close()
+        elapsed = time.perf_counter() - start
+        print(
+            "live      {} lines, {:.0f} lines/s unbatched".format(live, live / elapsed)
+        )
+
+        stats = index.stats()
+        print(
+            "index     {} lines, {} users, {:.1f} MB ({:.0f}% of logs)".format(
+                stats["lines"],
+                stats["users"],
+                stats["bytes"] / 1e6,
+                stats["bytes"] / size * 100,
+            )
+        )
+
+        for label, query in [
+            ("seen", lambda: index.seen("user42")),
+            ("grep", lambda: index.grep("youtube")),
+            ("grep rare", lambda: index.grep("awake kek based")),
+        ]:
+            start = time.perf_counter()
+            for _ in range(20):
+                query()
+            print(
+                "{:<9} {:.2f} ms".format(
+                    label, (time.perf_counter() - start) / 20 * 1000
+                )
+            )
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
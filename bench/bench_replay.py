@@ -0,0 +1,335 @@
+"""
+Replays chat through LmaoBot.on_message with every network call faked
+
+    python3 bench/bench_replay.py [--mix mixed] [--messages 5000] [--latency 0.02]
+    python3 bench/bench_replay.py --mix chat=70,stash=20,mention=10
+    python3 bench/bench_replay.py --replay logs/devroom.log
+
+Reports messages/sec, p50/p99 on_message latency per message kind and
+allocations per message (tracemalloc).  Fake YouTube, OMDb, vxtwitter,
+Wolfram and LLM calls sleep for --latency seconds, the LLM goes through
+bench/fake_llm.py.  Needs the bot's data files like async.py does.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import string
+import asyncio
+import argparse
+import tempfile
+import importlib
+import tracemalloc
+from types import SimpleNamespace
+
+cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, cwd)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import chatango
+import chatlog
+import fetch
+import metrics
+import logindex
+import governor
+import fake_llm
+
+bot = importlib.import_module("async")
+
+MIXES = {
+    "chat": {"chat": 1},
+    "stash": {"chat": 1, "stash": 1},
+    "links": {"chat": 2, "youtube": 1, "twitter": 1, "imdb": 1},
+    "mentions": {"chat": 4, "mention": 1},
+    "mixed": {
+        "chat": 70,
+        "stash": 12,
+        "youtube": 5,
+        "twitter": 3,
+        "imdb": 2,
+        "mention": 3,
+        "wolfram": 2,
+        "banned": 3,
+    },
+}
+
+WORDS = (
+    "lmao the game tonight is on what channel movie kek based anyone awake "
+    "this ref is blind who is watching that was wild pass the remote"
+).split()
+USERS = ["user{}".format(i) for i in range(200)]
+# Ids repeat so the unfurl caches see some hits
+POOL = 200
+
+
+class SinkRoom(chatango.Room):
+    """Sits under LmaoRoom in the MRO so queued sends end here, not the socket"""
+
+    async def send_message(self, message, **kwargs):
+        self.sent += 1
+
+    async def delete_message(self, message):
+        self.deleted += 1
+
+
+class BenchRoom(bot.LmaoRoom, SinkRoom):
+    def __init__(self, name):
+        super().__init__(name)
+        self.sent = 0
+        self.deleted = 0
+        self.rate_limit = 0
+        self._maxlen = 2700
+
+
+class FakeMessage:
+    __slots__ = ("user", "body", "flags", "id")
+
+    def __init__(self, user, body, msg_id):
+        self.user = SimpleNamespace(name=user, isanon=False)
+        self.body = body
+        self.flags = chatango.MessageFlags(0)
+        self.id = str(msg_id)
+
+
+def fake_id(rng, n, alphabet=string.ascii_letters + string.digits):
+    return "".join(rng.choice(alphabet) for _ in range(n))
+
+
+def make_generators(rng):
+    yt_ids = [fake_id(rng, 11) for _ in range(POOL)]
+    stash_keys = list(bot.stash_memes) or ["/lol"]
+    banned = bot.banned_words.matcher.words if bot.banned_words else []
+    chat = lambda: " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 14)))
+
+    return {
+        "chat": chat,
+        "stash": lambda: "{} {}".format(rng.choice(stash_keys), chat()),
+        "youtube": lambda: "https://www.youtube.com/watch?v=" + rng.choice(yt_ids),
+        "twitter": lambda: "https://x.com/someone/status/{}".format(
+            rng.randrange(POOL)
+        ),
+        "imdb": lambda: "https://www.imdb.com/title/tt{:07d}/".format(
+            rng.randrange(POOL)
+        ),
+        "mention": lambda: "@lmaolover " + chat(),
+        "wolfram": lambda: "?? " + chat(),
+        "banned": lambda: chat() + " " + (rng.choice(banned) if banned else "ok"),
+    }
+
+
+def parse_mix(text):
+    if text in MIXES:
+        return MIXES[text]
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def synthetic(count, mix, rooms, seed=1):
+    rng = random.Random(seed)
+    generators = make_generators(rng)
+    unknown = set(mix) - set(generators)
+    if unknown:
+        raise SystemExit("unknown message kinds: {}".format(", ".join(unknown)))
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    return [
+        (kind, rng.choice(rooms), rng.choice(USERS), generators[kind]())
+        for kind in kinds
+    ]
+
+
+def recorded(path, rooms):
+    """Lines of a room log, all sent to the first room"""
+    traffic = []
+    with open(path, errors="replace") as logfile:
+        for line in logfile:
+            match = logindex.line_re.match(line.rstrip("\n"))
+            if match:
+                _, user, body = match.groups()
+                traffic.append(("log", rooms[0], user, body))
+    return traffic
+
+
+def install_fakes(latency):
+    async def fake_request(method, url, timeout=None, **kwargs):
+        await asyncio.sleep(latency)
+        if "vxtwitter" in url:
+            body = {"text": "tweet text", "media_extended": []}
+        elif "omdbapi" in url:
+            body = {
+                "Title": "Movie",
+                "Year": "1999",
+                "imdbRating": "7.1",
+                "Plot": "Things happen.",
+                "Poster": "https://example.com/p.jpg",
+                "imdbID": "tt0000001",
+            }
+        else:
+            return fetch.Response(url, 200, {}, b"<html><title>page</title></html>")
+        return fetch.Response(url, 200, {}, json.dumps(body).encode())
+
+    def fake_youtube(query, max_results=5):
+        time.sleep(latency)
+        video_id = query.strip('"')
+        return SimpleNamespace(
+            videos=[
+                {
+                    "id": video_id,
+                    "title": "video",
+                    "thumbnails": ["https://i.ytimg.com/x.jpg"],
+                    "url_suffix": "/watch?v=" + video_id,
+                }
+            ]
+        )
+
+    async def fake_wolfram(query):
+        await asyncio.sleep(latency)
+        return "42"
+
+    fetch.request = fake_request
+    bot.YoutubeSearch = fake_youtube
+    bot.wolfram = SimpleNamespace(chatbot_wolfram_query_async=fake_wolfram)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0
+
+
+async def replay(client, rooms, traffic, concurrency):
+    latencies = {}
+    queue = asyncio.Queue()
+    for n, item in enumerate(traffic):
+        queue.put_nowait((n, item))
+
+    async def worker():
+        while not queue.empty():
+            n, (kind, room_name, user, body) = queue.get_nowait()
+            room = rooms[room_name]
+            message = FakeMessage(user, body, n)
+            room._history.append(message)
+            start = time.perf_counter()
+            await client.on_message(room, message)
+            latencies.setdefault(kind, []).append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies
+
+
+async def allocations(client, rooms, traffic):
+    """Peak and retained traced bytes per message, run one at a time"""
+    tracemalloc.start()
+    peak = retained = 0
+    for n, (kind, room_name, user, body) in enumerate(traffic):
+        room = rooms[room_name]
+        message = FakeMessage(user, body, n)
+        room._history.append(message)
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        await client.on_message(room, message)
+        current, top = tracemalloc.get_traced_memory()
+        peak += top - before
+        retained += current - before
+    tracemalloc.stop()
+    return peak / len(traffic), retained / len(traffic)
+
+
+async def main(args):
+    tmp = tempfile.mkdtemp()
+    chatlog.logger.log_dir = tmp
+    fetch.attach(asyncio.get_running_loop())
+
+    bot.load_memes()
+    bot.memes_loaded.set()
+    install_fakes(args.latency)
+    if not args.governor:
+        # Synthetic users spam far past any sane budget
+        governor.USER_BUDGET = governor.ROOM_BUDGET = float("inf")
+        governor.QUOTAS = {}
+        governor.COLLAPSE = frozenset()
+    runner, base_url = await fake_llm.start(delay=args.latency / 10)
+    os.environ["XAI_BASE_URL"] = base_url
+    os.environ["XAI_API_KEY"] = "fake"
+
+    # One room per group so group-only routes get exercised
+    room_names = list(dict.fromkeys(names[0] for names in bot.chat.values() if names))
+    room_names += ["benchroom{}".format(i) for i in range(args.rooms)]
+    room_names = room_names[: args.rooms]
+    client = bot.LmaoBot("lmaolover", "", [], room_class=BenchRoom)
+    rooms = {name: BenchRoom(name) for name in room_names}
+
+    if args.replay:
+        traffic = recorded(args.replay, room_names)[: args.messages]
+        mix = "replay of {}".format(args.replay)
+    else:
+        traffic = synthetic(args.messages, parse_mix(args.mix), room_names)
+        mix = args.mix
+
+    # Warm up imports, caches and the LLM client
+    await replay(client, rooms, traffic[:200], args.concurrency)
+
+    elapsed, latencies = await replay(client, rooms, traffic, args.concurrency)
+    total = sum(len(v) for v in latencies.values())
+    print(
+        "{} messages ({}) in {:.2f}s, {:.0f} msg/s, {} rooms, concurrency {}".format(
+            total, mix, elapsed, total / elapsed, len(rooms), args.concurrency
+        )
+    )
+    print("{:<10} {:>7} {:>10} {:>10}".format("kind", "count", "p50 ms", "p99 ms"))
+    every = [t for values in latencies.values() for t in values]
+    for kind, values in sorted(latencies.items()) + [("all", every)]:
+        print(
+            "{:<10} {:>7} {:>10.3f} {:>10.3f}".format(
+                kind,
+                len(values),
+                percentile(values, 0.5) * 1000,
+                percentile(values, 0.99) * 1000,
+            )
+        )
+
+    peak, retained = await allocations(client, rooms, traffic[: args.traced])
+    print(
+        "allocations  {:.1f} KB peak, {:.0f} B retained per message ({} traced)".format(
+            peak / 1024, retained, min(args.traced, len(traffic))
+        )
+    )
+
+    if args.governor:
+        for line in metrics.summary():
+            if line.startswith("[governor]"):
+                print(line)
+
+    await asyncio.sleep(0.5)
+    print(
+        "sent {} room messages, deleted {}".format(
+            sum(room.sent for room in rooms.values()),
+            sum(room.deleted for room in rooms.values()),
+        )
+    )
+    await runner.cleanup()
+    await fetch.close()
+    chatlog.logger.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--mix",
+        default="mixed",
+        help="{} or kind=weight,...".format(", ".join(MIXES)),
+    )
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--rooms", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds")
+    parser.add_argument("--traced", type=int, default=500)
+    parser.add_argument("--replay", help="room log file to replay")
+    parser.add_argument(
+        "--governor", action="store_true", help="keep the flood governor budgets"
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,151 @@
+"""
+Per-message dispatch cost of the router versus the old if/elif cascade
+
+    python3 bench/bench_router.py [iterations]
+
+Only routing is measured, handlers are never called.  Needs the bot's data
+files (rooms.yaml, *_memes.txt, stash_memes.json) like async.py does.
+"""
+
+import os
+import sys
+import timeit
+import importlib
+from types import SimpleNamespace
+
+cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, cwd)
+
+bot = importlib.import_module("async")
+
+SAMPLES = [
+    "lmao",
+    "what are we watching tonight",
+    "/jameis",
+    "/jameis /phins spam",
+    "!movies",
+    "!egg",
+    "?? population of canada",
+    "? never gonna give you up",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://x.com/someone/status/1234567890",
+    "check this https://www.theepochtimes.com/some/article",
+    "!imdb the matrix",
+    "@lmaolover what is the meaning of life",
+    "church is in session",
+    "lil cnn",
+    "x" * 320,
+]
+
+
+def legacy_dispatch(room_name, body, bot_user_lower="lmaolover"):
+    chat = bot.chat
+    message_body_lower = body.lower()
+    link_matches = bot.link_re.search(body)
+
+    if (
+        f"@{bot_user_lower}" in message_body_lower
+        and room_name in chat["kek"] + chat["dev"] + chat["lmao"]
+    ):
+        return "mention"
+    elif bot.yt_re.search(body):
+        return "youtube"
+    elif bot.twitter_re.search(body):
+        return "twitter"
+    elif (
+        len(message_body_lower) > 2
+        and message_body_lower[0] == "?"
+        and message_body_lower[1] == "?"
+        and message_body_lower[2] != "?"
+    ):
+        return "wolframalpha"
+    elif (
+        len(message_body_lower) > 1
+        and message_body_lower[0] == "?"
+        and message_body_lower[1] != "?"
+    ):
+        return "youtube-search"
+    elif bot.imdb_re.search(body) or message_body_lower.startswith("!imdb "):
+        return "imdb"
+    elif link_matches and any(
+        link_type in link_matches.group(0) for link_type in bot.propaganda_hosts
+    ):
+        return "propaganda"
+    elif link_matches and any(
+        link_type in link_matches.group(0)
+        for link_type in ["dailymotion.com", "strawpoll.me", "open.spotify.com"]
+    ):
+        return "link"
+    elif (
+        [cmd for cmd in bot.kodi_actions.keys() if cmd == message_body_lower.strip()]
+        and room_name in chat["kek"] + chat["dev"]
+        and "someone" in chat["mods"]
+    ):
+        return "kodi"
+    elif [
+        cmd for cmd in bot.kekg_actions.keys() if cmd == message_body_lower.strip()
+    ] and room_name in chat["kek"] + chat["dev"]:
+        return "kekg"
+    elif [
+        cmd for cmd in bot.lmao_actions.keys() if cmd == message_body_lower.strip()
+    ] and room_name in chat["lmao"] + chat["dev"]:
+        return "lmao"
+    elif bot.command_re.findall(body):
+        return "stash"
+    elif "alex jones" in message_body_lower or "infowars" in message_body_lower:
+        return "infowars"
+    elif "church" in message_body_lower or "satan" in message_body_lower:
+        return "church"
+    elif "preach" in message_body_lower or "gospel" in message_body_lower:
+        return "gospel"
+    elif room_name in chat["balb"] + chat["dev"] and len(message_body_lower) > 299:
+        return "tldr"
+    elif (
+        "lil" in message_body_lower and "cnn" in message_body_lower
+    ) or message_body_lower.split().count("cnn") >= 3:
+        return "cnn"
+    return None
+
+
+def router_dispatch(room_name, body, bot_user_lower="lmaolover"):
+    message = SimpleNamespace(body=body, user=SimpleNamespace(name="someone"))
+    link_matches = bot.link_re.search(body)
+    ctx = bot.MessageContext(
+        SimpleNamespace(name=room_name),
+        message,
+        bot_user_lower,
+        body.lower(),
+        link_matches.group(0) if link_matches else None,
+    )
+    route = bot.router.dispatch(ctx)
+    return route.name if route else None
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    room_name = (bot.chat.get("dev") or ["devchat"])[0]
+
+    mismatches = [
+        body
+        for body in SAMPLES
+        if legacy_dispatch(room_name, body) != router_dispatch(room_name, body)
+    ]
+    for body in mismatches:
+        print(
+            "mismatch: {!r} legacy={} router={}".format(
+                body[:40],
+                legacy_dispatch(room_name, body),
+                router_dispatch(room_name, body),
+            )
+        )
+
+    for name, func in [("cascade", legacy_dispatch), ("router", router_dispatch)]:
+        elapsed = timeit.timeit(
+            lambda: [func(room_name, body) for body in SAMPLES], number=iterations
+        )
+        per_msg = elapsed / (iterations * len(SAMPLES)) * 1e6
+        print("{:<8} {:8.2f} us/message".format(name, per_msg))
+
+
+if __name__ == "__main__":
+    main()
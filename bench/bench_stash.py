@@ -0,0 +1,141 @@
+"""
+Stash index lookups and "did you mean" suggestions on a big stash
+
+    python3 bench/bench_stash.py [number of stash entries]
+
+Writes a synthetic stash_memes.json (50k entries by default) to a temp
+folder, so it runs without the meme files.  Compares resolving commands
+with the old dict probing to StashIndex and times suggestions for typos.
+"""
+
+import os
+import sys
+import json
+import random
+import string
+import tempfile
+import timeit
+import tracemalloc
+
+cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, cwd)
+
+from stash import StashIndex
+
+SYLLABLES = (
+    "ba be bi bo ka ke ki ko ma me mi mo na ne ni no ra re ri ro sa se si so "
+    "ta te ti to la le li lo da de di do ja je ji jo pu gu zu chi sha"
+).split()
+
+
+def make_stash(rng, count):
+    stash = {}
+    while len(stash) < count:
+        name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 5)))
+        name += rng.choice(["", "", "1", "2", "z", "s"])
+        stash["/" + name] = "https://i.imgur.com/{}.jpg".format(
+            "".join(rng.choice(string.ascii_letters) for _ in range(7))
+        )
+    return stash
+
+
+def typo(rng, word):
+    """One random insert, delete, swap or substitution"""
+    i = rng.randrange(1, len(word))
+    edit = rng.choice(["insert", "delete", "swap", "sub"])
+    letter = rng.choice(string.ascii_lowercase)
+    if edit == "insert":
+        return word[:i] + letter + word[i:]
+    if edit == "delete":
+        return word[:i] + word[i + 1 :]
+    if edit == "swap" and i < len(word) - 1:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2 :]
+    return word[:i] + letter + word[i + 1 :]
+
+
+def old_resolve(stash_memes, match):
+    """The probing handle_stash did before StashIndex"""
+    if match not in stash_memes and match[-1] == "s" and match[:-1] in stash_memes:
+        return match[:-1]
+    if match not in stash_memes and match[-2:] == "es" and match[:-2] in stash_memes:
+        return match[:-2]
+    return match if match in stash_memes else None
+
+
+def per_call(func, items, number=5):
+    total = timeit.timeit(lambda: [func(item) for item in items], number=number)
+    return total / (number * len(items)) * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    rng = random.Random(420)
+
+    path = os.path.join(tempfile.mkdtemp(), "stash_memes.json")
+    with open(path, "w") as stashjson:
+        json.dump(make_stash(rng, count), stashjson)
+
+    start = timeit.default_timer()
+    with open(path) as stashjson:
+        stash_memes = json.load(stashjson)
+    load_ms = (timeit.default_timer() - start) * 1000
+
+    start = timeit.default_timer()
+    index = StashIndex(stash_memes)
+    build_ms = (timeit.default_timer() - start) * 1000
+
+    # Tracing slows the build down a lot, measure size on a second one
+    tracemalloc.start()
+    traced = StashIndex(stash_memes)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del traced
+    print(
+        "{} entries, json {:.0f} ms, index built in {:.0f} ms, {:.1f} MB".format(
+            count, load_ms, build_ms, size / 1e6
+        )
+    )
+
+    keys = list(stash_memes)
+    hits = rng.sample(keys, 1000)
+    plurals = [key + "s" for key in hits if key + "s" not in stash_memes]
+    misses = ["/" + typo(rng, key[1:]) for key in hits]
+    misses = [m for m in misses if m not in stash_memes and m not in index.plurals]
+    hopeless = ["/qx" + "".join(rng.sample("wvxyq", 4)) for _ in range(50)]
+
+    print("{:<10} {:>12} {:>12}".format("command", "old us", "index us"))
+    for label, items in [("hit", hits), ("plural", plurals), ("miss", misses)]:
+        print(
+            "{:<10} {:>12.2f} {:>12.2f}".format(
+                label,
+                per_call(lambda m: old_resolve(stash_memes, m), items),
+                per_call(index.resolve, items),
+            )
+        )
+
+    index.suggest(misses[:1])
+    found = sum(1 for m in misses if index.suggest([m]))
+    print(
+        "suggest one typo     {:8.1f} us  ({}/{} got a suggestion)".format(
+            per_call(lambda m: index.suggest([m]), misses, number=1),
+            found,
+            len(misses),
+        )
+    )
+    print(
+        "suggest batch of 5   {:8.1f} us".format(
+            per_call(index.suggest, [misses[i : i + 5] for i in range(0, 500, 5)], 1)
+        )
+    )
+    print(
+        "suggest no neighbour {:8.1f} us  (no suggestion)".format(
+            per_call(lambda m: index.suggest([m]), hopeless, number=1)
+        )
+    )
+    print(
+        "stash roll           {:8.2f} us".format(per_call(lambda _: index.roll(), hits))
+    )
+
+
+if __name__ == "__main__":
+    main()
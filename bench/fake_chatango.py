@@ -0,0 +1,240 @@
+"""
+Local stand-in for the Chatango room servers, enough for load testing
+
+    python3 bench/fake_chatango.py [port]
+
+Speaks the part of the websocket room protocol chatango-lib uses: bauth
+login answered with ok/inited, a little join history, bm sends echoed back as
+b/u message events, delmsg answered with delete, ratelimit setup and show_fw
+flood warnings when a connection sends faster than FLOOD_MESSAGES per
+FLOOD_WINDOW seconds.  Every room name is accepted.  PMs aren't emulated.
+
+inject() posts a chat line from a fake user to every connection in a room,
+which is how bench/load_chatango.py drives traffic at the bot.
+"""
+
+import re
+import sys
+import html
+import time
+import asyncio
+import itertools
+from collections import deque
+from aiohttp import web, WSMsgType
+
+TERMINATOR = "\r\n\0"
+
+# More sends than this inside the window gets a flood warning
+FLOOD_MESSAGES = 8
+FLOOD_WINDOW = 5.0
+
+tag_re = re.compile(r"<[^>]*>")
+
+
+def strip_tags(raw):
+    return html.unescape(tag_re.sub("", raw))
+
+
+class Connection:
+    def __init__(self, ws, server):
+        self.ws = ws
+        self.server = server
+        self.room = None
+        self.name = None
+        self.sends = deque()
+        self.flood_warnings = 0
+
+    async def send(self, *args):
+        if not self.ws.closed:
+            await self.ws.send_str(":".join(str(a) for a in args) + TERMINATOR)
+
+
+class Room:
+    def __init__(self, name, rate_limit=0):
+        self.name = name
+        self.rate_limit = rate_limit
+        self.connections = set()
+        self.history = deque(maxlen=20)
+        # Trigger times waiting for the bot to answer, oldest first
+        self.pending = deque()
+        self.latencies = []
+        self.bot_messages = 0
+        self.deletes = 0
+        self.user_messages = 0
+
+
+class FakeChatango:
+    def __init__(self, rate_limit=0, history=5):
+        self.rate_limit = rate_limit
+        self.history_size = history
+        self.rooms = {}
+        self._ids = itertools.count(1)
+        self.logins = 0
+        self.flood_warnings = 0
+
+    def room(self, name):
+        room = self.rooms.get(name)
+        if room is None:
+            room = self.rooms[name] = Room(name, self.rate_limit)
+            for i in range(self.history_size):
+                self._remember(
+                    room, "olduser{}".format(i), "earlier message {}".format(i)
+                )
+        return room
+
+    def _remember(self, room, user, body):
+        msg_id = str(next(self._ids))
+        room.history.append((time.time(), user, body, msg_id))
+        return msg_id
+
+    @staticmethod
+    def _event(cmd, when, user, msg_id, body):
+        # b/i: time, name, temp name, puid, unid, msgid, ip, flags, (blank), message
+        return (
+            cmd,
+            "{:.2f}".format(when),
+            user,
+            "",
+            abs(hash(user)) % 100000000,
+            "{:032x}".format(abs(hash(user))),
+            msg_id,
+            "127.0.0.1",
+            0,
+            "",
+            '<n000/><f x12000="0">{}</f>'.format(html.escape(body, quote=False)),
+        )
+
+    async def broadcast(self, room, *args):
+        await asyncio.gather(*(conn.send(*args) for conn in list(room.connections)))
+
+    async def post(self, room, user, body):
+        msg_id = self._remember(room, user, body)
+        temp_id = "t{}".format(msg_id)
+        await self.broadcast(room, *self._event("b", time.time(), user, temp_id, body))
+        await self.broadcast(room, "u", temp_id, msg_id)
+        return msg_id
+
+    async def inject(self, room_name, user, body, expect_reply=False):
+        """Post as a regular user, expect_reply starts a latency measurement"""
+        room = self.room(room_name)
+        room.user_messages += 1
+        if expect_reply:
+            room.pending.append(time.perf_counter())
+        await self.post(room, user, body)
+
+    async def handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        conn = Connection(ws, self)
+        try:
+            async for frame in ws:
+                if frame.type != WSMsgType.TEXT:
+                    break
+                for command in frame.data.replace("\r\n", "\0").split("\0"):
+                    if command:
+                        await self.command(conn, *command.split(":"))
+        finally:
+            if conn.room:
+                conn.room.connections.discard(conn)
+        return ws
+
+    async def command(self, conn, cmd, *args):
+        handler = getattr(self, "cmd_" + cmd, None)
+        if handler is not None:
+            await handler(conn, *args)
+
+    async def cmd_bauth(self, conn, room_name, uid="", name="", password="", *_):
+        self.logins += 1
+        room = self.room(room_name)
+        conn.room = room
+        conn.name = name or "anon"
+        room.connections.add(conn)
+        await conn.send(
+            "ok",
+            "owner",
+            "12345678",
+            "M",
+            conn.name,
+            "{:.2f}".format(time.time()),
+            "127.0.0.1",
+            "",
+            0,
+        )
+        for when, user, body, msg_id in room.history:
+            await conn.send(*self._event("i", when, user, msg_id, body))
+        await conn.send("nomore")
+        await conn.send("inited")
+        await conn.send("ratelimitinit", room.rate_limit, 0)
+        await conn.send("n", "{:x}".format(len(room.connections)))
+
+    async def cmd_v(self, conn, *_):
+        await conn.send("v", 15, 15)
+
+    async def cmd_bm(self, conn, _rnd="", _flags="", *text):
+        room = conn.room
+        if room is None:
+            return
+        now = time.perf_counter()
+        conn.sends.append(now)
+        while conn.sends and now - conn.sends[0] > FLOOD_WINDOW:
+            conn.sends.popleft()
+        if len(conn.sends) > FLOOD_MESSAGES:
+            conn.flood_warnings += 1
+            self.flood_warnings += 1
+            await conn.send("show_fw")
+
+        room.bot_messages += 1
+        if room.pending:
+            room.latencies.append(now - room.pending.popleft())
+        await self.post(room, conn.name, strip_tags(":".join(text)))
+
+    async def cmd_delmsg(self, conn, msg_id="", *_):
+        room = conn.room
+        if room is None:
+            return
+        room.deletes += 1
+        if room.pending:
+            # Deleting a banned word counts as the bot answering
+            room.latencies.append(time.perf_counter() - room.pending.popleft())
+        await self.broadcast(room, "delete", msg_id)
+
+    def stats(self):
+        latencies = sorted(t for room in self.rooms.values() for t in room.latencies)
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+        return {
+            "rooms": len(self.rooms),
+            "logins": self.logins,
+            "user_messages": sum(r.user_messages for r in self.rooms.values()),
+            "bot_messages": sum(r.bot_messages for r in self.rooms.values()),
+            "deletes": sum(r.deletes for r in self.rooms.values()),
+            "unanswered": sum(len(r.pending) for r in self.rooms.values()),
+            "flood_warnings": self.flood_warnings,
+            "reply_p50": pick(0.5) if latencies else None,
+            "reply_p99": pick(0.99) if latencies else None,
+        }
+
+
+async def start(server, port=0, host="127.0.0.1"):
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", server.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, "ws://{}:{}/".format(host, port)
+
+
+async def main(port):
+    server = FakeChatango()
+    runner, url = await start(server, port)
+    print("fake chatango on", url)
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 8080))
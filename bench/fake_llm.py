@@ -0,0 +1,160 @@
+"""
+Local stand-in for the Messages API that streams a canned reply over SSE
+
+    python3 bench/fake_llm.py serve [port]        # point XAI_BASE_URL at it
+    python3 bench/fake_llm.py check [delay_ms]    # stream through claude.py
+
+The reply is sent a few characters at a time with a delay between events, so
+the time to the first room message can be compared with the full reply time.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+from aiohttp import web
+
+cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, cwd)
+
+REPLY = (
+    "Sure, here is the short version.\n\n"
+    "The **first** paragraph is done once the blank line shows up, so it should "
+    "reach the room long before the rest of the reply is generated.\n\n"
+    "```\ncode blocks stay together\n\neven with blank lines\n```\n\n"
+    "A longer closing paragraph. It keeps going for a while so the splitter has "
+    "to cut it at a sentence end instead! Does that work? It should."
+)
+CHUNK = 6
+
+
+def event(name, data):
+    return "event: {}\ndata: {}\n\n".format(name, json.dumps(data)).encode()
+
+
+async def messages(request):
+    body = await request.json()
+    delay = request.app["delay"]
+    message = {
+        "id": "msg_fake",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model", "fake"),
+        "content": [],
+        "stop_reason": None,
+        "stop_sequence": None,
+        "usage": {"input_tokens": 1, "output_tokens": 0},
+    }
+
+    if not body.get("stream"):
+        message["content"] = [{"type": "text", "text": REPLY}]
+        message["stop_reason"] = "end_turn"
+        return web.json_response(message)
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    try:
+        await response.write(
+            event("message_start", {"type": "message_start", "message": message})
+        )
+        await response.write(
+            event(
+                "content_block_start",
+                {
+                    "type": "content_block_start",
+                    "index": 0,
+                    "content_block": {"type": "text", "text": ""},
+                },
+            )
+        )
+        for i in range(0, len(REPLY), CHUNK):
+            await asyncio.sleep(delay)
+            await response.write(
+                event(
+                    "content_block_delta",
+                    {
+                        "type": "content_block_delta",
+                        "index": 0,
+                        "delta": {"type": "text_delta", "text": REPLY[i : i + CHUNK]},
+                    },
+                )
+            )
+        await response.write(
+            event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        )
+        await response.write(
+            event(
+                "message_delta",
+                {
+                    "type": "message_delta",
+                    "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                    "usage": {"output_tokens": len(REPLY) // 4},
+                },
+            )
+        )
+        await response.write(event("message_stop", {"type": "message_stop"}))
+        await response.write_eof()
+    except ConnectionResetError:
+        # The bot cancelled the reply, a newer mention replaced it
+        pass
+    return response
+
+
+def make_app(delay=0.02):
+    app = web.Application()
+    app["delay"] = delay
+    app.router.add_post("/v1/messages", messages)
+    return app
+
+
+async def start(port=0, delay=0.02):
+    runner = web.AppRunner(make_app(delay))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, "http://127.0.0.1:{}".format(port)
+
+
+async def check(delay):
+    import claude
+
+    runner, base_url = await start(delay=delay)
+    try:
+        client = claude.LLMClient(api_key="fake", base_url=base_url, use_async=True)
+        start_time = time.perf_counter()
+        first = None
+        pieces = []
+        async for piece in client.astream_response(
+            system_prompt="fake",
+            messages=[{"role": "user", "content": "hi"}],
+            max_length=120,
+        ):
+            elapsed = time.perf_counter() - start_time
+            print("{:6.0f} ms  {!r}".format(elapsed * 1000, piece[:60]))
+            first = first or elapsed
+            pieces.append(piece)
+        total = time.perf_counter() - start_time
+    finally:
+        await runner.cleanup()
+
+    print(
+        "first message {:.0f} ms, full reply {:.0f} ms, {} pieces".format(
+            first * 1000, total * 1000, len(pieces)
+        )
+    )
+
+
+def main():
+    mode = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if mode == "serve":
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+        web.run_app(make_app(), host="127.0.0.1", port=port)
+    else:
+        delay = int(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.02
+        asyncio.run(check(delay))
+
+
+if __name__ == "__main__":
+    main()
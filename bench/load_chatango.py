@@ -0,0 +1,198 @@
+"""
+Runs LmaoBot against bench/fake_chatango.py with many busy rooms
+
+    python3 bench/load_chatango.py [--rooms 100] [--rate 0.5] [--duration 30]
+
+The fake server runs in its own process and posts --rate messages per second
+in each of --rooms rooms, --triggers of them stash commands the bot answers.
+The bot runs here with the real chatango-lib, its websocket connects sent to
+the fake server instead of chatango.com.  Reports reply latency as seen by
+the server, event loop lag in the bot and resident memory per room.
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import importlib
+import multiprocessing
+
+cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, cwd)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_chatango
+
+USERS = ["user{}".format(i) for i in range(500)]
+WORDS = "lmao the game tonight who is watching kek based that ref".split()
+
+
+def server_process(args, room_names, triggers, conn):
+    async def run():
+        server = fake_chatango.FakeChatango(rate_limit=args.rate_limit)
+        runner, url = await fake_chatango.start(server)
+        conn.send(url)
+
+        # Wait for the bot to join every room
+        deadline = time.monotonic() + args.join_timeout
+        while time.monotonic() < deadline:
+            joined = sum(
+                1
+                for name in room_names
+                if name in server.rooms and server.rooms[name].connections
+            )
+            if joined == len(room_names):
+                break
+            await asyncio.sleep(0.2)
+        join_time = args.join_timeout - (deadline - time.monotonic())
+        conn.send(("joined", joined, join_time))
+
+        rng = random.Random(1)
+        interval = 1 / (args.rate * len(room_names))
+        end = time.monotonic() + args.duration
+        next_send = time.monotonic()
+        while time.monotonic() < end:
+            trigger = rng.random() < args.triggers
+            body = (
+                rng.choice(triggers)
+                if trigger
+                else " ".join(rng.choices(WORDS, k=rng.randint(2, 10)))
+            )
+            await server.inject(
+                rng.choice(room_names), rng.choice(USERS), body, trigger
+            )
+            next_send += interval
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        # Let replies that are still queued arrive
+        await asyncio.sleep(args.drain)
+        conn.send(("stats", server.stats()))
+        await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def loop_lag(samples, interval=0.05):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+def redirect_websockets(url):
+    """Send chatango-lib's ws_connect calls to the fake server"""
+    import aiohttp
+
+    ws_connect = aiohttp.ClientSession.ws_connect
+
+    def fake_ws_connect(self, target, *args, **kwargs):
+        if "chatango.com" in str(target):
+            target = url
+        return ws_connect(self, target, *args, **kwargs)
+
+    aiohttp.ClientSession.ws_connect = fake_ws_connect
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0
+
+
+async def main(args):
+    bot = importlib.import_module("async")
+    import chatlog
+
+    chatlog.logger.log_dir = tempfile.mkdtemp()
+    bot.load_memes()
+    bot.memes_loaded.set()
+    triggers = list(bot.stash_memes) or ["/lol"]
+
+    room_names = ["loadroom{}".format(i) for i in range(args.rooms)]
+    spawn = multiprocessing.get_context("spawn")
+    parent, child = spawn.Pipe()
+    server = spawn.Process(
+        target=server_process, args=(args, room_names, triggers, child), daemon=True
+    )
+    server.start()
+    url = await asyncio.to_thread(parent.recv)
+    redirect_websockets(url)
+
+    rss_before = rss_bytes()
+    lag = []
+    lag_task = asyncio.ensure_future(loop_lag(lag))
+    client = bot.LmaoBot("lmaoload", "password", room_names, room_class=bot.LmaoRoom)
+    client_task = asyncio.ensure_future(client.run())
+
+    _, joined, join_time = await asyncio.to_thread(parent.recv)
+    rss_joined = rss_bytes()
+    print(
+        "joined {}/{} rooms in {:.1f}s, {:.0f} KB per room".format(
+            joined,
+            len(room_names),
+            join_time,
+            (rss_joined - rss_before) / max(joined, 1) / 1024,
+        )
+    )
+    lag.clear()
+
+    _, stats = await asyncio.to_thread(parent.recv)
+    rss_after = rss_bytes()
+    lag_task.cancel()
+    client_task.cancel()
+    server.join(5)
+
+    print(
+        "{} user messages at {}/s/room for {}s, {} bot messages, {} unanswered".format(
+            stats["user_messages"],
+            args.rate,
+            args.duration,
+            stats["bot_messages"],
+            stats["unanswered"],
+        )
+    )
+    if stats["reply_p50"] is not None:
+        print(
+            "reply latency p50 {:.1f} ms, p99 {:.1f} ms".format(
+                stats["reply_p50"] * 1000, stats["reply_p99"] * 1000
+            )
+        )
+    print(
+        "loop lag p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms".format(
+            percentile(lag, 0.5) * 1000,
+            percentile(lag, 0.99) * 1000,
+            max(lag, default=0) * 1000,
+        )
+    )
+    print(
+        "memory {:.1f} MB at start, {:.0f} KB per room after traffic".format(
+            rss_before / 1e6, (rss_after - rss_before) / max(joined, 1) / 1024
+        )
+    )
+    print("flood warnings {}".format(stats["flood_warnings"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=0.5, help="msgs/s per room")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--triggers", type=float, default=0.1, help="reply fraction")
+    parser.add_argument("--rate-limit", type=int, default=0, help="room rate limit")
+    parser.add_argument("--join-timeout", type=float, default=60)
+    parser.add_argument("--drain", type=float, default=3)
+    asyncio.run(main(parser.parse_args()))
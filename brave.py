@@ -1,6 +1,7 @@
 import os
 import json
-import requests
+import fetch
+import metrics
 
 BRAVE_URL = os.environ.get("BRAVE_URL")
 BRAVE_AUTH = os.environ.get("BRAVE_AUTH")
@@ -11,7 +12,8 @@ def web_result_to_link_desc(result):
 def search_top(query, count=10):
     return fetch_brave(query, count).get("web", {}).get("results",[])
 
-def fetch_brave(query, count=10):
+@metrics.instrument("brave")
+async def fetch_brave_async(query, count=10):
     if BRAVE_URL and BRAVE_AUTH:
         headers = {
             "Accept": "application/json",
@@ -30,7 +32,10 @@ def fetch_brave(query, count=10):
             "q": query
         }
 
-        response = requests.get(f"{BRAVE_URL}/web/search", headers=headers, params=params)
+        response = await fetch.get(f"{BRAVE_URL}/web/search", headers=headers, params=params)
         return json.loads(response.content)
     else:
         raise ValueError("BRAVE_URL and/or BRAVE_AUTH is not set")
+
+def fetch_brave(query, count=10):
+    return fetch.run_sync(fetch_brave_async(query, count))
@@ -0,0 +1,152 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+import metrics
+
+# Every cache made, for stats reporting
+caches = {}
+
+# Set in supervisor workers to a supervisor.Link, shared caches ask it first
+remote = None
+
+
+class TTLCache:
+    """
+    LRU cache with expiry and single-flight fetching
+
+    Concurrent lookups of the same missing key share one fetch.  A fetch that
+    returns None is a known miss ("video not found") and is remembered for
+    negative_ttl instead of ttl.  Exceptions are never cached.
+
+    With shared=True a miss asks the supervisor before fetching and a fetch
+    is handed to it, so sibling workers don't repeat it.
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=3600, negative_ttl=300, shared=False):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+        caches[name] = self
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def lookup(self, key):
+        """(seconds left, value) or None, tells cached None from a miss"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        left = entry[0] - time.monotonic()
+        if left < 0:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return left, entry[1]
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def get_or_fetch(self, key, fetcher):
+        """Return the cached value for key or await fetcher() to fill it"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] >= time.monotonic():
+            self._entries.move_to_end(key)
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[1]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fill(key, fetcher))
+            self._inflight[key] = task
+
+        # Shielded so one caller getting cancelled doesn't fail the others
+        return await asyncio.shield(task)
+
+    async def _fill(self, key, fetcher):
+        try:
+            if self.shared and remote is not None:
+                found = await self._remote_get(key)
+                if found is not None:
+                    left, value = found
+                    self.shared_hits += 1
+                    self.set(key, value, left)
+                    return value
+
+            value = await fetcher()
+            self.set(key, value)
+            if self.shared and remote is not None:
+                ttl = self.negative_ttl if value is None else self.ttl
+                remote.cache_put(self.name, key, value, ttl)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _remote_get(self, key):
+        try:
+            return await remote.cache_get(self.name, key)
+        except (asyncio.TimeoutError, EOFError, OSError):
+            # Supervisor busy or gone, fetch it ourselves
+            return None
+
+    def stats(self):
+        stats = {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+        if self.shared:
+            stats["shared_hits"] = self.shared_hits
+        return stats
+
+
+def _collect():
+    return {
+        (name, stat): value
+        for name, c in caches.items()
+        for stat, value in c.stats().items()
+    }
+
+
+metrics.Gauge(
+    "lmaobot_cache", "TTL cache size and lookups", ("cache", "stat"), _collect
+)
+
+
+def report():
+    return " ".join(
+        "{}[{}]".format(
+            name, " ".join("{}={}".format(k, v) for k, v in c.stats().items())
+        )
+        for name, c in caches.items()
+    )
@@ -0,0 +1,160 @@
+import os
+import atexit
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pytz import timezone
+
+cwd = os.path.dirname(os.path.abspath(__file__))
+
+LOG_DIR = os.path.join(cwd, "logs")
+LOG_TZ = timezone("America/Denver")
+
+# Flush when this many bytes are waiting or this many seconds have passed
+FLUSH_BYTES = 64 * 1024
+FLUSH_INTERVAL = 2.0
+
+# Least recently written files get closed past this many handles
+MAX_OPEN_FILES = 64
+
+# LOG_ROTATE=day starts a new file every day, LOG_ROTATE=size once a file
+# grows past LOG_ROTATE_BYTES.  Unset keeps appending to one file forever.
+LOG_ROTATE = os.environ.get("LOG_ROTATE", "").lower()
+LOG_ROTATE_BYTES = int(os.environ.get("LOG_ROTATE_BYTES", 50 * 1024 * 1024))
+
+
+def log_filename(room_name, sub):
+    if sub:
+        return "{0}_{1}.log".format(room_name, sub)
+    else:
+        return "{0}.log".format(room_name)
+
+
+class ChatLogger:
+    """Buffers log lines in memory and writes them out in batches
+
+    Lines are grouped per file and written through a pool of open handles by
+    a background task, so the event loop never waits on the disk.  Without a
+    running flusher (scripts, tests) every line is written immediately.
+    """
+
+    def __init__(self, log_dir=LOG_DIR):
+        self.log_dir = log_dir
+        self._buffers = {}
+        self._buffered_bytes = 0
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._handles = OrderedDict()
+        self._handle_days = {}
+        self._wakeup = None
+        self._running = False
+        # listener(path, lines, end) runs on the flushing thread after each write
+        self.listeners = []
+
+    def write(self, room_name, sub, message):
+        filename = log_filename(room_name, sub)
+        time_str = "{:%Y-%m-%d %H:%M:%S}".format(datetime.now(LOG_TZ))
+        line = "[{0}] {1}\n".format(time_str, message)
+
+        with self._buffer_lock:
+            self._buffers.setdefault(filename, []).append(line)
+            self._buffered_bytes += len(line)
+            full = self._buffered_bytes >= FLUSH_BYTES
+
+        if not self._running:
+            self.flush()
+        elif full and self._wakeup:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._buffer_lock:
+                buffers = self._buffers
+                self._buffers = {}
+                self._buffered_bytes = 0
+
+            if not buffers:
+                return
+
+            today = datetime.now(LOG_TZ).date()
+            for filename, lines in buffers.items():
+                logfile = self._handle(filename, today)
+                logfile.write("".join(lines))
+                logfile.flush()
+                self._notify(logfile.name, lines, logfile.tell())
+                if LOG_ROTATE == "size" and logfile.tell() >= LOG_ROTATE_BYTES:
+                    stamp = "{:%Y-%m-%d_%H%M%S}".format(datetime.now(LOG_TZ))
+                    self._rotate(filename, stamp)
+
+    def _notify(self, path, lines, end):
+        for listener in self.listeners:
+            try:
+                listener(path, lines, end)
+            except Exception:
+                logging.exception("log listener failed for %s", path)
+
+    def _handle(self, filename, today):
+        logfile = self._handles.get(filename)
+        if logfile is not None:
+            if LOG_ROTATE == "day" and self._handle_days[filename] != today:
+                self._rotate(filename, str(self._handle_days[filename]))
+            else:
+                self._handles.move_to_end(filename)
+                return logfile
+
+        path = os.path.join(self.log_dir, filename)
+        if LOG_ROTATE == "day" and os.path.exists(path):
+            file_day = datetime.fromtimestamp(os.path.getmtime(path), LOG_TZ).date()
+            if file_day != today:
+                os.replace(path, "{}.{}".format(path, file_day))
+
+        while len(self._handles) >= MAX_OPEN_FILES:
+            old_name, old_file = self._handles.popitem(last=False)
+            self._handle_days.pop(old_name, None)
+            old_file.close()
+
+        os.makedirs(self.log_dir, exist_ok=True)
+        logfile = open(path, "a")
+        self._handles[filename] = logfile
+        self._handle_days[filename] = today
+        return logfile
+
+    def _rotate(self, filename, suffix):
+        logfile = self._handles.pop(filename, None)
+        self._handle_days.pop(filename, None)
+        if logfile is not None:
+            logfile.close()
+        path = os.path.join(self.log_dir, filename)
+        if os.path.exists(path):
+            os.replace(path, "{}.{}".format(path, suffix))
+
+    async def run(self):
+        """Background flusher, add with client.add_task"""
+        self._wakeup = asyncio.Event()
+        self._running = True
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await asyncio.to_thread(self.flush)
+        finally:
+            self._running = False
+            self.flush()
+
+    def close(self):
+        self._running = False
+        self.flush()
+        with self._flush_lock:
+            for logfile in self._handles.values():
+                logfile.close()
+            self._handles.clear()
+            self._handle_days.clear()
+
+
+logger = ChatLogger()
+atexit.register(logger.close)
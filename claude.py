@@ -1,19 +1,50 @@
+import os
+import time
+import asyncio
 import anthropic
 import markdown
+import metrics
+from contextlib import asynccontextmanager
 
 
 class LLMClient:
     """Class to handle interactions with LLM services"""
 
-    def __init__(self, api_key=None, base_url=None):
-        """Initialize the LLM client with API credentials"""
+    # Long-lived async clients keep their connection pool between mentions
+    _async_clients = {}
+
+    def __init__(self, api_key=None, base_url=None, use_async=False):
+        """
+        Initialize the LLM client with API credentials
+
+        Args:
+            api_key (str): API key for the service
+            base_url (str): Base URL of the Messages API
+            use_async (bool): Share one AsyncAnthropic client per base_url for
+                              agenerate_response instead of a sync client
+        """
         self.api_key = api_key
         self.base_url = base_url
-        self.client = anthropic.Anthropic(
-            api_key=self.api_key,
-            base_url=self.base_url,
-        )
+        if use_async:
+            self.client = None
+            self.async_client = self._shared_async_client(api_key, base_url)
+        else:
+            self.async_client = None
+            self.client = anthropic.Anthropic(
+                api_key=self.api_key,
+                base_url=self.base_url,
+            )
+
+    @classmethod
+    def _shared_async_client(cls, api_key, base_url):
+        key = (base_url, api_key)
+        client = cls._async_clients.get(key)
+        if client is None:
+            client = anthropic.AsyncAnthropic(api_key=api_key, base_url=base_url)
+            cls._async_clients[key] = client
+        return client
 
+    @metrics.instrument("llm")
     def generate_response(
         self,
         system_prompt,
@@ -68,6 +99,181 @@ class LLMClient:
         except Exception as e:
             raise e
 
+    @metrics.instrument("llm")
+    async def agenerate_response(
+        self,
+        system_prompt,
+        user_input=None,
+        messages=None,
+        model="grok-beta",
+        temperature=0.6,
+        max_tokens=1500,
+        timeout=16,
+    ):
+        """
+        Async version of generate_response, needs use_async=True
+
+        Returns:
+            str: Generated response text
+        """
+        if messages is None:
+            messages = [{"role": "user", "content": user_input}]
+
+        completion = await self.async_client.messages.create(
+            model=model,
+            system=system_prompt,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+        )
+        return completion.content[0].text or ""
+
+    async def astream_response(
+        self,
+        system_prompt,
+        messages,
+        model="grok-beta",
+        temperature=0.6,
+        max_tokens=1500,
+        timeout=16,
+        max_length=700,
+    ):
+        """
+        Stream a response as complete paragraphs or sentences, needs use_async=True
+
+        Args:
+            max_length (int): Longest piece to hold back waiting for a paragraph
+                              break, longer text is cut at a sentence end
+
+        Yields:
+            str: Markdown text ready for format_response_for_html
+        """
+        splitter = ReplySplitter(max_length=max_length)
+        start = time.perf_counter()
+        first = True
+
+        with metrics.track("integration", "llm"):
+            async with self.async_client.messages.stream(
+                model=model,
+                system=system_prompt,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                timeout=timeout,
+            ) as stream:
+                async for text in stream.text_stream:
+                    for piece in splitter.feed(text):
+                        if first:
+                            metrics.first_message.observe(time.perf_counter() - start)
+                            first = False
+                        yield piece
+
+        rest = splitter.flush()
+        if rest:
+            if first:
+                metrics.first_message.observe(time.perf_counter() - start)
+            yield rest
+
+
+class ReplySplitter:
+    """Cuts streamed text into paragraphs, or sentences when a paragraph runs long"""
+
+    sentence_ends = (". ", "! ", "? ", "\n")
+
+    def __init__(self, max_length=700):
+        self.max_length = max_length
+        self.buffer = ""
+
+    def feed(self, text):
+        self.buffer += text
+        pieces = []
+        while (cut := self._cut()) is not None:
+            piece = self.buffer[:cut].strip()
+            self.buffer = self.buffer[cut:]
+            if piece:
+                pieces.append(piece)
+        return pieces
+
+    def flush(self):
+        piece = self.buffer.strip()
+        self.buffer = ""
+        return piece
+
+    def _cut(self):
+        # Blank lines inside a code block don't end the paragraph
+        paragraph = self.buffer.find("\n\n")
+        while paragraph != -1 and self.buffer.count("```", 0, paragraph) % 2:
+            paragraph = self.buffer.find("\n\n", paragraph + 2)
+        if paragraph != -1:
+            return paragraph + 2
+
+        if len(self.buffer) > self.max_length:
+            end = max(
+                self.buffer.rfind(p, 0, self.max_length) for p in self.sentence_ends
+            )
+            if end <= 0:
+                end = self.buffer.rfind(" ", 0, self.max_length)
+            return end + 1 if end > 0 else self.max_length
+
+        return None
+
+
+class MentionLimiter:
+    """
+    Bounds concurrent LLM calls for chat mentions
+
+    At most global_limit calls run at once across all rooms and room_limit in
+    any one room.  A newer mention from the same user in the same room
+    cancels their older one, waiting or running.
+    """
+
+    def __init__(self, global_limit=4, room_limit=2):
+        self.global_limit = global_limit
+        self.room_limit = room_limit
+        self._global = None
+        self._rooms = {}
+        self._pending = {}
+
+    def supersede(self, room_name, user_name):
+        """Cancel the user's pending mention and register the current task"""
+        key = (room_name, user_name.lower())
+        previous = self._pending.get(key)
+        if previous is not None and not previous.done():
+            previous.cancel()
+
+        task = asyncio.current_task()
+        self._pending[key] = task
+        task.add_done_callback(
+            lambda t: self._pending.pop(key) if self._pending.get(key) is t else None
+        )
+
+    @asynccontextmanager
+    async def slot(self, room_name):
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.global_limit)
+        room_limit = self._rooms.get(room_name)
+        if room_limit is None:
+            room_limit = asyncio.Semaphore(self.room_limit)
+            self._rooms[room_name] = room_limit
+
+        async with room_limit:
+            async with self._global:
+                yield
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "running": self.global_limit - self._global._value if self._global else 0,
+        }
+
+
+# Shared by every room's @mentions
+mention_limiter = MentionLimiter(
+    global_limit=int(os.environ.get("LLM_CONCURRENCY", 4)),
+    room_limit=int(os.environ.get("LLM_ROOM_CONCURRENCY", 2)),
+)
+
 
 def format_chat_history(
     history,
@@ -0,0 +1,175 @@
+import json
+import asyncio
+import aiohttp
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+# Uniform timeouts for every outbound call, override per request with timeout=
+TIMEOUT = 15
+CONNECT_TIMEOUT = 5
+
+# Keep-alive pool shared by every integration
+POOL_LIMIT = 100
+KEEPALIVE = 60
+
+# Max requests in flight to one host, so one slow API can't hog the pool
+HOST_LIMIT = 8
+HOST_LIMITS = {
+    "www.omdbapi.com": 4,
+    "api.vxtwitter.com": 4,
+    "bibledice.com": 2,
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, response):
+        super().__init__("{} for {}".format(response.status, response.url))
+        self.response = response
+
+
+class Response:
+    """The parts of a response the bot uses, body already read"""
+
+    __slots__ = ("url", "status", "headers", "content")
+
+    def __init__(self, url, status, headers, content):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.content = content
+
+    @property
+    def status_code(self):
+        return self.status
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise HTTPError(self)
+
+
+class _LoopClient:
+    def __init__(self):
+        connector = aiohttp.TCPConnector(
+            limit=POOL_LIMIT, keepalive_timeout=KEEPALIVE, ttl_dns_cache=300
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=TIMEOUT, connect=CONNECT_TIMEOUT),
+        )
+        self.host_limits = {}
+
+    def host_limit(self, host):
+        limit = self.host_limits.get(host)
+        if limit is None:
+            limit = asyncio.Semaphore(HOST_LIMITS.get(host, HOST_LIMIT))
+            self.host_limits[host] = limit
+        return limit
+
+
+# One client per event loop, the bot only ever has one
+_clients = {}
+_bot_loop = None
+_room_tasks = {}
+
+
+def attach(loop):
+    """Remember the bot's loop so sync helpers in worker threads can use it"""
+    global _bot_loop
+    _bot_loop = loop
+
+
+def _client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.session.closed:
+        client = _LoopClient()
+        _clients[loop] = client
+    return client
+
+
+@asynccontextmanager
+async def stream(method, url, timeout=None, **kwargs):
+    """
+    The aiohttp response with its body still unread
+
+    For parsers that read resp.content as it arrives and can stop early,
+    leaving the block closes the connection on whatever wasn't read.
+    """
+    client = _client()
+    if timeout is not None:
+        kwargs["timeout"] = aiohttp.ClientTimeout(
+            total=timeout, connect=min(timeout, CONNECT_TIMEOUT)
+        )
+
+    host = urlsplit(url).hostname or ""
+    async with client.host_limit(host):
+        async with client.session.request(method, url, **kwargs) as resp:
+            yield resp
+
+
+async def request(method, url, timeout=None, **kwargs):
+    async with stream(method, url, timeout, **kwargs) as resp:
+        content = await resp.read()
+        return Response(str(resp.url), resp.status, resp.headers, content)
+
+
+async def get(url, **kwargs):
+    return await request("GET", url, **kwargs)
+
+
+async def post(url, **kwargs):
+    return await request("POST", url, **kwargs)
+
+
+async def close():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client:
+        await client.session.close()
+
+
+async def _run_and_close(coro):
+    try:
+        return await coro
+    finally:
+        await close()
+
+
+def run_sync(coro):
+    """
+    Run a coroutine from sync code
+
+    Worker threads of the bot hand it to the bot's loop so they share its
+    connections.  Scripts without a running bot get a throwaway loop.
+    """
+    loop = _bot_loop
+    if loop is not None and loop.is_running():
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            coro.close()
+            raise RuntimeError("Sync fetch called on the event loop, await it")
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+    return asyncio.run(_run_and_close(coro))
+
+
+def room_task(room_name, coro):
+    """Start a task that gets cancelled if the room disconnects"""
+    task = asyncio.ensure_future(coro)
+    tasks = _room_tasks.setdefault(room_name, set())
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    return task
+
+
+def cancel_room(room_name):
+    for task in _room_tasks.pop(room_name, ()):
+        task.cancel()
@@ -0,0 +1,166 @@
+import os
+import time
+from collections import deque
+
+import metrics
+
+# Budgets are spent over a sliding window this many seconds long
+WINDOW = 60
+# Units one user may spend in one room per window, per handler class
+USER_BUDGET = int(os.environ.get("FLOOD_USER_BUDGET", 30))
+# Units a room may spend per window across everyone, keeps its send queue short
+ROOM_BUDGET = int(os.environ.get("FLOOD_ROOM_BUDGET", 120))
+
+# What one request costs by handler class
+COSTS = {
+    "chat": 1,
+    "stash": 1,
+    "lookup": 3,
+    "guide": 5,
+    "wolfram": 10,
+    "llm": 10,
+}
+# Spam commands send three times as much
+SPAM_FACTOR = 3
+# Requests per window across every room, what the outside APIs put up with
+QUOTAS = {
+    "lookup": 120,
+    "guide": 30,
+    "wolfram": 10,
+    "llm": 40,
+}
+# The same command in the same room this soon after is only answered once
+COLLAPSE_WINDOW = 10
+COLLAPSE = frozenset(["lookup", "guide", "wolfram"])
+# Sweep idle windows out after this many checks
+SWEEP_EVERY = 1000
+
+ALLOWED = "allowed"
+DROPPED = "dropped"
+COLLAPSED = "collapsed"
+
+
+class SlidingWindow:
+    """Sum of what was spent in the last WINDOW seconds"""
+
+    __slots__ = ("events", "total")
+
+    def __init__(self):
+        self.events = deque()
+        self.total = 0
+
+    def expire(self, now, window=WINDOW):
+        events = self.events
+        while events and events[0][0] <= now - window:
+            self.total -= events.popleft()[1]
+        return self.total
+
+    def spend(self, now, amount):
+        self.events.append((now, amount))
+        self.total += amount
+
+
+class Governor:
+    """
+    Flood budgets for handlers, checked after routing and before running
+
+    A request costs COSTS[handler class] and is charged to three sliding
+    windows: the user in that room for the class, the room as a whole, and a
+    global count of calls for classes with an API quota.  If any of them
+    would go over, the request is dropped without charging anything.  A
+    repeat of a guide or lookup command already answered in the room within
+    COLLAPSE_WINDOW is collapsed into the earlier answer.
+    """
+
+    def __init__(self, classes):
+        # Route name -> handler class, unlisted routes are "chat"
+        self.classes = classes
+        self._users = {}
+        self._rooms = {}
+        self._quotas = {}
+        self._recent = {}
+        self._checks = 0
+        # (room, user, class) dropped this window, to log once
+        self._noted = {}
+
+    def cost(self, handler_class, ctx):
+        cost = COSTS.get(handler_class, 1)
+        return cost * SPAM_FACTOR if "spam" in ctx.body_lower else cost
+
+    def check(self, route_name, ctx, now=None):
+        """ALLOWED, DROPPED or COLLAPSED for a routed message"""
+        now = time.monotonic() if now is None else now
+        handler_class = self.classes.get(route_name, "chat")
+        room_name = ctx.room.name
+        user_key = (room_name, ctx.user.name.lower(), handler_class)
+
+        self._checks += 1
+        if self._checks % SWEEP_EVERY == 0:
+            self.sweep(now)
+
+        if handler_class in COLLAPSE:
+            recent_key = (room_name, ctx.command)
+            answered = self._recent.get(recent_key)
+            if answered is not None and now - answered < COLLAPSE_WINDOW:
+                metrics.governed.inc(handler_class, COLLAPSED)
+                return COLLAPSED
+
+        cost = self.cost(handler_class, ctx)
+        user = self._users.get(user_key)
+        if user is None:
+            user = self._users[user_key] = SlidingWindow()
+        room = self._rooms.get(room_name)
+        if room is None:
+            room = self._rooms[room_name] = SlidingWindow()
+        quota = QUOTAS.get(handler_class)
+        calls = None
+        if quota is not None:
+            calls = self._quotas.setdefault(handler_class, SlidingWindow())
+
+        if (
+            user.expire(now) + cost > USER_BUDGET
+            or room.expire(now) + cost > ROOM_BUDGET
+            or (calls is not None and calls.expire(now) + 1 > quota)
+        ):
+            metrics.governed.inc(handler_class, DROPPED)
+            return DROPPED
+
+        user.spend(now, cost)
+        room.spend(now, cost)
+        if calls is not None:
+            calls.spend(now, 1)
+        if handler_class in COLLAPSE:
+            self._recent[(room_name, ctx.command)] = now
+        metrics.governed.inc(handler_class, ALLOWED)
+        return ALLOWED
+
+    def first_drop(self, route_name, ctx, now=None):
+        """True the first time a user gets dropped for a class in a window"""
+        now = time.monotonic() if now is None else now
+        key = (
+            ctx.room.name,
+            ctx.user.name.lower(),
+            self.classes.get(route_name, "chat"),
+        )
+        noted = self._noted.get(key)
+        if noted is not None and now - noted < WINDOW:
+            return False
+        self._noted[key] = now
+        return True
+
+    def sweep(self, now=None):
+        """Forget windows with nothing left in them"""
+        now = time.monotonic() if now is None else now
+        for windows in (self._users, self._rooms):
+            for key in [k for k, w in windows.items() if not w.expire(now)]:
+                del windows[key]
+        for table, age in ((self._recent, COLLAPSE_WINDOW), (self._noted, WINDOW)):
+            for key in [k for k, t in table.items() if now - t >= age]:
+                del table[key]
+
+    def stats(self):
+        return {
+            "users": len(self._users),
+            "rooms": len(self._rooms),
+            "quota_used": {name: window.total for name, window in self._quotas.items()},
+        }
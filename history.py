@@ -0,0 +1,110 @@
+import time
+from collections import deque
+
+# Decisions made once when a message is added
+MOD = 1
+FILTERED = 2
+CUTOFF = 4
+DELETED = 8
+
+SKIP = MOD | FILTERED | DELETED
+
+
+class ChatRecord:
+    __slots__ = ("id", "user", "body", "flags", "time", "entry")
+
+    def __init__(self, msg_id, user, body, flags, created, entry):
+        self.id = msg_id
+        self.user = user
+        self.body = body
+        self.flags = flags
+        self.time = created
+        self.entry = entry
+
+
+class RoomHistory:
+    """
+    Recent messages of one room, kept ready to hand to the messages API
+
+    Mod messages, filtered text and the cutoff line are flagged when a message
+    comes in, and its role/content dict is built then too, so a mention only
+    walks back over the records it actually sends.
+    """
+
+    def __init__(
+        self, maxlen=50, bot_name="lmaolover", filter_text="WWWWWW", cutoff="lmao?"
+    ):
+        self.records = deque(maxlen=maxlen)
+        self.bot_name = bot_name.lower()
+        self.filter_text = filter_text
+        self.cutoff = cutoff
+        self.seeded = False
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, message, is_mod=False):
+        self.seeded = True
+        user = message.user.name
+        body = message.body
+
+        flags = 0
+        if is_mod:
+            flags |= MOD
+        if self.filter_text and self.filter_text in body:
+            flags |= FILTERED
+        if self.cutoff and body.strip() == self.cutoff:
+            flags |= CUTOFF
+
+        if user.lower() == self.bot_name:
+            entry = {"role": "assistant", "content": body}
+        else:
+            entry = {"role": "user", "content": f"<{user}>: {body}"}
+
+        record = ChatRecord(
+            getattr(message, "id", None), user, body, flags, time.time(), entry
+        )
+        self.records.append(record)
+        return record
+
+    def remove(self, message):
+        """Leave a deleted message out of future context"""
+        msg_id = getattr(message, "id", None)
+        for record in self.records:
+            if (record.id is not None and record.id == msg_id) or (
+                msg_id is None
+                and record.user == message.user.name
+                and record.body == message.body
+            ):
+                record.flags |= DELETED
+
+    def context(self, max_messages=15, max_chars=None):
+        """
+        Messages API list for the newest messages, oldest first
+
+        Args:
+            max_messages (int, optional): How many recent messages to look back
+                                          over, skipped ones included
+            max_chars (int, optional): Stop adding older messages past this many
+                                       characters of content, the newest is always kept
+
+        Returns:
+            list: {"role", "content"} dicts, shared so don't modify them
+        """
+        entries = []
+        total = 0
+        for i, record in enumerate(reversed(self.records)):
+            if max_messages is not None and i >= max_messages:
+                break
+            if record.flags & SKIP:
+                continue
+            size = len(record.entry["content"])
+            if max_chars is not None and entries and total + size > max_chars:
+                break
+            total += size
+            entries.append(record.entry)
+            if record.flags & CUTOFF:
+                break
+
+        entries.reverse()
+        return entries
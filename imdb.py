@@ -1,23 +1,58 @@
-import requests
+import fetch
+import metrics
+from cache import TTLCache
 from urllib.parse import quote
 
+# !imdb, imdb links and !imdbspam all look titles up through this
+imdb_cache = TTLCache("imdb", ttl=12 * 3600, negative_ttl=600, shared=True)
 
-def imdb_info_by_search(query: str):
+
+@metrics.instrument("imdb")
+async def imdb_info_by_search_async(query: str):
     imdb_api = "http://www.omdbapi.com/?apikey=cc41196e&t=" + quote(query)
-    imdb_resp = requests.get(imdb_api, timeout=5)
+    imdb_resp = await fetch.get(imdb_api, timeout=5)
     imdb_resp.raise_for_status()
 
     return imdb_resp.json()
 
 
-def imdb_info_by_id(video_id: str):
+@metrics.instrument("imdb")
+async def imdb_info_by_id_async(video_id: str):
     imdb_api = "http://www.omdbapi.com/?apikey=cc41196e&i=" + video_id
-    imdb_resp = requests.get(imdb_api, timeout=5)
+    imdb_resp = await fetch.get(imdb_api, timeout=5)
     imdb_resp.raise_for_status()
 
     return imdb_resp.json()
 
 
+async def imdb_lookup(lookup, query):
+    """OMDb info, None when OMDb has never heard of it"""
+    imdb_info = await lookup(query)
+    return imdb_info if "Title" in imdb_info else None
+
+
+async def imdb_info_by_id_cached(video_id: str):
+    return await imdb_cache.get_or_fetch(
+        video_id, lambda: imdb_lookup(imdb_info_by_id_async, video_id)
+    )
+
+
+async def imdb_info_by_search_cached(query: str):
+    """OMDb info for a title through imdb_cache, None if it's not found"""
+    query = query.strip()
+    return await imdb_cache.get_or_fetch(
+        "?" + query, lambda: imdb_lookup(imdb_info_by_search_async, query)
+    )
+
+
+def imdb_info_by_search(query: str):
+    return fetch.run_sync(imdb_info_by_search_async(query))
+
+
+def imdb_info_by_id(video_id: str):
+    return fetch.run_sync(imdb_info_by_id_async(video_id))
+
+
 def imdb_printout(imdb_info: dict, show_poster=True, extra_info=""):
     poster = imdb_info["Poster"]
     title = imdb_info["Title"]
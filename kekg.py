@@ -1,68 +1,701 @@
 import os
 import json
 import math
-import requests
-from datetime import datetime, timedelta
+import time
+import random
+import pickle
+import asyncio
+import bisect
+import calendar
+import functools
+import zlib
+import fetch
+import cache
+import metrics
+from datetime import datetime, timedelta, timezone
 import pytz
-from imdb import imdb_info_by_search, imdb_printout
-
+from imdb import imdb_info_by_search_cached, imdb_printout
 
 cwd = os.path.dirname(os.path.abspath(__file__))
-with open(cwd + "/kekg_memes.json", "r") as stashjson:
-    kekg_config = json.load(stashjson)
 
-sports_labels = kekg_config["sports_labels"]
-sports_junk_labels = kekg_config["sports_junk_labels"]
-movies_labels = kekg_config["movies_labels"]
-shows_labels = kekg_config["shows_labels"]
-church_labels = kekg_config["church_labels"]
-reality_numbers = kekg_config["reality_numbers"]
-number_mapping = kekg_config["number_mapping"]
+
+# What new broadcasts can be announced, keys of the "announce" section
+ANNOUNCE_KINDS = ("movies", "sports")
+
+
+def parse_quiet(hours):
+    """ "23:00-08:30" to minutes of the day (1380, 510), may wrap midnight"""
+    start, end = (
+        int(h) * 60 + int(m)
+        for h, m in (part.strip().split(":") for part in hours.split("-"))
+    )
+    if not (0 <= start < 1440 and 0 <= end < 1440):
+        raise ValueError("bad quiet hours {!r}".format(hours))
+    return start, end
+
+
+class Announce:
+    """
+    Who hears about new movies and games, the "announce" section of
+    kekg_memes.json
+
+    "movies" and "sports" list the rooms.yaml groups or single rooms that
+    get each kind, "quiet_hours" maps a room (or "*" for every room) to hours
+    it hears nothing, in "timezone".
+    """
+
+    def __init__(self, config):
+        self.kinds = {kind: list(config.get(kind) or ()) for kind in ANNOUNCE_KINDS}
+        self.quiet = {
+            room: parse_quiet(hours)
+            for room, hours in (config.get("quiet_hours") or {}).items()
+        }
+        self.tz = pytz.timezone(config.get("timezone", "America/New_York"))
+
+    def __bool__(self):
+        return any(self.kinds.values())
+
+    def kinds_for(self, room_name, groups):
+        """Kinds a room is subscribed to, groups is the rooms.yaml mapping"""
+        return [
+            kind
+            for kind, names in self.kinds.items()
+            if any(
+                name == room_name or room_name in (groups.get(name) or ())
+                for name in names
+            )
+        ]
+
+    def is_quiet(self, room_name, now):
+        hours = self.quiet.get(room_name, self.quiet.get("*"))
+        if hours is None:
+            return False
+        local = datetime.fromtimestamp(now, self.tz)
+        minute = local.hour * 60 + local.minute
+        start, end = hours
+        if start <= end:
+            return start <= minute < end
+        return minute >= start or minute < end
+
+
+def reload_config():
+    global kekg_config, sports_labels, sports_junk_labels, movies_labels
+    global shows_labels, church_labels, reality_numbers, number_mapping
+    global announce
+
+    with open(cwd + "/kekg_memes.json", "r") as stashjson:
+        config = json.load(stashjson)
+
+    # Look everything up before assigning so a bad file changes nothing
+    labels = (
+        config["sports_labels"],
+        config["sports_junk_labels"],
+        config["movies_labels"],
+        config["shows_labels"],
+        config["church_labels"],
+        config["reality_numbers"],
+        config["number_mapping"],
+    )
+    new_announce = Announce(config.get("announce") or {})
+    kekg_config = config
+    announce = new_announce
+    (
+        sports_labels,
+        sports_junk_labels,
+        movies_labels,
+        shows_labels,
+        church_labels,
+        reality_numbers,
+        number_mapping,
+    ) = labels
+
+
+reload_config()
 
 
 KEKG_URL = os.environ.get("KEKG_URL")
 
+# Refresh this many seconds after the earliest programme on now ends, plus up
+# to BOUNDARY_JITTER so supervisor workers don't all ask at once
+BOUNDARY_DELAY = 20
+BOUNDARY_JITTER = 10
+# Refresh at least this often so progress and "In N minutes" stay close, and
+# no more often than MIN_REFRESH even if a programme just ended
+MIN_REFRESH = 60
+MAX_REFRESH = 300
+# A guide this far past its refresh is refetched before it's used
+MAX_STALE = 1800
+# Wait this long after a failed background refresh
+RETRY_DELAY = 60
+# Past its refresh by this much the guide is old news, replies say so
+STALE_NOTE_AFTER = 600
+
+# Each new guide is saved here for warm starts and outages, "" turns it off
+KEKG_SNAPSHOTS = os.environ.get("KEKG_SNAPSHOTS", os.path.join(cwd, "logs", "guide"))
+# Snapshots kept, oldest deleted first
+SNAPSHOT_KEEP = int(os.environ.get("KEKG_SNAPSHOT_KEEP", 48))
+SNAPSHOT_VERSION = 1
+
+GUIDE_TIME = "%Y-%m-%d %H:%M:%S"
+
+
+def next_boundary(guide, now):
+    """Epoch seconds the earliest programme on now ends, None if unknown"""
+    # Guide times are UTC and zero padded so the strings sort like times
+    after = time.strftime(GUIDE_TIME, time.gmtime(now))
+    ends = [
+        ch["broadcastnow"].get("endtime") or ""
+        for ch in guide["result"]["channels"]
+        if ch.get("broadcastnow")
+    ]
+    ends = [end for end in ends if end > after]
+    if not ends:
+        return None
+    return calendar.timegm(time.strptime(min(ends), GUIDE_TIME))
+
+
+def snapshot_paths(folder=None):
+    """Saved guides oldest first, names sort by fetch time"""
+    folder = KEKG_SNAPSHOTS if folder is None else folder
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return []
+    return [
+        os.path.join(folder, name)
+        for name in sorted(names)
+        if name.startswith("guide-") and name.endswith(".snap")
+    ]
+
+
+def write_snapshot(state, folder=None, keep=None):
+    """
+    Save a guide state dict as zlib compressed pickle
+
+    Written to a temp file and renamed over so a crash never leaves half a
+    snapshot, then all but the newest keep snapshots are deleted.
+    """
+    folder = KEKG_SNAPSHOTS if folder is None else folder
+    keep = SNAPSHOT_KEEP if keep is None else keep
+    os.makedirs(folder, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(state["fetched"]))
+    path = os.path.join(folder, "guide-{}.snap".format(stamp))
+
+    data = zlib.compress(
+        pickle.dumps(dict(state, version=SNAPSHOT_VERSION), pickle.HIGHEST_PROTOCOL),
+        1,
+    )
+    temp = path + ".tmp"
+    with open(temp, "wb") as snapshot:
+        snapshot.write(data)
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.replace(temp, path)
+
+    for old in snapshot_paths(folder)[:-keep] if keep > 0 else ():
+        os.remove(old)
+    return path
+
+
+def read_snapshot(path):
+    with open(path, "rb") as snapshot:
+        state = pickle.loads(zlib.decompress(snapshot.read()))
+    if state.get("version") != SNAPSHOT_VERSION:
+        raise ValueError("{} is snapshot version {}".format(path, state.get("version")))
+    return state
+
+
+class Guide:
+    """
+    The channel guide, refreshed in the background
+
+    Refreshes are conditional GETs with the ETag and Last-Modified of the
+    last guide, so an unchanged guide costs a 304 and no parsing.  Callers
+    are handed the guide already held while a refresh runs, and concurrent
+    refreshes share one fetch.  A refresh is due just after the earliest
+    programme on now ends, when broadcastnow changes.
+
+    Supervisor workers share the guide through the supervisor, the first one
+    due fetches it and the rest take its copy.
+
+    Every new guide fetched is saved to KEKG_SNAPSHOTS.  The newest one is
+    loaded on first use, so a restart has a guide right away and revalidates
+    it with its ETag.  While KEKG isn't answering the guide held is served
+    and stale_note() says how old it is.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.guide = None
+        self.etag = None
+        self.last_modified = None
+        # Epoch seconds the guide was fetched and is due for a refresh
+        self.fetched = 0.0
+        self.expires = 0.0
+        self._inflight = None
+        # No background refresh before this after one failed
+        self._retry_at = 0.0
+        self._restored = False
+        self._writes = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.not_modified = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+        self.fallbacks = 0
+        cache.caches["guide"] = self
+
+    async def get(self):
+        if self.guide is None and not self._restored:
+            self.restore()
+        now = time.time()
+        if self.guide is None:
+            return await self.refresh()
+        if now > self.expires + MAX_STALE and now >= self._retry_at:
+            try:
+                return await self.refresh()
+            except Exception:
+                # Old beats nothing, stale_note() tells the room
+                self.fallbacks += 1
+                return self.guide
+        if now < self.expires:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+            self.refresh_soon()
+        return self.guide
+
+    def refresh_soon(self):
+        """Start a refresh if one isn't running, without waiting for it"""
+        if self._inflight is None and time.time() >= self._retry_at:
+            self.refresh().add_done_callback(_ignore_result)
+
+    def refresh(self):
+        """Future of the refreshed guide, shared by everyone who asks meanwhile"""
+        if self._inflight is not None:
+            self.coalesced += 1
+        else:
+            self._inflight = asyncio.ensure_future(self._refresh())
+        # Shielded so one caller getting cancelled doesn't fail the others
+        return asyncio.shield(self._inflight)
+
+    async def _refresh(self):
+        try:
+            if cache.remote is not None and await self._take_shared():
+                return self.guide
+            changed = await self._fetch()
+            if changed and KEKG_SNAPSHOTS:
+                self.save()
+            if cache.remote is not None:
+                cache.remote.cache_put(
+                    "guide",
+                    self.url,
+                    (self.guide, self.etag, self.last_modified, self.fetched),
+                    self.expires - time.time(),
+                )
+            return self.guide
+        except Exception:
+            self._retry_at = time.time() + RETRY_DELAY
+            raise
+        finally:
+            self._inflight = None
+
+    async def _take_shared(self):
+        try:
+            found = await cache.remote.cache_get("guide", self.url)
+        except (asyncio.TimeoutError, EOFError, OSError):
+            return False
+        if found is None:
+            return False
+        left, (guide, etag, last_modified, fetched) = found
+        if fetched <= self.fetched:
+            return False
+        self.shared_hits += 1
+        self.guide, self.etag, self.last_modified = guide, etag, last_modified
+        self.fetched = fetched
+        self.expires = time.time() + left
+        return True
+
+    @metrics.instrument("kekg")
+    async def _fetch(self):
+        if not self.url:
+            raise ValueError("KEKG_URL is not set")
+        headers = {}
+        if self.guide is not None:
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+
+        self.refreshes += 1
+        page = await fetch.get(self.url, headers=headers)
+        now = time.time()
+        changed = not (page.status == 304 and self.guide is not None)
+        if changed:
+            page.raise_for_status()
+            self.guide = json.loads(page.content)
+            self.etag = page.headers.get("ETag")
+            self.last_modified = page.headers.get("Last-Modified")
+        else:
+            self.not_modified += 1
+        self.fetched = now
+        self.expires = self.next_refresh(now)
+        return changed
+
+    def state(self):
+        return {
+            "guide": self.guide,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "fetched": self.fetched,
+            "expires": self.expires,
+        }
+
+    def save(self):
+        """Write a snapshot in a worker thread, the loop carries on"""
+        write = asyncio.get_running_loop().run_in_executor(
+            None, write_snapshot, self.state()
+        )
+        self._writes.add(write)
+        write.add_done_callback(self._writes.discard)
+        write.add_done_callback(_ignore_result)
+
+    def restore(self, path=None):
+        """Load the newest snapshot (or path), False if there's none to load"""
+        self._restored = True
+        if path is None:
+            paths = snapshot_paths() if KEKG_SNAPSHOTS else []
+            if not paths:
+                return False
+            path = paths[-1]
+        try:
+            state = read_snapshot(path)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError, zlib.error):
+            return False
+        self.guide = state["guide"]
+        self.etag = state["etag"]
+        self.last_modified = state["last_modified"]
+        self.fetched = state["fetched"]
+        self.expires = state["expires"]
+        return True
+
+    def stale_since(self, now=None):
+        """When the guide held was fetched if it's well past due, else None"""
+        now = time.time() if now is None else now
+        if self.guide is None or now < self.expires + STALE_NOTE_AFTER:
+            return None
+        return self.fetched
+
+    def next_refresh(self, now):
+        boundary = next_boundary(self.guide, now)
+        if boundary is None:
+            return now + MAX_REFRESH
+        boundary += BOUNDARY_DELAY + random.uniform(0, BOUNDARY_JITTER)
+        return min(max(boundary, now + MIN_REFRESH), now + MAX_REFRESH)
+
+    async def run(self, on_error=None, on_refresh=None):
+        """
+        Keep the guide fresh
+
+        on_error(e) hears about failed refreshes and await on_refresh() runs
+        after every one that worked.
+        """
+        if self.guide is None and not self._restored:
+            self.restore()
+        while True:
+            delay = RETRY_DELAY
+            try:
+                await self.refresh()
+                delay = self.expires - time.time()
+                if on_refresh is not None:
+                    await on_refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if on_error is not None:
+                    on_error(e)
+            await asyncio.sleep(max(delay, 1))
+
+    def stats(self):
+        return {
+            "age": round(time.time() - self.fetched) if self.guide else -1,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "refreshes": self.refreshes,
+            "not_modified": self.not_modified,
+            "coalesced": self.coalesced,
+            "shared_hits": self.shared_hits,
+            "fallbacks": self.fallbacks,
+        }
+
+
+def _ignore_result(future):
+    # A failed background refresh leaves the old guide, the next caller retries
+    if not future.cancelled():
+        future.exception()
+
+
+guide = Guide(KEKG_URL)
+
+
+async def fetch_kekg_async():
+    return await guide.get()
+
 
 def fetch_kekg():
-    if KEKG_URL:
-        page = requests.get(KEKG_URL)
-        return json.loads(page.content)
-    else:
-        raise ValueError("KEKG_URL is not set")
+    return fetch.run_sync(guide.get())
 
 
-def filter_channels(numbers=[], labels=[], programs=[], reject=False):
-    kekg_json = fetch_kekg()
-    channels = kekg_json["result"]["channels"]
+def stale_note():
+    """A line for replies built on an old guide, empty when it's current"""
+    fetched = guide.stale_since()
+    if fetched is None:
+        return ""
+    return "\n(guide from {}, KEKG isn't answering)".format(clock_printout(fetched))
 
-    filtered = []
-    for ch in channels:
-        number_match = not numbers or (str(ch["channelnumber"]) in numbers) ^ reject
-        label_match = not labels or (ch["label"] in labels) ^ reject
-        program_match = not programs or (
-            ch.get("broadcastnow")
-            and (ch["broadcastnow"].get("title") in programs) ^ reject
+
+# Programmes mostly start on the hour and half hour, the same few strings
+@functools.lru_cache(maxsize=4096)
+def guide_time(text):
+    """Epoch seconds for a guide time string, None if it's missing or bad"""
+    try:
+        return datetime.fromisoformat(text).replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class Broadcast:
+    """One programme, times in epoch seconds"""
+
+    __slots__ = (
+        "title",
+        "plot",
+        "genre",
+        "runtime",
+        "start",
+        "end",
+        "progress",
+        "percent",
+        "_over_jeop",
+    )
+
+    def __init__(self, raw):
+        self.title = raw.get("title") or ""
+        self.plot = raw.get("plot") or ""
+        self.genre = raw.get("genre")
+        # Minutes, None when the guide leaves it out
+        self.runtime = raw.get("runtime")
+        self.start = guide_time(raw.get("starttime"))
+        self.end = guide_time(raw.get("endtime"))
+        # As of the fetch, only used when the times are missing
+        self.progress = raw.get("progress")
+        self.percent = raw.get("progresspercentage")
+        self._over_jeop = None
+
+    def percent_done(self, now):
+        if self.start is not None and self.end is not None and self.end > self.start:
+            return min(max((now - self.start) / (self.end - self.start), 0), 1) * 100
+        return 50 if self.percent is None else self.percent
+
+    def minutes_left(self, now):
+        if self.end is not None:
+            return math.floor((self.end - now) / 60)
+        runtime = 420 if self.runtime is None else self.runtime
+        progress = 210 * 60 if self.progress is None else self.progress
+        return math.floor((runtime * 60 - progress) / 60)
+
+
+class Channel:
+    __slots__ = ("position", "number", "label", "name", "now", "next", "schedule")
+
+    def __init__(self, position, raw):
+        self.position = position
+        self.number = str(raw.get("channelnumber"))
+        self.label = raw.get("label")
+        self.name = raw.get("channel")
+        now = raw.get("broadcastnow")
+        following = raw.get("broadcastnext")
+        self.now = Broadcast(now) if now else None
+        self.next = Broadcast(following) if following else None
+        self.schedule = Schedule(self._airings(raw.get("broadcasts") or ()))
+
+    def _airings(self, broadcasts):
+        """(channel, broadcast) for everything with times, now and next first"""
+        seen = set()
+        airings = []
+        known = [self.now, self.next] + [Broadcast(raw) for raw in broadcasts]
+        for broadcast in known:
+            if broadcast is None or broadcast.start is None or broadcast.end is None:
+                continue
+            key = (broadcast.start, broadcast.title)
+            if key not in seen:
+                seen.add(key)
+                airings.append((self, broadcast))
+        return airings
+
+
+class Schedule:
+    """
+    Airings as (channel, broadcast) sorted by start time, for time queries
+
+    Anything on at T started no more than the longest airing before it, so
+    each query is a bisect on the start times plus a scan of what it finds.
+    """
+
+    def __init__(self, airings):
+        self.airings = sorted(airings, key=lambda a: (a[1].start, a[0].position))
+        self.starts = [broadcast.start for _, broadcast in self.airings]
+        self.longest = max((b.end - b.start for _, b in self.airings), default=0)
+        # When the last airing ends, None for an empty schedule
+        self.until = max((b.end for _, b in self.airings), default=None)
+
+    def __len__(self):
+        return len(self.airings)
+
+    def on_at(self, when):
+        lo = bisect.bisect_right(self.starts, when - self.longest)
+        hi = bisect.bisect_right(self.starts, when)
+        return [a for a in self.airings[lo:hi] if a[1].end > when]
+
+    def starting_between(self, start, end):
+        lo = bisect.bisect_left(self.starts, start)
+        hi = bisect.bisect_left(self.starts, end)
+        return self.airings[lo:hi]
+
+    def next_airing(self, when):
+        """The airing on at when, else the first one after, None past the end"""
+        on = self.on_at(when)
+        if on:
+            return on[0]
+        i = bisect.bisect_right(self.starts, when)
+        return self.airings[i] if i < len(self.airings) else None
+
+
+def title_key(title):
+    return title.lstrip("*").strip().lower()
+
+
+def _index(pairs):
+    index = {}
+    for key, channel in pairs:
+        index.setdefault(key, []).append(channel)
+    return index
+
+
+class GuideModel:
+    """
+    The guide as records, built once per fetched guide
+
+    Channels are indexed by number, label and the title on now, so the guide
+    commands look up the few channels they want instead of scanning them all.
+    Every airing with times is also in a Schedule overall, per channel and
+    per title.  KEKG only lists now and next, a channel with a "broadcasts"
+    list gets all of them.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.channels = [
+            Channel(i, ch) for i, ch in enumerate(raw["result"]["channels"])
+        ]
+        self.by_number = _index((ch.number, ch) for ch in self.channels)
+        self.by_label = _index((ch.label, ch) for ch in self.channels)
+        self.by_title = _index(
+            (ch.now.title, ch) for ch in self.channels if ch.now is not None
+        )
+        # Every airing in the guide, overall and by title_key
+        airings = [a for ch in self.channels for a in ch.schedule.airings]
+        self.schedule = Schedule(airings)
+        self.titles = {
+            key: Schedule(found)
+            for key, found in _index(
+                (title_key(a[1].title), a) for a in airings
+            ).items()
+        }
+        # Title keys by each word in them, words sorted for prefix lookups
+        self.title_words = _index(
+            (word, key) for key in self.titles for word in set(key.split())
         )
-        if number_match and label_match and program_match:
-            filtered.append(ch)
+        self.words = sorted(self.title_words)
+
+    def titles_with_words(self, text):
+        """Title keys with a word starting with each word of text, any order"""
+        found = None
+        for part in text.split():
+            keys = set()
+            i = bisect.bisect_left(self.words, part)
+            while i < len(self.words) and self.words[i].startswith(part):
+                keys.update(self.title_words[self.words[i]])
+                i += 1
+            found = keys if found is None else found & keys
+            if not found:
+                return []
+        return sorted(found or ())
+
+    @staticmethod
+    def _matches(ch, numbers, labels, programs, reject):
+        return (
+            (not numbers or (ch.number in numbers) ^ reject)
+            and (not labels or (ch.label in labels) ^ reject)
+            and (
+                not programs
+                or (ch.now is not None and (ch.now.title in programs) ^ reject)
+            )
+        )
+
+    def select(self, numbers=(), labels=(), programs=(), reject=False):
+        """Channels matching every filter given, in guide order"""
+        numbers = {str(n) for n in numbers}
+        labels = set(labels)
+        programs = set(programs)
+        if reject or not (numbers or labels or programs):
+            candidates = self.channels
+        else:
+            # Start from the narrowest index, the other filters check the rest
+            candidates = None
+            for wanted, index in (
+                (numbers, self.by_number),
+                (labels, self.by_label),
+                (programs, self.by_title),
+            ):
+                if wanted:
+                    found = [ch for key in wanted for ch in index.get(key, ())]
+                    if candidates is None or len(found) < len(candidates):
+                        candidates = found
+            candidates = sorted(set(candidates), key=lambda ch: ch.position)
+        return [
+            ch
+            for ch in candidates
+            if self._matches(ch, numbers, labels, programs, reject)
+        ]
+
+
+_model = None
+
+
+def guide_model():
+    """GuideModel of the current guide, rebuilt when a new one is fetched"""
+    global _model
+    raw = fetch_kekg()
+    model = _model
+    if model is None or model.raw is not raw:
+        model = _model = GuideModel(raw)
+    return model
+
 
-    return filtered
+def filter_channels(numbers=[], labels=[], programs=[], reject=False):
+    return guide_model().select(numbers, labels, programs, reject)
 
 
 def channel_names():
     channels = filter_channels()
-    lines = [
-        '"{}": "{}",'.format(
-            ch.get("channelnumber"),
-            ch.get("channel"),
-        )
-        for ch in channels
-    ]
+    lines = ['"{}": "{}",'.format(ch.number, ch.name) for ch in channels]
     return "\n".join(lines)
 
 
 def good_sports(broadcast) -> bool:
-    on_now = broadcast.get("title")
+    on_now = broadcast.title
     return (
         on_now.startswith("*")
         and "College" not in on_now
@@ -80,15 +713,19 @@ def sports(spam=False):
     )
 
 
+def channel_label(channel):
+    return number_mapping.get(channel.number, channel.label)
+
+
 def egg():
     channels = filter_channels(programs=["*College Football"])
     lines = []
     for ch in channels:
-        now = ch.get("broadcastnow")
+        now = ch.now
         if now:
-            channel = number_mapping.get(str(ch.get("channelnumber")), ch.get("label"))
-            on_now = now.get("title", " ")
-            desc = now.get("plot")
+            channel = channel_label(ch)
+            on_now = now.title or " "
+            desc = now.plot
             if desc.startswith("All the action"):
                 continue
             desc = desc.replace("No. ", "#")
@@ -102,11 +739,11 @@ def march():
     channels = filter_channels(numbers=["503", "683", "551", "552"])
     lines = []
     for ch in channels:
-        now = ch.get("broadcastnow")
+        now = ch.now
         if now:
-            channel = number_mapping.get(str(ch.get("channelnumber")), ch.get("label"))
-            on_now = now.get("title", " ")
-            desc = now.get("plot")
+            channel = channel_label(ch)
+            on_now = now.title or " "
+            desc = now.plot
             desc = desc.replace("No. ", "#")
             desc = desc.replace("St.", "Saint")
             desc = desc[: desc.find(".")] if "." in desc else desc
@@ -116,34 +753,35 @@ def march():
 
 
 def is_show(broadcast) -> bool:
-    return broadcast.get("runtime", 0) <= 60
+    return (broadcast.runtime or 0) <= 60
 
 
 def is_not_show(broadcast) -> bool:
-    return broadcast.get("runtime", 0) > 60 and not broadcast.get(
-        "title", ""
-    ).startswith("*")
+    return (broadcast.runtime or 0) > 60 and not broadcast.title.startswith("*")
+
+
+EASTERN = pytz.timezone("US/Eastern")
+# Jeopardy starts at 7:05pm Eastern on weekdays
+JEOP_START = (19, 5)
 
 
 def runs_over_jeop(broadcast) -> bool:
-    start = broadcast.get("starttime")
-    end = broadcast.get("endtime")
-    if not start or not end:
+    # Worked out once per broadcast, the model lives as long as the guide
+    if broadcast._over_jeop is None:
+        broadcast._over_jeop = _runs_over_jeop(broadcast.start, broadcast.end)
+    return broadcast._over_jeop
+
+
+def _runs_over_jeop(start, end):
+    if start is None or end is None:
         return False
 
-    eastern_timezone = pytz.timezone("US/Eastern")
-    startdate = (
-        datetime.strptime(start, "%Y-%m-%d %H:%M:%S")
-        .replace(tzinfo=pytz.UTC)
-        .astimezone(eastern_timezone)
-    )
-    enddate = (
-        datetime.strptime(end, "%Y-%m-%d %H:%M:%S")
-        .replace(tzinfo=pytz.UTC)
-        .astimezone(eastern_timezone)
-    )
+    startdate = datetime.fromtimestamp(start, EASTERN)
+    enddate = datetime.fromtimestamp(end, EASTERN)
 
-    jeop_start = startdate.replace(hour=19, minute=5, second=0, microsecond=0)
+    jeop_start = startdate.replace(
+        hour=JEOP_START[0], minute=JEOP_START[1], second=0, microsecond=0
+    )
 
     if startdate.time() > jeop_start.time():
         jeop_start += timedelta(days=1)
@@ -160,7 +798,7 @@ def good_movie(broadcast) -> bool:
 
 def is_genre(broadcast, genre) -> bool:
     try:
-        return broadcast.get("genre", False) and genre in broadcast.get("genre")
+        return bool(broadcast.genre) and genre in broadcast.genre
     except TypeError:
         return False
 
@@ -240,68 +878,210 @@ def sports_alt():
 
 
 def starttime_sorted(channel_broadcasts):
-    return sorted(channel_broadcasts, key=lambda b: b[1].get("starttime", ""))
+    return sorted(channel_broadcasts, key=lambda b: b[1].start or 0)
 
 
 def program_printout(channel, broadcast, plot=False):
     return "<b>{}</b> - {} - {}{}".format(
-        broadcast.get("title"),
-        number_mapping.get(str(channel.get("channelnumber")), channel.get("label")),
+        broadcast.title,
+        channel_label(channel),
         program_timing(broadcast),
-        f"\n{broadcast.get('plot','')[:275]}\n" if plot else "",
+        f"\n{broadcast.plot[:275]}\n" if plot else "",
     )
 
 
 def imdb_extra_printout(channel, broadcast, plot=True):
     try:
-        imdb_info = imdb_info_by_search(broadcast.get("title"))
+        # Same cache as !imdb, a title stays cached across !imdbspam calls
+        imdb_info = fetch.run_sync(imdb_info_by_search_cached(broadcast.title))
+        if imdb_info is None:
+            return ""
         channel_time = " - {} - {}".format(
-            number_mapping.get(str(channel.get("channelnumber")), channel.get("label")),
-            program_timing(broadcast),
+            channel_label(channel), program_timing(broadcast)
         )
         return imdb_printout(imdb_info, show_poster=False, extra_info=channel_time)
     except KeyError:
         return ""
 
 
-def program_timing(broadcast):
-    try:
-        current_time = datetime.now(pytz.UTC)
-        starttime = datetime.strptime(
-            broadcast.get("starttime", ""), "%Y-%m-%d %H:%M:%S"
-        ).replace(tzinfo=pytz.UTC)
-
-        if starttime > current_time:
-            time_until = starttime - current_time
-            now_remaining = str(round(time_until.total_seconds() / 60))
-            return "In {} minutes".format(now_remaining)
-        else:
-            now_prog = broadcast.get("progresspercentage", 50)
-            return "{}% done".format(math.floor(now_prog))
-
-    except ValueError:
+def program_timing(broadcast, now=None):
+    if broadcast.start is None:
         return ""
+    now = time.time() if now is None else now
+
+    if broadcast.start > now:
+        return "In {} minutes".format(round((broadcast.start - now) / 60))
+    else:
+        return "{}% done".format(math.floor(broadcast.percent_done(now)))
 
 
 # Returns two lists of (channel, broadcast)
-def starting_now(channels, test=always_true, default_now=False):
+def starting_now(channels, test=always_true, default_now=False, now=None):
+    now = time.time() if now is None else now
     started = []
     coming_up = []
     for channel in channels:
-        now = channel.get("broadcastnow")
-        next = channel.get("broadcastnext")
-
-        if now:
-            now_prog = now.get("progresspercentage", 50)
-            now_starting = now_prog < 15
-            now_remaining = math.floor(
-                ((now.get("runtime", 420) * 60) - now.get("progress", 210 * 60)) / 60
-            )
-            if now_starting and test(now):
-                started.append((channel, now))
-            elif next and now_remaining <= 15 and test(next):
-                coming_up.append((channel, next))
-            elif default_now and test(now):
-                started.append((channel, now))
+        current = channel.now
+        following = channel.next
+
+        if current:
+            now_starting = current.percent_done(now) < 15
+            now_remaining = current.minutes_left(now)
+            if now_starting and test(current):
+                started.append((channel, current))
+            elif following and now_remaining <= 15 and test(following):
+                coming_up.append((channel, following))
+            elif default_now and test(current):
+                started.append((channel, current))
 
     return started, coming_up
+
+
+# How far either side of a time counts as starting then, same as starting_now
+STARTING_WINDOW = 15 * 60
+# Airings !next lists
+NEXT_LIMIT = 3
+
+
+def clock_time(hour, minute, now=None):
+    """Epoch seconds of the next hour:minute Eastern, up to half an hour ago"""
+    now = time.time() if now is None else now
+    day = datetime.fromtimestamp(now, EASTERN).replace(tzinfo=None)
+    local = day.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    when = EASTERN.localize(local).timestamp()
+    if when < now - STARTING_WINDOW * 2:
+        when = EASTERN.localize(local + timedelta(days=1)).timestamp()
+    return when
+
+
+def clock_printout(when):
+    local = datetime.fromtimestamp(when, EASTERN)
+    return "{:%I:%M%p}".format(local).lstrip("0").lower()
+
+
+def starting_at(schedule, when, test=always_true):
+    """Airings that just started at when or start in the next few minutes"""
+    started = [
+        (ch, br)
+        for ch, br in schedule.on_at(when)
+        if br.percent_done(when) < 15 and test(br)
+    ]
+    coming_up = [
+        (ch, br)
+        for ch, br in schedule.starting_between(when, when + STARTING_WINDOW)
+        if br.start > when and test(br)
+    ]
+    return started + coming_up
+
+
+def movies_at(hour, minute, spam=False):
+    model = guide_model()
+    when = clock_time(hour, minute)
+    if model.schedule.until is None or when >= model.schedule.until:
+        return "Guide only goes to {}".format(
+            clock_printout(model.schedule.until or time.time())
+        )
+
+    channels = {ch.position for ch in model.select(labels=movies_labels)}
+    movies = [
+        (ch, br)
+        for ch, br in starting_at(model.schedule, when, good_movie)
+        if ch.position in channels
+    ]
+    return "\n{}".format(
+        "\n".join(program_printout(ch, br, spam) for ch, br in movies),
+    )
+
+
+def next_airing(title, now=None):
+    """Soonest airings of titles matching title, on now or later"""
+    now = time.time() if now is None else now
+    model = guide_model()
+    key = title_key(title)
+    schedules = [model.titles[key]] if key in model.titles else []
+    if not schedules and len(key) > 2:
+        schedules = [model.titles[k] for k in model.titles_with_words(key)]
+
+    found = [s.next_airing(now) for s in schedules]
+    found = [a for a in found if a is not None]
+    if not found:
+        return "Not in the guide"
+    found.sort(key=lambda a: (a[1].start, a[0].position))
+    return "\n{}".format(
+        "\n".join(program_printout(ch, br) for ch, br in found[:NEXT_LIMIT]),
+    )
+
+
+# Announce airings starting up to this far after a refresh
+ANNOUNCE_LEAD = 5 * 60
+
+
+class NewBroadcasts:
+    """
+    Movies and games that started since the last check, each found once
+
+    A check only looks at airings starting after the previous one, a bisect
+    on the guide's Schedule, so it costs what's new rather than a pass over
+    every channel.  The first check just sets the mark, what's already on
+    when the bot starts isn't news.
+    """
+
+    def __init__(self):
+        self.since = None
+        # (channel number, start, title) already found -> start
+        self.found = {}
+        self._labels = {}
+
+    def labels(self, labels):
+        """Set of a label list, kept until reload_config replaces the list"""
+        found = self._labels.get(id(labels))
+        if found is None or found[0] is not labels:
+            found = self._labels[id(labels)] = (labels, frozenset(labels))
+        return found[1]
+
+    def check(self, model, now=None):
+        """{kind: [(channel, broadcast)]} for airings new since last check"""
+        now = time.time() if now is None else now
+        if self.since is None:
+            self.since = now
+            return {}
+
+        airings = model.schedule.starting_between(self.since, now + ANNOUNCE_LEAD)
+        new = {}
+        if airings:
+            for kind, labels, test in (
+                ("movies", self.labels(movies_labels), good_movie),
+                ("sports", self.labels(sports_labels), good_sports),
+            ):
+                for ch, br in airings:
+                    key = (ch.number, br.start, br.title)
+                    if ch.label in labels and key not in self.found and test(br):
+                        self.found[key] = br.start
+                        new.setdefault(kind, []).append((ch, br))
+
+        # Anything starting before the mark can't come up again
+        self.since = now
+        for key in [k for k, start in self.found.items() if start < now]:
+            del self.found[key]
+        return new
+
+
+watch = NewBroadcasts()
+
+
+def new_broadcasts():
+    if not announce:
+        # Nobody listening, start from scratch if someone subscribes
+        watch.since = None
+        return {}
+    return watch.check(guide_model())
+
+
+def announcement(new, kinds):
+    """One message for a room with the new airings of the kinds it wants"""
+    airings = [airing for kind in kinds for airing in new.get(kind, ())]
+    if not airings:
+        return ""
+    return "\nStarting now:\n{}".format(
+        "\n".join(program_printout(ch, br) for ch, br in starttime_sorted(airings))
+    )
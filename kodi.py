@@ -4,17 +4,26 @@ import json
 import math
 import time
 import random
-import requests
+import fetch
+import metrics
 import threading
 from guessit import guessit
 from rapidfuzz import fuzz
 
-
 cwd = os.path.dirname(os.path.abspath(__file__))
-with open(cwd + "/kekg_memes.json", "r") as stashjson:
-    kekg_config = json.load(stashjson)
 
-number_mapping = kekg_config["number_mapping"]
+
+def reload_config():
+    global kekg_config, number_mapping
+
+    with open(cwd + "/kekg_memes.json", "r") as stashjson:
+        config = json.load(stashjson)
+
+    number_mapping = config["number_mapping"]
+    kekg_config = config
+
+
+reload_config()
 
 
 KODI_URL = os.environ.get("KODI_URL")
@@ -341,7 +350,8 @@ def channel_detail(id):
     return res["result"]
 
 
-def fetch_kodi(method, **kwargs):
+@metrics.instrument("kodi")
+async def fetch_kodi_async(method, **kwargs):
     if KODI_URL and KODI_AUTH:
         headers = {
             "content-type": "application/json",
@@ -350,7 +360,11 @@ def fetch_kodi(method, **kwargs):
 
         data = {"jsonrpc": "2.0", "method": method, "params": kwargs, "id": 1}
 
-        response = requests.post(KODI_URL, json=data, headers=headers)
+        response = await fetch.post(KODI_URL, json=data, headers=headers)
         return json.loads(response.content)
     else:
         raise ValueError("KODI_URL and/or KODI_AUTH is not set")
+
+
+def fetch_kodi(method, **kwargs):
+    return fetch.run_sync(fetch_kodi_async(method, **kwargs))
@@ -1,9 +1,12 @@
 import os
 from mcstatus import JavaServer
 
+import metrics
+
 KRAFT_URL = os.environ.get("KRAFT_URL")
 
 
+@metrics.instrument("kraft")
 def who_krafting():
     if KRAFT_URL:
         server_status = JavaServer.lookup(KRAFT_URL).status()
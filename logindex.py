@@ -0,0 +1,314 @@
+import os
+import re
+import sqlite3
+import itertools
+import threading
+from contextlib import contextmanager
+
+cwd = os.path.dirname(os.path.abspath(__file__))
+
+# LOG_INDEX= (empty) turns the index off
+LOG_INDEX = os.environ.get("LOG_INDEX", os.path.join(cwd, "logs", "index.sqlite3"))
+
+# Lines per transaction when importing old logs
+IMPORT_BATCH = 5000
+# Milliseconds to wait while another supervisor worker writes to the index
+BUSY_TIMEOUT = 10000
+# Bumped when the tables change, an older index is rebuilt from the logs
+SCHEMA_VERSION = 1
+
+line_re = re.compile(r"^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\] <([^>]+)> (.*)$")
+
+# words only holds the full text index, the lines themselves stay in the
+# log files and lines points at them
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS words USING fts5(
+    body, content='', columnsize=0
+);
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY, file INTEGER, offset INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY, dev INTEGER, ino INTEGER, path TEXT, room TEXT,
+    offset INTEGER, UNIQUE (dev, ino)
+);
+CREATE TABLE IF NOT EXISTS seen (
+    user TEXT PRIMARY KEY, name TEXT, room TEXT, time TEXT, body TEXT
+);
+"""
+# Version 0 kept a copy of every line in lines, seen carries over
+OLD_TABLES = """
+DROP TABLE IF EXISTS lines;
+DROP TABLE IF EXISTS offsets;
+"""
+
+
+def log_room(path):
+    """
+    Room a log file belongs to, or None for logs that aren't room chat
+
+    devroom.log, devroom_mod.log and rotated devroom.log.2024-01-01 are chat,
+    devroom_deleted.log, status.log and the like are skipped.
+    """
+    name = os.path.basename(path)
+    stem, ext, _ = name.partition(".log")
+    if not ext:
+        return None
+    if stem.endswith("_mod"):
+        stem = stem[:-4]
+    if "_" in stem or stem in ("status", "errors", "flood", "bans"):
+        return None
+    return stem
+
+
+def parse_lines(lines):
+    """(offset, user, time, body) of the chat lines in (offset, line) pairs"""
+    rows = []
+    for offset, line in lines:
+        match = line_re.match(line.rstrip("\n"))
+        if match:
+            time_str, user, body = match.groups()
+            rows.append((offset, user, time_str, body))
+    return rows
+
+
+class LogIndex:
+    """
+    Full text index of the room logs in SQLite FTS5
+
+    New lines arrive from the chat logger after every flush.  Old files go
+    through import_dir, which remembers how far it got in each file by inode
+    so re-runs pick up where they stopped and rotated files aren't read twice.
+    The index keeps where each line is instead of a copy of it and grep reads
+    the hits back from the logs, so lines in deleted logs drop out.
+    """
+
+    def __init__(self, path=LOG_INDEX):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA busy_timeout = {}".format(BUSY_TIMEOUT))
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._write():
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            script = (OLD_TABLES if version < SCHEMA_VERSION else "") + SCHEMA
+            for statement in script.split(";"):
+                if statement.strip():
+                    self._db.execute(statement)
+            self._db.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+
+    @contextmanager
+    def _write(self):
+        """
+        Transaction that takes the write lock up front, so reading a file's
+        offset and indexing past it can't interleave with another worker
+        """
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            yield
+
+    def _file(self, st):
+        """(id, offset) of the file with st's inode, (None, 0) if it's new"""
+        row = self._db.execute(
+            "SELECT id, offset FROM files WHERE dev = ? AND ino = ?",
+            (st.st_dev, st.st_ino),
+        ).fetchone()
+        return row or (None, 0)
+
+    def _insert(self, rows, st, path, file_id, offset):
+        db = self._db
+        if file_id is None:
+            file_id = db.execute(
+                "INSERT INTO files (dev, ino, path, room, offset) VALUES (?, ?, ?, ?, ?)",
+                (st.st_dev, st.st_ino, path, log_room(path), offset),
+            ).lastrowid
+        else:
+            db.execute(
+                "UPDATE files SET path = ?, offset = ? WHERE id = ?",
+                (path, offset, file_id),
+            )
+        if not rows:
+            return
+        db.executemany(
+            "INSERT INTO lines (file, offset) VALUES (?, ?)",
+            [(file_id, row[0]) for row in rows],
+        )
+        # One statement inserts with consecutive ids, the last one is known
+        last = db.execute("SELECT last_insert_rowid()").fetchone()[0]
+        db.executemany(
+            "INSERT INTO words (rowid, body) VALUES (?, ?)",
+            zip(range(last - len(rows) + 1, last + 1), (row[3] for row in rows)),
+        )
+        room = log_room(path)
+        db.executemany(
+            """INSERT INTO seen (user, name, room, time, body) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user) DO UPDATE SET
+                name = excluded.name, room = excluded.room,
+                time = excluded.time, body = excluded.body
+            WHERE excluded.time >= seen.time""",
+            [(user.lower(), user, room, t, body) for _, user, t, body in rows],
+        )
+
+    def add_lines(self, path, lines, end):
+        """chatlog listener, indexes lines just appended to path"""
+        if log_room(path) is None:
+            return
+        sizes = [len(line.encode()) for line in lines]
+        start = end - sum(sizes)
+        st = os.stat(path)
+        with self._write():
+            file_id, offset = self._file(st)
+            if offset == start:
+                offsets = itertools.accumulate(sizes, initial=start)
+                self._insert(parse_lines(zip(offsets, lines)), st, path, file_id, end)
+                return
+        if offset < start:
+            # Lines written before this process started or by the supervisor
+            # worker that had the room before a rebalance, read them in too
+            self.import_file(path)
+
+    def import_file(self, path, batch=IMPORT_BATCH):
+        """Index whatever part of path isn't indexed yet, returns lines read"""
+        if log_room(path) is None:
+            return 0
+
+        total = 0
+        with open(path, "rb") as logfile:
+            st = os.fstat(logfile.fileno())
+            while True:
+                with self._write():
+                    file_id, offset = self._file(st)
+                    if offset > st.st_size:
+                        # Truncated in place, start over
+                        offset = 0
+                    logfile.seek(offset)
+                    lines = []
+                    for raw in logfile:
+                        if not raw.endswith(b"\n"):
+                            break
+                        lines.append((offset, raw.decode("utf-8", "replace")))
+                        offset += len(raw)
+                        if len(lines) >= batch:
+                            break
+                    if not lines:
+                        return total
+                    self._insert(parse_lines(lines), st, path, file_id, offset)
+                total += len(lines)
+                st = os.fstat(logfile.fileno())
+
+    def import_dir(self, log_dir):
+        """Catch up on every chat log in log_dir, oldest files first"""
+        paths = []
+        with os.scandir(log_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and log_room(entry.name):
+                    paths.append((entry.stat().st_mtime, entry.path))
+        return sum(self.import_file(path) for _, path in sorted(paths))
+
+    def seen(self, user):
+        """(name, room, time, body) of the user's last line, or None"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT name, room, time, body FROM seen WHERE user = ?",
+                (user.lower(),),
+            ).fetchone()
+
+    def grep(self, term, room=None, limit=5):
+        """Last indexed (user, room, time, body) lines with term as a phrase
+
+        Logs go in oldest first, so index order is time order.
+        """
+        query = '"{}"'.format(term.replace('"', '""'))
+        sql = """SELECT files.id, files.dev, files.ino, files.path, files.room,
+                lines.offset
+            FROM words
+            JOIN lines ON lines.id = words.rowid
+            JOIN files ON files.id = lines.file
+            WHERE words MATCH ? AND files.path IS NOT NULL"""
+        args = [query]
+        if room:
+            sql += " AND files.room = ?"
+            args.append(room)
+        sql += " ORDER BY words.rowid DESC LIMIT ?"
+        args.append(limit)
+        while True:
+            with self._lock:
+                hits = self._db.execute(sql, args).fetchall()
+            rows, missing = self._read_lines(hits)
+            # Logs that are gone were left out, ask again without them
+            if not missing:
+                return rows
+
+    def _read_lines(self, hits):
+        """
+        (user, room, time, body) of each hit read back from its log, and
+        whether any log couldn't be found
+        """
+        rows = []
+        missing = False
+        logfiles = {}
+        try:
+            for file_id, dev, ino, path, room, offset in hits:
+                if file_id not in logfiles:
+                    logfiles[file_id] = self._open(file_id, dev, ino, path)
+                logfile = logfiles[file_id]
+                if logfile is None:
+                    missing = True
+                    continue
+                logfile.seek(offset)
+                line = logfile.readline().decode("utf-8", "replace")
+                match = line_re.match(line.rstrip("\n"))
+                if match:
+                    time_str, user, body = match.groups()
+                    rows.append((user, room, time_str, body))
+        finally:
+            for logfile in logfiles.values():
+                if logfile is not None:
+                    logfile.close()
+        return rows, missing
+
+    def _open(self, file_id, dev, ino, path):
+        """
+        The log file with that inode, looked for again if it was rotated.
+        None if it's gone, its path is cleared so grep stops finding it
+        """
+        try:
+            logfile = open(path, "rb")
+            st = os.fstat(logfile.fileno())
+            if (st.st_dev, st.st_ino) == (dev, ino):
+                return logfile
+            logfile.close()
+        except OSError:
+            pass
+        try:
+            with os.scandir(os.path.dirname(path)) as entries:
+                for entry in entries:
+                    if entry.inode() == ino and entry.stat().st_dev == dev:
+                        with self._lock, self._db:
+                            self._db.execute(
+                                "UPDATE files SET path = ? WHERE id = ?",
+                                (entry.path, file_id),
+                            )
+                        return open(entry.path, "rb")
+        except OSError:
+            pass
+        with self._lock, self._db:
+            self._db.execute("UPDATE files SET path = NULL WHERE id = ?", (file_id,))
+        return None
+
+    def stats(self):
+        with self._lock:
+            lines = self._db.execute("SELECT count(*) FROM lines").fetchone()[0]
+            users = self._db.execute("SELECT count(*) FROM seen").fetchone()[0]
+        size = sum(
+            os.path.getsize(self.path + ext)
+            for ext in ("", "-wal")
+            if os.path.exists(self.path + ext)
+        )
+        return {"lines": lines, "users": users, "bytes": size}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,5 +1,10 @@
 #!/bin/sh
 
+# With BOT_SHARDS the supervisor restarts crashed workers itself
+if [ -n "$BOT_SHARDS" ]; then
+    exec python3 /root/lmaobot/async.py
+fi
+
 while true
 do
     echo "Starting bot..."
@@ -0,0 +1,288 @@
+import os
+import time
+import asyncio
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+
+# METRICS_PORT serves /metrics on localhost in Prometheus text format
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+# Seconds between summaries in the status log
+METRICS_INTERVAL = int(os.environ.get("METRICS_INTERVAL", 3600))
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = ['{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def header(self):
+        return [
+            "# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+
+    def render(self):
+        lines = self.header()
+        for labels, value in sorted(self.collect().items()):
+            lines.append(
+                "{}{} {}".format(self.name, _labels(self.labels, labels), value)
+            )
+        return lines
+
+    def collect(self):
+        with self._lock:
+            return dict(self.values)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+
+class Gauge(Metric):
+    """Set directly, or give collect() returning {label tuple: value}"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        if collect is not None:
+            self.collect = collect
+
+    def set(self, *labels, value):
+        with self._lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # One count per bucket plus +Inf, then the sum
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def count(self, *labels):
+        counts = self.values.get(labels)
+        return sum(counts[:-1]) if counts else 0
+
+    def percentile(self, q, *labels):
+        """Upper bound of the bucket holding the q-th observation"""
+        with self._lock:
+            counts = list(self.values.get(labels) or ())
+        if not counts:
+            return None
+        target = q * sum(counts[:-1])
+        seen = 0
+        for bound, n in zip(self.buckets, counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self.values.items())
+        for labels, counts in items:
+            total = 0
+            for bound, n in zip(self.buckets + ("+Inf",), counts):
+                total += n
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        self.name,
+                        _labels(self.labels, labels, 'le="{}"'.format(bound)),
+                        total,
+                    )
+                )
+            lines.append(
+                "{}_sum{} {}".format(
+                    self.name, _labels(self.labels, labels), counts[-1]
+                )
+            )
+            lines.append(
+                "{}_count{} {}".format(self.name, _labels(self.labels, labels), total)
+            )
+        return lines
+
+
+calls = Counter(
+    "lmaobot_calls_total", "Handler and integration calls", ("kind", "name")
+)
+errors = Counter("lmaobot_errors_total", "Calls that raised", ("kind", "name"))
+latency = Histogram(
+    "lmaobot_latency_seconds", "Handler and integration latency", ("kind", "name")
+)
+logged_errors = Counter(
+    "lmaobot_logged_errors_total", "Lines written to errors.log", ("key",)
+)
+queue_depth = Gauge("lmaobot_sendq_depth", "Messages waiting to send", ("room",))
+queue_wait = Histogram(
+    "lmaobot_sendq_wait_seconds", "Time messages spent queued", ("room",)
+)
+queue_merged = Counter(
+    "lmaobot_sendq_merged_total", "Queued messages sent with the one before", ("room",)
+)
+governed = Counter(
+    "lmaobot_governor_total",
+    "Routed messages by flood governor outcome",
+    ("class", "outcome"),
+)
+first_message = Histogram(
+    "lmaobot_llm_first_message_seconds", "Time from LLM request to first room message"
+)
+
+
+@contextmanager
+def track(kind, name):
+    """Count a call, its latency and whether it raised"""
+    calls.inc(kind, name)
+    start = time.perf_counter()
+    try:
+        yield
+    except asyncio.CancelledError:
+        raise
+    except BaseException:
+        errors.inc(kind, name)
+        raise
+    finally:
+        latency.observe(time.perf_counter() - start, kind, name)
+
+
+def instrument(name, kind="integration"):
+    """Decorator version of track for plain and async functions"""
+
+    def decorate(func):
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with track(kind, name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track(kind, name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _seconds(value):
+    return "-" if value is None else "{:g}s".format(value)
+
+
+def summary():
+    """Status log lines, one per handler, integration and send queue"""
+    lines = []
+    for kind, name in sorted(calls.collect()):
+        lines.append(
+            "[{}] {} calls={} errors={} p50<={} p99<={}".format(
+                kind,
+                name,
+                calls.get(kind, name),
+                errors.get(kind, name),
+                _seconds(latency.percentile(0.5, kind, name)),
+                _seconds(latency.percentile(0.99, kind, name)),
+            )
+        )
+    for (room,), depth in sorted(queue_depth.collect().items()):
+        lines.append(
+            "[sendq] [{}] depth={} sent={} merged={} wait_p50<={} wait_p99<={}".format(
+                room,
+                depth,
+                queue_wait.count(room),
+                queue_merged.get(room),
+                _seconds(queue_wait.percentile(0.5, room)),
+                _seconds(queue_wait.percentile(0.99, room)),
+            )
+        )
+    if logged_errors.values:
+        lines.append(
+            "[errors] {}".format(
+                " ".join(
+                    "{}={}".format(key, n)
+                    for (key,), n in sorted(logged_errors.collect().items())
+                )
+            )
+        )
+    outcomes = {}
+    for (handler_class, outcome), n in sorted(governed.collect().items()):
+        outcomes.setdefault(handler_class, []).append("{}={}".format(outcome, n))
+    for handler_class, counts in outcomes.items():
+        lines.append("[governor] {} {}".format(handler_class, " ".join(counts)))
+    if first_message.count():
+        lines.append(
+            "[llm] first message p50<={} p99<={}".format(
+                _seconds(first_message.percentile(0.5)),
+                _seconds(first_message.percentile(0.99)),
+            )
+        )
+    return lines
+
+
+async def serve(port=METRICS_PORT, host="127.0.0.1"):
+    """Run the /metrics endpoint until cancelled"""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,83 @@
+import os
+import time
+import logging
+import importlib
+import threading
+from contextlib import contextmanager
+
+# BOT_PROFILE_STARTUP=1 logs how long each import and data file took
+PROFILE_STARTUP = bool(os.environ.get("BOT_PROFILE_STARTUP"))
+
+timings = []
+
+
+@contextmanager
+def timed(label):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.append((label, time.perf_counter() - start))
+
+
+def report(total=None):
+    lines = ["{:>8.1f} ms  {}".format(secs * 1000, label) for label, secs in timings]
+    if total is not None:
+        lines.append("{:>8.1f} ms  total".format(total * 1000))
+    return "\n".join(lines)
+
+
+def log_report(total=None):
+    if PROFILE_STARTUP:
+        logging.info("startup profile\n%s", report(total))
+
+
+class LazyModule:
+    """Imports the module the first time an attribute is used"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    with timed("import {}".format(self._name)):
+                        self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+class LazyAttr:
+    """Stands in for a module function until it is first called"""
+
+    def __init__(self, module, attr):
+        self.module = module
+        self.attr = attr
+
+    def __call__(self, *args, **kwargs):
+        return getattr(self.module.load(), self.attr)(*args, **kwargs)
+
+    def __repr__(self):
+        return "<lazy {}.{}>".format(self.module._name, self.attr)
+
+
+_modules = {}
+
+
+def lazy_module(name):
+    if name not in _modules:
+        _modules[name] = LazyModule(name)
+    return _modules[name]
+
+
+def lazy(module_name, attr):
+    return LazyAttr(lazy_module(module_name), attr)
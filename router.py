@@ -0,0 +1,245 @@
+from urllib.parse import urlparse
+
+
+class MessageContext:
+    """Everything a handler needs about one incoming message"""
+
+    __slots__ = (
+        "room",
+        "message",
+        "user",
+        "bot_name",
+        "body",
+        "body_lower",
+        "command",
+        "link",
+        "host",
+        "trigger",
+        "match",
+    )
+
+    def __init__(self, room, message, bot_name, body_lower, link=None):
+        self.room = room
+        self.message = message
+        self.user = message.user
+        self.bot_name = bot_name
+        self.body = message.body
+        self.body_lower = body_lower
+        self.command = body_lower.strip()
+        self.link = link
+        self.host = link_host(link) if link else None
+        self.trigger = None
+        self.match = None
+
+
+def link_host(link):
+    try:
+        return (urlparse(link).hostname or "").lower()
+    except ValueError:
+        return ""
+
+
+def host_suffixes(host):
+    """www.ntd.com -> www.ntd.com, ntd.com, com"""
+    parts = host.split(".")
+    return [".".join(parts[i:]) for i in range(len(parts))]
+
+
+class Route:
+    __slots__ = (
+        "name",
+        "handler",
+        "order",
+        "groups",
+        "guard",
+        "search",
+        "needs",
+        "contains",
+        "when",
+    )
+
+    def __init__(
+        self, name, handler, order, groups, guard, search, needs, contains, when
+    ):
+        self.name = name
+        self.handler = handler
+        self.order = order
+        self.groups = groups
+        self.guard = guard
+        self.search = search
+        self.needs = needs
+        self.contains = contains
+        self.when = when
+
+    @property
+    def scans(self):
+        return bool(self.search or self.contains or self.when)
+
+
+class Router:
+    """Picks the handler for a message without walking every condition
+
+    Routes are tried in the order they were added, same as an if/elif chain,
+    but exact commands, prefixes and link hosts are looked up in tables.
+    Regex and predicate triggers only run when they are ordered before the
+    best table hit, so most messages never touch them.
+    """
+
+    def __init__(self):
+        self.routes = []
+        self.group_sets = {}
+        self._exact = {}
+        self._prefixes = []
+        self._hosts = {}
+        self._scans = []
+        self._room_routes = {}
+        self._open_routes = frozenset()
+
+    def add(
+        self,
+        name,
+        handler,
+        exact=(),
+        prefix=(),
+        hosts=(),
+        search=None,
+        needs=(),
+        contains=(),
+        when=None,
+        groups=None,
+        guard=None,
+    ):
+        """
+        Register a handler, earlier routes win when several match
+
+        Args:
+            name (str): Label used in logs and stats
+            handler (callable): Called with (bot, room, ctx)
+            exact (iterable): Whole (stripped, lowercased) messages to match
+            prefix (iterable): Message prefixes, ctx.match gets the rest
+            hosts (iterable): Hostnames of the first link, subdomains included.
+                Matched on whole labels, ntdtv.com doesn't match ntdtv.com.tw
+            search (re.Pattern): Regex searched in the original body
+            needs (iterable): Substrings of the lowercased body, search only
+                runs when one is there so other messages skip the regex
+            contains (iterable): Substrings of the lowercased body
+            when (callable): Predicate on ctx, truthy result becomes ctx.match
+            groups (iterable, optional): rooms.yaml groups allowed to use it
+            guard (callable, optional): Extra check on ctx after a trigger hits
+        """
+        route = Route(
+            name,
+            handler,
+            len(self.routes),
+            tuple(groups) if groups else None,
+            guard,
+            search,
+            tuple(needs),
+            tuple(contains),
+            when,
+        )
+        self.routes.append(route)
+
+        for cmd in exact:
+            self._exact.setdefault(cmd, []).append(route)
+        for p in prefix:
+            self._prefixes.append((p, route))
+        self._prefixes.sort(key=lambda pr: (-len(pr[0]), pr[1].order))
+        for host in hosts:
+            self._hosts.setdefault(host.lower(), []).append(route)
+        if route.scans:
+            self._scans.append(route)
+
+        return route
+
+    def build(self, chat):
+        """Precompute which routes each room may use from the rooms.yaml groups"""
+        group_sets = {group: frozenset(rooms or []) for group, rooms in chat.items()}
+        open_routes = frozenset(r for r in self.routes if r.groups is None)
+
+        room_routes = {}
+        for room_name in set().union(*group_sets.values()):
+            room_routes[room_name] = open_routes | frozenset(
+                r
+                for r in self.routes
+                if r.groups
+                and any(room_name in group_sets.get(g, ()) for g in r.groups)
+            )
+
+        # Rebuilt on rooms.yaml reload, swap everything in at the end
+        self.group_sets = group_sets
+        self._open_routes = open_routes
+        self._room_routes = room_routes
+
+    def in_group(self, room_name, *groups):
+        return any(room_name in self.group_sets.get(g, ()) for g in groups)
+
+    def enabled(self, room_name):
+        return self._room_routes.get(room_name, self._open_routes)
+
+    def dispatch(self, ctx):
+        """Return the first route matching ctx and fill in ctx.trigger/match"""
+        enabled = self.enabled(ctx.room.name)
+        best = None
+        best_trigger = None
+        best_match = None
+
+        for route in self._exact.get(ctx.command, ()):
+            if route in enabled and self._allowed(route, ctx, "exact", ctx.command):
+                best, best_trigger, best_match = route, "exact", ctx.command
+                break
+
+        for p, route in self._prefixes:
+            if best and route.order >= best.order:
+                continue
+            if ctx.body_lower.startswith(p) and route in enabled:
+                rest = ctx.body_lower[len(p) :]
+                if self._allowed(route, ctx, "prefix", rest):
+                    best, best_trigger, best_match = route, "prefix", rest
+
+        if ctx.host:
+            for host in host_suffixes(ctx.host):
+                for route in self._hosts.get(host, ()):
+                    if best and route.order >= best.order:
+                        continue
+                    if route in enabled and self._allowed(route, ctx, "host", ctx.link):
+                        best, best_trigger, best_match = route, "host", ctx.link
+
+        for route in self._scans:
+            if best and route.order > best.order:
+                break
+            if route not in enabled:
+                continue
+            trigger, match = self._scan(route, ctx)
+            if match and self._allowed(route, ctx, trigger, match):
+                best, best_trigger, best_match = route, trigger, match
+                break
+
+        ctx.trigger = best_trigger
+        ctx.match = best_match
+        return best
+
+    @staticmethod
+    def _scan(route, ctx):
+        if route.search and (
+            not route.needs or any(n in ctx.body_lower for n in route.needs)
+        ):
+            match = route.search.search(ctx.body)
+            if match:
+                return "search", match
+        for needle in route.contains:
+            if needle in ctx.body_lower:
+                return "contains", needle
+        if route.when:
+            match = route.when(ctx)
+            if match:
+                return "when", match
+        return None, None
+
+    @staticmethod
+    def _allowed(route, ctx, trigger, match):
+        if route.guard is None:
+            return True
+        ctx.trigger = trigger
+        ctx.match = match
+        return route.guard(ctx)
@@ -0,0 +1,190 @@
+"""
+Timed room broadcasts from schedule.yaml
+
+Each job has a five field cron expression (minute hour day month weekday)
+read in its own timezone, the rooms.yaml groups it goes to and the bot action
+it runs.  One task sleeps until the earliest job on a heap, runs everything
+that's due and puts each job back at its next time.
+"""
+
+import time
+import heapq
+import random
+import asyncio
+import itertools
+from datetime import datetime, timedelta
+
+import pytz
+
+# Longest single sleep, so clock changes and reloads get noticed
+MAX_SLEEP = 300
+# Default seconds to spread a job's rooms over
+JITTER = 10
+
+FIELDS = (
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 6),
+)
+
+
+def parse_field(text, name, low, high):
+    # Sunday is 0 or 7
+    top = 7 if name == "weekday" else high
+    values = set()
+    for part in str(text).split(","):
+        spec, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if spec == "*":
+            start, end = low, high
+        elif "-" in spec:
+            start, end = (int(n) for n in spec.split("-", 1))
+        else:
+            start = int(spec)
+            end = high if step > 1 else start
+        if not low <= start <= end <= top or step < 1:
+            raise ValueError("bad {} field {!r}".format(name, text))
+        values.update(range(start, end + 1, step))
+    return frozenset(v % 7 if name == "weekday" else v for v in values)
+
+
+class Cron:
+    """Five field cron expression, day and weekday match either when both set"""
+
+    def __init__(self, expression, tz="UTC"):
+        parts = expression.split()
+        if len(parts) != len(FIELDS):
+            raise ValueError("cron needs 5 fields: {!r}".format(expression))
+        self.expression = expression
+        self.tz = pytz.timezone(tz)
+        fields = [parse_field(p, *f) for p, f in zip(parts, FIELDS)]
+        self.minutes, self.hours, self.days, self.months, self.weekdays = fields
+        self.any_day = parts[2] == "*"
+        self.any_weekday = parts[4] == "*"
+
+    def day_matches(self, day):
+        in_days = day.day in self.days
+        # isoweekday is 1-7 from Monday, cron is 0-6 from Sunday
+        in_weekdays = day.isoweekday() % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, when):
+        """Epoch seconds of the first match after epoch seconds when"""
+        local = datetime.fromtimestamp(when, self.tz).replace(tzinfo=None)
+        t = local.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1) + timedelta(days=32)).replace(
+                    day=1, hour=0, minute=0
+                )
+            elif not self.day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return self.tz.localize(t).timestamp()
+        raise ValueError("cron never matches: {!r}".format(self.expression))
+
+
+class Job:
+    def __init__(
+        self,
+        name,
+        cron,
+        action,
+        timezone="UTC",
+        groups=None,
+        chance=1.0,
+        jitter=JITTER,
+        enabled=True,
+    ):
+        self.name = name
+        self.cron = Cron(cron, timezone)
+        self.action = action
+        self.groups = groups
+        self.chance = chance
+        self.jitter = jitter
+        self.enabled = enabled
+
+    @classmethod
+    def from_config(cls, name, spec):
+        return cls(name, **spec)
+
+
+def parse_schedule(config):
+    """Jobs from the schedule.yaml mapping of name to job settings"""
+    return [Job.from_config(name, spec or {}) for name, spec in (config or {}).items()]
+
+
+async def fan_out(rooms, send, jitter=JITTER):
+    """send(room) for every room at once, each started up to jitter seconds late"""
+
+    async def delayed(room):
+        if jitter:
+            await asyncio.sleep(random.uniform(0, jitter))
+        await send(room)
+
+    return await asyncio.gather(
+        *(delayed(room) for room in rooms), return_exceptions=True
+    )
+
+
+class Scheduler:
+    """
+    Runs due jobs with run_job(job), upcoming() lists what's next
+
+    The heap holds (epoch seconds, sequence, job), load() replaces every job
+    and wakes the run loop so a reloaded schedule counts from now.
+    """
+
+    def __init__(self, run_job=None):
+        self.run_job = run_job
+        self.jobs = []
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        # Running jobs, the loop only keeps weak references to tasks
+        self._running = set()
+
+    def load(self, jobs, now=None):
+        now = time.time() if now is None else now
+        self.jobs = list(jobs)
+        self._heap = [
+            (job.cron.next_after(now), next(self._seq), job)
+            for job in self.jobs
+            if job.enabled
+        ]
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def upcoming(self, limit=10):
+        """[(epoch seconds, job)] soonest first"""
+        return [(when, job) for when, _, job in heapq.nsmallest(limit, self._heap)]
+
+    async def run(self):
+        while True:
+            timeout = MAX_SLEEP
+            if self._heap:
+                timeout = min(max(self._heap[0][0] - time.time(), 0), MAX_SLEEP)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                when, _, job = heapq.heappop(self._heap)
+                heapq.heappush(
+                    self._heap, (job.cron.next_after(now), next(self._seq), job)
+                )
+                task = asyncio.ensure_future(self.run_job(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
@@ -0,0 +1,112 @@
+import time
+import heapq
+import asyncio
+import itertools
+
+import metrics
+
+# Lower goes first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+# Messages allowed back to back, rooms in slow mode get 1
+SEND_BURST = 2
+# Extra seconds on top of the room rate limit so we never arrive early
+SEND_MARGIN = 0.2
+
+
+class TokenBucket:
+    def __init__(self, rate=1.0, capacity=SEND_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until a token is available"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class SendQueue:
+    """
+    Outgoing messages for one room, ordered by priority then arrival
+
+    Small messages waiting behind each other with the same send options are
+    merged into one send when they fit together.
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self._heap = []
+        self._seq = itertools.count()
+        self._ready = asyncio.Event()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def put(self, msg, kwargs, priority=PRIORITY_NORMAL):
+        heapq.heappush(
+            self._heap, (priority, next(self._seq), msg, kwargs, time.monotonic())
+        )
+        metrics.queue_depth.set(self.name, value=len(self._heap))
+        self._ready.set()
+
+    async def wait(self):
+        while not self._heap:
+            self._ready.clear()
+            await self._ready.wait()
+
+    def pop(self, max_length):
+        _, _, msg, kwargs, queued = heapq.heappop(self._heap)
+        waits = [queued]
+
+        while self._heap:
+            _, _, next_msg, next_kwargs, next_queued = self._heap[0]
+            if next_kwargs != kwargs or len(msg) + len(next_msg) + 1 > max_length:
+                break
+            heapq.heappop(self._heap)
+            msg = "{}\n{}".format(msg, next_msg)
+            waits.append(next_queued)
+            metrics.queue_merged.inc(self.name)
+
+        now = time.monotonic()
+        for queued in waits:
+            metrics.queue_wait.observe(now - queued, self.name)
+        metrics.queue_depth.set(self.name, value=len(self._heap))
+        return msg, kwargs
+
+
+def chunk_message(message, max_length):
+    """Split on newlines into pieces no longer than max_length where possible"""
+    if len(message) <= max_length:
+        return [message]
+
+    chunks = []
+    current_chunk = []
+    current_length = 0
+
+    for line in message.split("\n"):
+        if current_chunk and current_length + len(line) + 1 > max_length:
+            chunks.append("\n".join(current_chunk))
+            current_chunk = []
+            current_length = 0
+        current_chunk.append(line)
+        current_length += len(line) + 1
+
+    if current_chunk:
+        chunks.append("\n".join(current_chunk))
+
+    return chunks
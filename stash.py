@@ -0,0 +1,130 @@
+import random
+from array import array
+from bisect import bisect_left
+
+# Suggestions scoring below this (0-100) aren't worth showing
+SUGGEST_CUTOFF = 70
+# Typos shorter than this match too much to guess at
+SUGGEST_MIN_LENGTH = 3
+
+
+def _deletes(text):
+    return {text[:i] + text[i + 1 :] for i in range(len(text))}
+
+
+class StashIndex:
+    """
+    Lookups for stash_memes.json, built once per load
+
+    Commands resolve through a lowercase map of the keys and a map of plural
+    spellings ("/dinks" to "/dink").  Misses get suggestions from keys within
+    one typo, found through an index of every key with one character
+    deleted, which takes microseconds however big the stash is.  A miss
+    with no such neighbour gets no suggestion, scoring every key would
+    block the event loop for milliseconds on a big stash.
+    """
+
+    def __init__(self, stash):
+        self.memes = stash
+        self.items = list(stash.items())
+        self.keys = {key.lower(): key for key in stash}
+
+        self.plurals = {}
+        for suffix in ("es", "s"):
+            for lower, key in self.keys.items():
+                if lower + suffix not in self.keys:
+                    self.plurals[lower + suffix] = key
+
+        # Keys without the slash, what rapidfuzz compares against
+        self.choices = [lower.lstrip("/") for lower in self.keys]
+        self._canonical = list(self.keys.values())
+        self._exact = {choice: i for i, choice in enumerate(self.choices)}
+        # Sorted hash(key with one char deleted) << shift | index, packed in
+        # one array of ints instead of a dict of objects.  Truncated hashes
+        # that collide only add a candidate, scoring drops it
+        self._shift = max(len(self.choices), 1).bit_length()
+        mask = (1 << (63 - self._shift)) - 1
+        shift = self._shift
+        packed = [
+            (hash(choice[:j] + choice[j + 1 :]) & mask) << shift | i
+            for i, choice in enumerate(self.choices)
+            # Typos that short aren't suggested for, so can't reach them
+            if len(choice) >= SUGGEST_MIN_LENGTH
+            for j in range(len(choice))
+        ]
+        packed.sort()
+        self._neighbours = array("q", packed)
+        self._mask = mask
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, cmd):
+        return cmd.lower() in self.keys
+
+    def get(self, cmd, default=None):
+        key = self.keys.get(cmd.lower())
+        return default if key is None else self.memes[key]
+
+    def resolve(self, cmd):
+        """(stash key, was plural) for a command, (None, False) if it's not one"""
+        cmd = cmd.lower()
+        key = self.keys.get(cmd)
+        if key is not None:
+            return key, False
+        key = self.plurals.get(cmd)
+        if key is not None:
+            return key, True
+        return None, False
+
+    def roll(self):
+        return random.choice(self.items)
+
+    def latest(self, count):
+        return [key for key, _ in self.items[-count:]]
+
+    def _lookup(self, found, text):
+        """Add indexes of keys with a deletion hashing like text to found"""
+        low = (hash(text) & self._mask) << self._shift
+        high = low + (1 << self._shift)
+        neighbours = self._neighbours
+        at = bisect_left(neighbours, low)
+        while at < len(neighbours) and neighbours[at] < high:
+            found.add(neighbours[at] - low)
+            at += 1
+
+    def _candidates(self, text):
+        """Indexes of keys at most one deletion from text on either side"""
+        found = set()
+        self._lookup(found, text)
+        for deleted in _deletes(text):
+            hit = self._exact.get(deleted)
+            if hit is not None:
+                found.add(hit)
+            self._lookup(found, deleted)
+        return found
+
+    def suggest(self, misses, limit=3, cutoff=SUGGEST_CUTOFF):
+        """{miss: [closest stash keys]} for commands that matched nothing"""
+        # Imported on the first miss, rooms connect without it
+        from rapidfuzz import fuzz, process
+
+        suggestions = {}
+        for miss in dict.fromkeys(m.lower() for m in misses):
+            text = miss.lstrip("/")
+            if len(text) < SUGGEST_MIN_LENGTH:
+                continue
+            candidates = self._candidates(text)
+            if not candidates:
+                continue
+            best = process.extract(
+                text,
+                {i: self.choices[i] for i in candidates},
+                scorer=fuzz.ratio,
+                processor=None,
+                limit=limit,
+                score_cutoff=cutoff,
+            )
+            if best:
+                suggestions[miss] = [self._canonical[i] for _, _, i in best]
+        return suggestions
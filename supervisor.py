@@ -0,0 +1,369 @@
+"""
+Supervisor mode, the prod rooms sharded over worker processes
+
+    BOT_SHARDS=4 BOT_PROD=1 python3 async.py
+
+The supervisor forks BOT_SHARDS workers, each running its own LmaoBot on a
+share of the rooms, and restarts any worker that dies without touching the
+others.  Workers report how many messages each room gets and every
+REBALANCE_INTERVAL seconds the busiest rooms are moved off shards that are
+doing much more than their share.
+
+The supervisor also keeps the shared side of TTLCaches made with
+shared=True, so an OMDb lookup or guide fetch done by one worker is a hit in
+the others.  Everything goes over one pipe per worker.
+"""
+
+import os
+import sys
+import time
+import signal
+import asyncio
+import itertools
+import multiprocessing
+from multiprocessing.connection import wait
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache
+
+SHARDS = int(os.environ.get("BOT_SHARDS", 0))
+# Seconds between rebalances, 0 keeps the first partition
+REBALANCE_INTERVAL = int(os.environ.get("BOT_REBALANCE", 900))
+# Workers report room message counts this often
+VOLUME_INTERVAL = 60
+# Rebalance once the busiest shard is this far over the average
+TOLERANCE = 0.25
+# Rooms moved per rebalance, every move is a leave and a join
+MAX_MOVES = 3
+# An idle room still costs a connection, count it as this many msgs/minute
+ROOM_COST = 1.0
+# Restart delay doubles while a worker keeps dying young
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 60
+# Entries kept per shared cache
+SHARED_CACHE_SIZE = 4096
+# How long a worker waits on the supervisor before fetching itself
+REMOTE_TIMEOUT = 1.0
+
+
+def partition(rooms, shards, weights=None):
+    """Split rooms into shards lists, heaviest first onto the lightest shard"""
+    weights = weights or {}
+    bins = [[] for _ in range(shards)]
+    loads = [0.0] * shards
+    ordered = sorted(rooms, key=lambda room: -weights.get(room, ROOM_COST))
+    for room in ordered:
+        i = loads.index(min(loads))
+        bins[i].append(room)
+        loads[i] += weights.get(room, ROOM_COST)
+    return bins
+
+
+def plan_moves(assignment, weights, tolerance=TOLERANCE, max_moves=MAX_MOVES):
+    """
+    Rooms to move as (room, from shard, to shard)
+
+    Repeatedly moves the room off the busiest shard that best closes the gap
+    to the quietest one, so a balanced layout is left alone.
+    """
+    shards = {}
+    for room, shard in assignment.items():
+        shards.setdefault(shard, []).append(room)
+    loads = {
+        shard: sum(weights.get(room, ROOM_COST) for room in rooms)
+        for shard, rooms in shards.items()
+    }
+    if len(loads) < 2:
+        return []
+    average = sum(loads.values()) / len(loads)
+
+    moves = []
+    while len(moves) < max_moves:
+        busiest = max(loads, key=loads.get)
+        quietest = min(loads, key=loads.get)
+        gap = loads[busiest] - loads[quietest]
+        if loads[busiest] <= average * (1 + tolerance):
+            break
+        # Moving a room of weight w leaves a gap of |gap - 2w|, best near gap/2
+        room = min(
+            shards[busiest], key=lambda r: abs(gap - 2 * weights.get(r, ROOM_COST))
+        )
+        weight = weights.get(room, ROOM_COST)
+        # Not worth a leave and a join unless it closes a real part of the gap
+        if gap - abs(gap - 2 * weight) < average * tolerance:
+            break
+        shards[busiest].remove(room)
+        shards[quietest].append(room)
+        loads[busiest] -= weight
+        loads[quietest] += weight
+        moves.append((room, busiest, quietest))
+    return moves
+
+
+class Worker:
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.started = 0.0
+        self.restart_at = None
+        self.delay = RESTART_DELAY
+        self.restarts = 0
+
+
+class Supervisor:
+    """
+    Runs target(index, rooms, conn) in one forked process per shard
+
+    Single threaded, it blocks in multiprocessing's wait() on every worker
+    pipe and process sentinel and handles whatever is ready.
+    """
+
+    def __init__(self, rooms, shards, target, log=print):
+        self.target = target
+        self.log = log
+        self.context = multiprocessing.get_context("fork")
+        self.workers = [Worker(i) for i in range(max(1, min(shards, len(rooms))))]
+        self.assignment = {}
+        for i, shard_rooms in enumerate(partition(rooms, len(self.workers))):
+            for room in shard_rooms:
+                self.assignment[room] = i
+        # Messages per minute per room, smoothed over rebalances
+        self.weights = {}
+        self.counts = {}
+        self.last_rebalance = time.monotonic()
+        self.caches = {}
+
+    def rooms_of(self, index):
+        return sorted(room for room, i in self.assignment.items() if i == index)
+
+    def start(self, worker):
+        rooms = self.rooms_of(worker.index)
+        parent, child = self.context.Pipe()
+        worker.process = self.context.Process(
+            target=self._run_worker,
+            args=(worker.index, rooms, child),
+            name="lmaobot-{}".format(worker.index),
+            daemon=True,
+        )
+        worker.process.start()
+        child.close()
+        worker.conn = parent
+        worker.started = time.monotonic()
+        worker.restart_at = None
+        self.log(
+            "worker {} pid {} started with {}".format(
+                worker.index, worker.process.pid, " ".join(rooms)
+            )
+        )
+
+    def _run_worker(self, index, rooms, conn):
+        # Sibling pipes left open here would hide the supervisor exiting
+        for worker in self.workers:
+            if worker.conn is not None:
+                worker.conn.close()
+        self.target(index, rooms, conn)
+
+    def died(self, worker):
+        exitcode = worker.process.exitcode
+        worker.process.join()
+        worker.conn.close()
+        worker.process = None
+        worker.conn = None
+        # Dying soon after starting backs off, a long run resets the delay
+        if time.monotonic() - worker.started < MAX_RESTART_DELAY:
+            worker.delay = min(worker.delay * 2, MAX_RESTART_DELAY)
+        else:
+            worker.delay = RESTART_DELAY
+        worker.restart_at = time.monotonic() + worker.delay
+        worker.restarts += 1
+        self.log(
+            "worker {} exited with {}, restarting in {}s".format(
+                worker.index, exitcode, worker.delay
+            )
+        )
+
+    def send(self, worker, *message):
+        if worker.conn is None:
+            return
+        try:
+            worker.conn.send(message)
+        except OSError:
+            # Its sentinel fires next and it gets restarted
+            pass
+
+    def handle(self, worker, message):
+        kind = message[0]
+        if kind == "get":
+            _, request_id, name, key = message
+            store = self.caches.get(name)
+            self.send(worker, "cache", request_id, store and store.lookup(key))
+        elif kind == "put":
+            _, name, key, value, ttl = message
+            store = self.caches.get(name)
+            if store is None:
+                store = self.caches[name] = TTLCache(
+                    "shared " + name, maxsize=SHARED_CACHE_SIZE
+                )
+            store.set(key, value, ttl)
+        elif kind == "volume":
+            for room, count in message[1].items():
+                self.counts[room] = self.counts.get(room, 0) + count
+
+    def rebalance(self):
+        now = time.monotonic()
+        minutes = max((now - self.last_rebalance) / 60, 1 / 60)
+        self.last_rebalance = now
+        for room in self.assignment:
+            rate = self.counts.pop(room, 0) / minutes + ROOM_COST
+            old = self.weights.get(room)
+            self.weights[room] = rate if old is None else (old + rate) / 2
+        self.counts.clear()
+
+        # Moving rooms onto a worker that's restarting would lose them
+        if any(worker.process is None for worker in self.workers):
+            return
+        for room, source, dest in plan_moves(self.assignment, self.weights):
+            self.assignment[room] = dest
+            self.send(self.workers[source], "leave", room)
+            self.send(self.workers[dest], "join", room)
+            self.log(
+                "moved {} ({:.1f} msgs/min) from worker {} to {}".format(
+                    room, self.weights[room] - ROOM_COST, source, dest
+                )
+            )
+
+    def next_timeout(self):
+        deadlines = [w.restart_at for w in self.workers if w.restart_at is not None]
+        if REBALANCE_INTERVAL:
+            deadlines.append(self.last_rebalance + REBALANCE_INTERVAL)
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.monotonic())
+
+    def run(self):
+        # SIGTERM from docker stop unwinds through the finally below
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        for worker in self.workers:
+            self.start(worker)
+        try:
+            while True:
+                waiting = {}
+                for worker in self.workers:
+                    if worker.process is not None:
+                        waiting[worker.conn] = worker
+                        waiting[worker.process.sentinel] = worker
+                for ready in wait(list(waiting), self.next_timeout()):
+                    worker = waiting[ready]
+                    if worker.process is None:
+                        continue
+                    if ready is worker.conn:
+                        try:
+                            self.handle(worker, worker.conn.recv())
+                        except (EOFError, OSError):
+                            pass
+                    elif worker.process.exitcode is not None:
+                        self.died(worker)
+
+                now = time.monotonic()
+                for worker in self.workers:
+                    if worker.restart_at is not None and worker.restart_at <= now:
+                        self.start(worker)
+                if (
+                    REBALANCE_INTERVAL
+                    and now >= self.last_rebalance + REBALANCE_INTERVAL
+                ):
+                    self.rebalance()
+        finally:
+            self.stop()
+
+    def stop(self):
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(10)
+                if worker.process.is_alive():
+                    worker.process.kill()
+
+
+class Link:
+    """
+    A worker's end of the supervisor pipe
+
+    Messages from the supervisor are read on the event loop, sends go through
+    one writer thread so a large cache value never blocks the loop and the two
+    ends can't deadlock writing to each other.
+    """
+
+    def __init__(self, conn, index):
+        self.conn = conn
+        self.index = index
+        self.volume = {}
+        self.handlers = {}
+        self._pending = {}
+        self._ids = itertools.count()
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="supervisor")
+        self._loop = None
+        self.on_error = None
+
+    def attach(self, loop, on_error=None, **handlers):
+        """
+        Start reading on loop, handlers take join=, leave= coroutines and
+        on_error(e) hears about sends nobody waits on that failed
+        """
+        self._loop = loop
+        self.on_error = on_error
+        self.handlers = handlers
+        loop.add_reader(self.conn.fileno(), self._read)
+
+    def _read(self):
+        try:
+            message = self.conn.recv()
+        except (EOFError, OSError):
+            # Supervisor is gone, shut down the way docker stop does
+            self._loop.remove_reader(self.conn.fileno())
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+
+        kind = message[0]
+        if kind == "cache":
+            _, request_id, found = message
+            future = self._pending.pop(request_id, None)
+            if future is not None and not future.done():
+                future.set_result(found)
+        elif kind in self.handlers:
+            self._loop.create_task(self.handlers[kind](*message[1:]))
+
+    def send(self, *message):
+        return self._loop.run_in_executor(self._writer, self.conn.send, message)
+
+    def seen(self, room_name):
+        self.volume[room_name] = self.volume.get(room_name, 0) + 1
+
+    async def report_volume(self):
+        while True:
+            await asyncio.sleep(VOLUME_INTERVAL)
+            volume, self.volume = self.volume, {}
+            if volume:
+                await self.send("volume", volume)
+
+    async def cache_get(self, name, key):
+        """(seconds left, value) from the shared cache, None on a miss"""
+        request_id = next(self._ids)
+        future = self._loop.create_future()
+        self._pending[request_id] = future
+        try:
+            await self.send("get", request_id, name, key)
+            return await asyncio.wait_for(future, REMOTE_TIMEOUT)
+        finally:
+            self._pending.pop(request_id, None)
+
+    def cache_put(self, name, key, value, ttl):
+        self.send("put", name, key, value, ttl).add_done_callback(self._sent)
+
+    def _sent(self, future):
+        e = not future.cancelled() and future.exception()
+        if e and self.on_error is not None:
+            self.on_error(e)
@@ -0,0 +1,67 @@
+import os
+import asyncio
+
+
+class FileWatcher:
+    """
+    Polls a directory for changed files and runs their reload callbacks
+
+    Plain mtime polling, one scandir per interval, so it works the same on a
+    docker bind mount as on a local disk.
+    """
+
+    def __init__(self, directory, interval=2.0):
+        self.directory = directory
+        self.interval = interval
+        self._exact = {}
+        self._suffixes = []
+        self._mtimes = None
+
+    def watch(self, filename, callback):
+        """callback(filename) is awaited when that file changes"""
+        self._exact[filename] = callback
+
+    def watch_suffix(self, suffix, callback):
+        """callback(filename) is awaited for any changed file ending in suffix"""
+        self._suffixes.append((suffix, callback))
+
+    def _callback(self, filename):
+        if filename in self._exact:
+            return self._exact[filename]
+        for suffix, callback in self._suffixes:
+            if filename.endswith(suffix):
+                return callback
+        return None
+
+    def _scan(self):
+        mtimes = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if self._callback(entry.name) is not None:
+                    try:
+                        mtimes[entry.name] = entry.stat().st_mtime_ns
+                    except OSError:
+                        pass
+        return mtimes
+
+    async def check(self):
+        mtimes = await asyncio.to_thread(self._scan)
+        previous = self._mtimes
+        self._mtimes = mtimes
+        if previous is None:
+            return []
+
+        changed = [
+            name for name, mtime in mtimes.items() if previous.get(name) != mtime
+        ]
+        for name in changed:
+            await self._callback(name)(name)
+        return changed
+
+    async def run(self):
+        while True:
+            await self.check()
+            try:
+                await asyncio.sleep(self.interval)
+            except asyncio.exceptions.CancelledError:
+                break
@@ -1,15 +1,54 @@
 import os
-import requests
+import fetch
+import metrics
 import xml.etree.ElementTree as ET
-from urllib.parse import quote
+from cache import TTLCache
 
 WOLFRAM_API_KEY = os.environ.get("WOLFRAM_API_KEY")
-
-
-def wolfram_query_full(query, app_id=WOLFRAM_API_KEY):
+WOLFRAM_URL = "http://api.wolframalpha.com/v2/query"
+
+# Seconds Wolfram may spend, kept under our own request timeout so a slow
+# query comes back with what it has instead of nothing
+WOLFRAM_TIMEOUT = 12
+API_TIMEOUTS = {
+    "scantimeout": 3,
+    "podtimeout": 4,
+    "formattimeout": 4,
+    "totaltimeout": 10,
+}
+# Pods the answer never comes from, not worth sending
+EXCLUDE_PODS = [
+    "Input",
+    "Plot",
+    "Plots",
+    "NumberLine",
+    "VisualRepresentation",
+    "Illustration",
+]
+# Only answered from when no other pod is good, some words and names get
+# nothing else back
+LAST_RESORT_PODS = ["wikipedia summary", "web definitions", "alternate form"]
+
+# Answers can be about "now" (prices, weather, time), keep them short
+wolfram_cache = TTLCache("wolfram", maxsize=512, ttl=600, negative_ttl=600)
+
+
+class WolframError(Exception):
+    pass
+
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+
+@metrics.instrument("wolfram")
+async def wolfram_query_async(query, app_id=WOLFRAM_API_KEY):
     """
     Query Wolfram Alpha's full API and extract the most relevant text response.
 
+    The XML is parsed as it arrives and reading stops at the first good
+    "Result" pod, nothing later can beat it.
+
     Args:
         query (str): The question/query to ask Wolfram Alpha
         app_id (str): Your Wolfram Alpha App ID
@@ -17,36 +56,101 @@ def wolfram_query_full(query, app_id=WOLFRAM_API_KEY):
     Returns:
         str: Simplified text response extracted from XML
     """
-    # Encode the query for URL
-    encoded_query = quote(query)
+    params = [("appid", app_id or ""), ("input", query), ("format", "plaintext")]
+    params += [(name, seconds) for name, seconds in API_TIMEOUTS.items()]
+    params += [("excludepodid", pod_id) for pod_id in EXCLUDE_PODS]
+
+    async with fetch.stream(
+        "GET", WOLFRAM_URL, params=params, timeout=WOLFRAM_TIMEOUT
+    ) as response:
+        if response.status != 200:
+            raise WolframError(
+                f"Error: Unable to get response (status code: {response.status})"
+            )
+
+        answers = BestAnswer()
+        parser = ET.XMLPullParser(events=("start", "end"))
+        try:
+            async for chunk in response.content.iter_chunked(8192):
+                parser.feed(chunk)
+                for event, elem in parser.read_events():
+                    if event == "start":
+                        # Check if query was successful
+                        if elem.tag == "queryresult" and elem.get("success") != "true":
+                            return "wot?"
+                    elif elem.tag == "pod":
+                        if answers.add(elem):
+                            return answers.best()
+                        elem.clear()
+            parser.close()
+        except ET.ParseError:
+            return "uhh"
+
+    return answers.best() or "AI is not that advanced"
+
+
+# Priority order for pod titles (most useful first)
+priority_pods = [
+    "result",
+    "decimal approximation",
+    "exact result",
+    "solution",
+    "value",
+    "answer",
+    "simplified form",
+    "derivative",
+    "integral",
+    "population",
+    "current result",
+    "basic information",
+]
+
+
+class BestAnswer:
+    """
+    Picks the most relevant answer from pods as they're parsed
 
-    # Use the full API endpoint
-    url = f"http://api.wolframalpha.com/v2/query?appid={app_id}&input={encoded_query}&format=plaintext"
+    The first good pod for the highest priority title wins, otherwise the
+    first good pod that isn't input interpretation or other meta pods, and
+    failing that the first good LAST_RESORT_PODS pod.
+    """
 
-    response = requests.get(url, timeout=15)
+    def __init__(self):
+        self.priority = len(priority_pods)
+        self.answer = None
+        self.fallback = None
+        self.last_resort = None
 
-    if response.status_code != 200:
-        return (
-            f"Error: Unable to get response (status code: {response.status_code})"
+    def add(self, pod):
+        """Take a parsed pod, True once nothing later could be better"""
+        title = pod.get("title", "")
+        title_lower = title.lower()
+        priority = next(
+            (i for i, p in enumerate(priority_pods) if p in title_lower), None
         )
+        wanted = priority is not None and priority < self.priority
+        if not wanted and any(p in title_lower for p in LAST_RESORT_PODS):
+            if self.last_resort is None:
+                text = extract_pod_text(pod)
+                if text and is_good_answer(text):
+                    self.last_resort = f"{title}: {text}"
+            return False
+        if not wanted and (self.fallback or should_skip_pod(title)):
+            return False
 
-    # Parse the XML response
-    try:
-        root = ET.fromstring(response.content)
-    except ET.ParseError:
-        return "uhh"
-
-    # Check if query was successful
-    if root.get("success") != "true":
-        return "wot?"
+        text = extract_pod_text(pod)
+        if not (text and is_good_answer(text)):
+            return False
 
-    # Extract the best answer
-    best_answer = extract_best_answer(root)
+        if wanted:
+            self.priority = priority
+            self.answer = f"{title}: {text}"
+        elif not should_skip_pod(title):
+            self.fallback = f"{title}: {text}"
+        return self.priority == 0
 
-    if best_answer:
-        return best_answer
-    else:
-        return "AI is not that advanced"
+    def best(self):
+        return self.answer or self.fallback or self.last_resort
 
 
 def extract_best_answer(root):
@@ -59,50 +163,11 @@ def extract_best_answer(root):
     Returns:
         str: Best answer text or None if no good answer found
     """
-    answers = []
-
-    # Priority order for pod titles (most useful first)
-    priority_pods = [
-        "Result",
-        "Decimal approximation",
-        "Exact result",
-        "Solution",
-        "Value",
-        "Answer",
-        "Simplified form",
-        "Derivative",
-        "Integral",
-        "Population",
-        "Current result",
-        "Basic information",
-    ]
-
-    # Get all pods
-    pods = root.findall(".//pod")
-
-    # First, look for high-priority pods
-    for priority_title in priority_pods:
-        for pod in pods:
-            title = pod.get("title", "").lower()
-            if priority_title.lower() in title:
-                text = extract_pod_text(pod)
-                if text and is_good_answer(text):
-                    return f"{pod.get('title')}: {text}"
-
-    # If no priority pods found, look for any pod with useful content
-    for pod in pods:
-        title = pod.get("title", "")
-
-        # Skip input interpretation and other meta pods
-        if should_skip_pod(title):
-            continue
-
-        text = extract_pod_text(pod)
-        if text and is_good_answer(text):
-            answers.append(f"{title}: {text}")
-
-    # Return the first good answer we found
-    return answers[0] if answers else None
+    answers = BestAnswer()
+    for pod in root.iter("pod"):
+        if answers.add(pod):
+            break
+    return answers.best()
 
 
 def extract_pod_text(pod):
@@ -155,12 +220,16 @@ def is_good_answer(text):
     return not any(bad in text_lower for bad in bad_indicators)
 
 
-# Example usage with better formatting
-def chatbot_wolfram_query(query, app_id=WOLFRAM_API_KEY):
+async def chatbot_wolfram_query_async(query, app_id=WOLFRAM_API_KEY):
     """
     Wrapper function that returns a clean response for chatbot use.
     """
-    result = wolfram_query_full(query, app_id)
+    try:
+        result = await wolfram_cache.get_or_fetch(
+            normalize_query(query), lambda: wolfram_query_async(query, app_id)
+        )
+    except WolframError as e:
+        return str(e)
 
     # Clean up the response for better readability
     if result.startswith("Result:"):
@@ -171,3 +240,7 @@ def chatbot_wolfram_query(query, app_id=WOLFRAM_API_KEY):
     #     result = result[:497] + "..."
 
     return result
+
+
+def chatbot_wolfram_query(query, app_id=WOLFRAM_API_KEY):
+    return fetch.run_sync(chatbot_wolfram_query_async(query, app_id))